@@ -2,7 +2,9 @@ import logging
 logger = logging.getLogger(__name__).addHandler(logging.NullHandler())
 
 __all__ = [
+        'arbiter',
         'calibration',
+        'collector',
         'config',
         'constants',
         'controls',
@@ -10,13 +12,23 @@ __all__ = [
         'detectors',
         'devices',
         'devicetree',
+        'events',
+        'filters',
+        'health',
         'meters',
         'profiles',
+        'sampler',
+        'shm',
+        'state',
+        'stream',
+        'units',
         'virtuals',
 ]
 
 from .sensorkit import SensorKit
+from . import arbiter
 from . import calibration
+from . import collector
 from . import config
 from . import constants
 from . import controls
@@ -24,6 +36,14 @@ from . import datastructures
 from . import detectors
 from . import devices
 from . import devicetree
+from . import events
+from . import filters
+from . import health
 from . import meters
 from . import profiles
+from . import sampler
+from . import shm
+from . import state
+from . import stream
+from . import units
 from . import virtuals
@@ -0,0 +1,109 @@
+from collections import namedtuple
+from contextlib import contextmanager
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower is served first
+PRIORITY_INTERRUPT   = 0
+PRIORITY_CALIBRATION = 1
+PRIORITY_POLL        = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERRUPT: 'interrupt',
+    PRIORITY_CALIBRATION: 'calibration',
+    PRIORITY_POLL: 'poll',
+}
+
+WaitStats = namedtuple('WaitStats', 'count total max')
+
+_context = threading.local()
+
+@contextmanager
+def priority(level: int):
+    # sets the priority used by arbitrated bus access on this thread, e.g. a calibration
+    # reading its sources and writing its target
+    previous = getattr(_context, 'priority', None)
+    _context.priority = level
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+def current_priority() -> int:
+    level = getattr(_context, 'priority', None)
+    return PRIORITY_POLL if level is None else level
+
+class BusArbiter:
+    def __init__(self, name: str):
+        self._name = name
+        self._cond = threading.Condition()
+        self._waiting = list()
+        self._seq = itertools.count()
+        self._owner = None
+        self._depth = 0
+        self._stats = { level: [0, 0.0, 0.0] for level in PRIORITY_NAMES }
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @contextmanager
+    def access(self, level: Optional[int] = None):
+        self.acquire(level)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, level: Optional[int] = None) -> None:
+        # Waiters are served by priority class, then in arrival order. The owner may
+        # re-acquire, nested access by the same thread does not queue.
+        level = current_priority() if level is None else level
+        me = threading.get_ident()
+
+        with self._cond:
+            if self._owner == me:
+                self._depth = self._depth + 1
+                return
+
+            entry = (level, next(self._seq), me)
+            heapq.heappush(self._waiting, entry)
+            start = time.monotonic()
+            while self._owner is not None or self._waiting[0] is not entry:
+                self._cond.wait()
+
+            heapq.heappop(self._waiting)
+            self._owner = me
+            self._depth = 1
+
+            waited = time.monotonic() - start
+            stats = self._stats.setdefault(level, [0, 0.0, 0.0])
+            stats[0] = stats[0] + 1
+            stats[1] = stats[1] + waited
+            stats[2] = max(stats[2], waited)
+
+    def release(self) -> None:
+        with self._cond:
+            if self._owner != threading.get_ident():
+                raise RuntimeError('bus arbiter {} released by non-owner'.format(self._name))
+
+            self._depth = self._depth - 1
+            if self._depth == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def stats(self) -> dict[str, WaitStats]:
+        with self._cond:
+            return { PRIORITY_NAMES.get(level, str(level)): WaitStats(*values)
+                     for level, values in self._stats.items() }
+
+    @property
+    def waiting(self) -> int:
+        with self._cond:
+            return len(self._waiting)
@@ -1,88 +1,117 @@
-import builtins
+from datetime import datetime, timezone
 import logging
+import time
 
-from isodate import parse_duration
-
-from .datastructures import (
-        capabilities_selector,
-        deviceids_selector,
-        join_devices_meters,
-        join_virtuals,
-)
+from . import arbiter
+from .config import CalibrationPlan
+from .health import DeviceUnavailableError
+from .sampler import SAMPLE_OK, SAMPLE_REJECTED
 from .tools.mixins import SchedulableInterface
+from .units import conversion, meter_units
 
 logger = logging.getLogger(__name__)
 
 class Calibration(SchedulableInterface):
-    def __init__(self, target, conf_dict, target_obj, tree, scheduler):
+    def __init__(self, plan: CalibrationPlan, target_obj, tree, scheduler, state=None,
+                 sampler=None):
         self._last = None
         self._policy = None
-        self._policy_interval = None
         self._target_obj = None
         self._static = None
-        self._type = None
+        self._last_write = None
+        self._writes = 0
+        self._skipped = 0
+        self._rejected = 0
 
-        self._target = target
-        self._conf = conf_dict
+        self._plan = plan
+        self._device = target_obj
+        self._target = plan.target
         self._tree = tree
         self._scheduler = scheduler
         self._job = None
+        self._state = state
+        self._restored = False
+        self._sampler = sampler
 
-        if self._conf['target']['where'] == 'real':
+        if plan.where == 'real':
             self._target_obj = target_obj.real_device
-        elif self._conf['target']['where'] == 'abstract':
+        elif plan.where == 'abstract':
             self._target_obj = target_obj
         else:
             raise NotImplementedError
 
-        self._by_property = True if 'property' in self._conf['target'] else False
-        self._attribute = self._conf['target']['property'] if self._by_property is True \
-                else self._conf['target']['method']
+        self._by_property = plan.by_property
+        self._attribute = plan.attribute
+        self._type = plan.cast
+
+        chan = target_obj.channel_id if target_obj.has_channel is True else '-'
+        self._state_key = 'calibration:{}:{}:{}:{}'.format(self._target,
+                                                           hex(target_obj.address), chan,
+                                                           self._attribute)
 
-        measurement = self._conf['measurement']
-        field = capabilities_selector('id', capability=measurement)
-        if field.found is False:
-            raise ValueError('unsuppored capability {}'.format(measurement))
-        source = self._conf['source']
         self._sources = list()
-        if 'meter' in source:
-            children = join_devices_meters()
-            for meter in children.where(name=source['meter'].upper(), measurement=field.field):
-                self._sources.append(meter.meter_obj)
-
-        elif 'virtual' in source:
-            virtuals = join_virtuals()
-            for virtual in virtuals.where(name=source['virtual'], measurement=field.field):
+        if plan.source_kind == 'meter':
+            # through the tree links, join_devices_meters() fails once a rescan removed a
+            # device
+            for device in tree.registry.join_devices().where(name=plan.source):
+                for meter in tree.children(device.obj):
+                    if getattr(meter, 'measurement', None) == plan.measurement:
+                        self._sources.append(meter)
+
+        elif plan.source_kind == 'virtual':
+            virtuals = tree.registry.join_virtuals()
+            for virtual in virtuals.where(name=plan.source, measurement=plan.measurement):
                 self._sources.append(virtual.obj)
 
-        if self._conf['policy']['aggregation'] == 'average':
+        if plan.aggregation == 'average':
             self._policy = self._cast_measure(self._measure_average)
-        elif self._conf['policy']['aggregation'] == 'first':
+        elif plan.aggregation == 'first':
             self._policy = self._cast_measure(self._measure_first)
         else:
             raise NotImplementedError
 
-        if 'type' in self._conf['policy']:
-            self._type = self._conf['policy']['type']
+        self._policy_interval = 'oneshot' if plan.oneshot else plan.interval
 
-        self._policy_interval = 'oneshot' if self._conf['policy']['interval'] == 'oneshot' else \
-                parse_duration(self._conf['policy']['interval']).seconds
+        # source values are converted to the units the target takes
+        self._units = plan.units
+
+        # write suppression: changes within either deadband, or arriving sooner than
+        # min_interval after the previous write, are counted but not written to the target
+        self._deadband = plan.deadband
+        self._relative_deadband = plan.relative_deadband
+        self._min_interval = plan.min_interval
 
         logger.debug('config: interval %s policy %s object %s',
                      self._policy_interval, self._policy, self._target_obj)
 
     def schedule(self, immediate: bool) -> None:
+        restored = self._restore()
+
         if self._policy_interval == 'oneshot':
             self._job = 'finished'
-            self.calibrate()
+            if restored is None:
+                self.calibrate()
+            elif self._is_stale(restored):
+                # refresh from the sources off the startup path
+                self._scheduler.add_job(self.calibrate)
             return
         elif self._job is not None:
             return
 
-        if immediate:
-            self.calibrate()
-        self._job = self._scheduler.add_job(self.calibrate, 'interval',
-                                            seconds=self._policy_interval)
+        next_run_time = None
+        if restored is None:
+            if immediate:
+                self.calibrate()
+        elif self._is_stale(restored):
+            next_run_time = datetime.now(timezone.utc)
+
+        if next_run_time is not None:
+            self._job = self._scheduler.add_job(self.calibrate, 'interval',
+                                                seconds=self._policy_interval,
+                                                next_run_time=next_run_time)
+        else:
+            self._job = self._scheduler.add_job(self.calibrate, 'interval',
+                                                seconds=self._policy_interval)
 
     def unschedule(self):
         if self._job is None or self._job == 'finished':
@@ -95,49 +124,167 @@ class Calibration(SchedulableInterface):
     def static(self):
         return self._static
 
+    @property
+    def plan(self) -> CalibrationPlan:
+        return self._plan
+
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def sources(self) -> list:
+        return self._sources
+
+    @property
+    def writes(self) -> int:
+        return self._writes
+
+    @property
+    def skipped(self) -> int:
+        return self._skipped
+
+    @property
+    def rejected(self) -> int:
+        # rounds skipped because no source had a usable value, rejected or unavailable
+        return self._rejected
+
     def _cast_measure(self, func: callable):
+        if self._type is None:
+            return func
+
+        cast = self._type
         def __cast():
-            v = func()
-            v = v if self._type is None else getattr(builtins, self._type)(v)
-            return v
+            value = func()
+            return None if value is None else cast(value)
         return __cast
 
+    def _convert(self, source, value):
+        if self._units is None or value is None:
+            return value
+        units = meter_units(source)
+        if units is None or units == self._units:
+            return value
+        return conversion(units, self._units)(value)
+
+    def _read(self, source):
+        # a filtered source is taken from its latest sample so a rejected spike never reaches
+        # the target, None when that sample was rejected or the source is unavailable
+        filtered = self._sampler is not None and source.node_id in self._sampler.filters
+        if filtered:
+            sample = self._sampler.latest(source.node_id)
+            if sample is not None:
+                if sample.status == SAMPLE_REJECTED:
+                    return None
+                if sample.status == SAMPLE_OK:
+                    return self._convert(source, sample.value)
+        try:
+            return self._convert(source, source.measure)
+        except DeviceUnavailableError as e:
+            # the source's breaker is open, leave it out rather than fail the round
+            logger.debug('calibration source unavailable, %s', e)
+            return None
+
     def _measure_average(self):
-        l = len(self._sources)
-        v = 0
-        for s in self._sources:
-            v = v + s.measure
-        v = v / l
-        return v
+        values = [ v for v in (self._read(s) for s in self._sources) if v is not None ]
+        if len(values) == 0:
+            return None
+        return sum(values) / len(values)
 
     def _measure_first(self):
-        s = self._sources[0]
-        return s.measure
+        return self._read(self._sources[0])
 
     def _measure_specific(self):
         raise NotImplementedError
 
-    def _setter(self, value):
-        _value = value if self._type is None else getattr(builtins, self._type)(value)
-        if self._by_property:
-            setattr(self._target_obj, self._attribute, _value)
-        else:
-            func = getattr(self._target_obj, self._attribute)
-            func(_value)
+    def _write(self, value):
+        _value = value if self._type is None else self._type(value)
+        with self._device.access(arbiter.PRIORITY_CALIBRATION):
+            if self._by_property:
+                setattr(self._target_obj, self._attribute, _value)
+            else:
+                func = getattr(self._target_obj, self._attribute)
+                func(_value)
         self._last = _value
+        return _value
+
+    def _setter(self, value, persist: bool = True):
+        _value = self._write(value)
+        self._last_write = time.monotonic()
+        self._writes = self._writes + 1
+
+        if persist and self._state is not None:
+            self._state.set(self._state_key, _value)
+
+    def _restore(self):
+        if self._state is None or self._restored is True:
+            return None
+        self._restored = True
+
+        entry = self._state.get(self._state_key)
+        if entry is None:
+            return None
+
+        logger.info('restoring %s to %s.%s from saved state', entry.value, self._target,
+                    self._attribute)
+        # not counted as a write, min_interval must not hold back the refresh of a stale value
+        try:
+            self._write(entry.value)
+        except Exception as e:
+            logger.warning('unable to restore saved value for %s: %s', self._state_key, e)
+            return None
+        return entry
+
+    def _is_stale(self, entry) -> bool:
+        age = time.time() - entry.timestamp
+        if self._policy_interval == 'oneshot':
+            return self._state.max_age is not None and age >= self._state.max_age
+        return age >= self._policy_interval
+
+    def _should_write(self, value) -> bool:
+        if self._last is None:
+            return True
+        if self._last == value:
+            return False
+
+        delta = abs(value - self._last)
+        if delta <= self._deadband:
+            logger.debug('change %s within deadband %s', delta, self._deadband)
+            return False
+        if self._last != 0 and delta / abs(self._last) <= self._relative_deadband:
+            logger.debug('change %s within relative deadband %s', delta,
+                         self._relative_deadband)
+            return False
+        if self._last_write is not None and \
+                time.monotonic() - self._last_write < self._min_interval:
+            logger.debug('change %s inside min interval %s', delta, self._min_interval)
+            return False
+
+        return True
 
     def calibrate(self):
+        with arbiter.priority(arbiter.PRIORITY_CALIBRATION):
+            self._calibrate()
+
+    def _calibrate(self):
         logger.debug('Calibration.calibrate source %s setting %s for %s',
-                     self._conf['source'], self._attribute,
+                     self._plan.source, self._attribute,
                      self._target)
         value = self._policy()
-        if self._last is None or self._last != value:
+        if value is None:
+            self._rejected = self._rejected + 1
+            logger.info('no usable %s value, %s left as is', self._plan.source,
+                        self._attribute)
+            return
+        if self._should_write(value):
             logger.info('found change from %s to %s', self._last, value)
             logger.debug('will pull new value %s from %s.measure', value,
-                         self._conf['source'])
+                         self._plan.source)
             logger.debug('will set value %s to %s.%s with %s device', value, self._target,
-                         self._attribute, self._conf['target']['where'])
+                         self._attribute, self._plan.where)
 
             self._setter(value)
         else:
-            logger.debug('no changes in %s', self._attribute)
+            self._skipped = self._skipped + 1
+            logger.debug('no changes written to %s (%s skipped, %s written)', self._attribute,
+                         self._skipped, self._writes)
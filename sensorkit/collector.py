@@ -0,0 +1,407 @@
+from collections import deque, OrderedDict
+import logging
+import math
+import select
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Any, Optional
+
+from .datastructures import capabilities_selector
+from .sampler import Sample
+from .tools.mixins import RunnableInterface
+
+logger = logging.getLogger(__name__)
+
+# Wire format, every message is a 4 byte big endian length followed by the payload:
+#
+#   b'H' node name                       hello, first message of every connection
+#   b'K' (u16 key id, u16 len, path)*    key ids of device paths, sent before first use
+#   b'B' (u16 key id, f64 value, f64 timestamp, u8 status)*
+#                                        batch of samples, NaN value for None
+#
+# Key ids are per connection, a reconnecting node says hello and resends its keys.
+MSG_HELLO = b'H'
+MSG_KEYS = b'K'
+MSG_BATCH = b'B'
+
+_LENGTH = struct.Struct('>I')
+_KEY = struct.Struct('>HH')
+_RECORD = struct.Struct('>HddB')
+
+MAX_MESSAGE = 1 << 20
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_BUFFER = 10000
+DEFAULT_ALIGN = 1.0
+DEFAULT_HISTORY = 300
+
+def meter_path(meter: Any, bus: int | None) -> str:
+    # root bus, mux hops, then device and measurement, e.g.
+    # bus0/0x70.1/0x71.2/BMP390@0x77/pressure, virtual meters have no bus or hops
+    device = getattr(meter, 'device', None)
+    hops = getattr(device, 'channel_path', ())
+    parts = [ 'bus{}'.format(bus) if bus is not None else 'virtual' ]
+    parts.extend('{}.{}'.format(hex(addr) if addr is not None else '-', chan)
+                 for addr, chan in hops)
+    parts.append('{}@{}'.format(meter.name, hex(meter.address)))
+    measurement = capabilities_selector('capability', id=meter.measurement)
+    parts.append(measurement.field if measurement.found else str(meter.measurement))
+    return '/'.join(parts)
+
+def parse_address(address: str) -> tuple[int, Any]:
+    # 'host:port' for TCP, anything else is a unix socket path
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+def _message(kind: bytes, payload: bytes) -> bytes:
+    return _LENGTH.pack(len(payload) + 1) + kind + payload
+
+class CollectorClient(RunnableInterface):
+    # Sampler listener pushing the kit's frames to a collector in batches. Samples wait in a
+    # bounded buffer, when the collector is slow or away the oldest are dropped and counted.
+    def __init__(self, node: str, address: str, tree,
+                 interval: float = DEFAULT_FLUSH_INTERVAL, buffer: int = DEFAULT_BUFFER,
+                 timeout: float = 5.0):
+        self._node = node
+        self._address = address
+        self._tree = tree
+        self._interval = interval
+        self._timeout = timeout
+        self._buffer = deque(maxlen=buffer)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+
+        self._paths = dict()
+        self._sock = None
+        self._keys = dict()
+        self._retry_at = 0.0
+        self._failures = 0
+        self._dropped = 0
+        self._sent = 0
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    @property
+    def sent(self) -> int:
+        return self._sent
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def __call__(self, frame: dict[int, Sample]) -> None:
+        with self._lock:
+            for node_id, sample in frame.items():
+                if len(self._buffer) == self._buffer.maxlen:
+                    self._dropped = self._dropped + 1
+                self._buffer.append((node_id, sample))
+
+    def run(self) -> None:
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name='sensorkit-collector',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._disconnect()
+
+    def flush(self) -> bool:
+        # sends everything buffered, returns False when the collector could not be reached
+        with self._lock:
+            pending = list(self._buffer)
+            self._buffer.clear()
+        if len(pending) == 0:
+            return True
+
+        if self._sock is not None and not self._alive():
+            logger.info('collector %s closed the connection, reconnecting', self._address)
+            self._disconnect()
+        if self._sock is None and not self._connect():
+            self._requeue(pending)
+            return False
+
+        try:
+            self._send(pending)
+        except OSError as e:
+            logger.warning('collector %s send failed, %s', self._address, e)
+            self._disconnect()
+            self._backoff()
+            self._requeue(pending)
+            return False
+
+        self._sent = self._sent + len(pending)
+        return True
+
+    def _loop(self) -> None:
+        while self._running:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def _requeue(self, pending: list[tuple[int, Sample]]) -> None:
+        with self._lock:
+            room = self._buffer.maxlen - len(self._buffer)
+            if room < len(pending):
+                self._dropped = self._dropped + len(pending) - room
+                pending = pending[len(pending) - room:]
+            self._buffer.extendleft(reversed(pending))
+
+    def _connect(self) -> bool:
+        if time.monotonic() < self._retry_at:
+            return False
+
+        family, addr = parse_address(self._address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        try:
+            sock.connect(addr)
+            sock.sendall(_message(MSG_HELLO, self._node.encode()))
+        except OSError as e:
+            sock.close()
+            logger.warning('collector %s unreachable, %s', self._address, e)
+            self._backoff()
+            return False
+
+        logger.info('connected to collector %s', self._address)
+        self._sock = sock
+        self._keys = dict()
+        self._failures = 0
+        return True
+
+    def _alive(self) -> bool:
+        # the collector never sends, a readable socket means it closed or reset the connection
+        try:
+            readable, _, _ = select.select([ self._sock ], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return len(readable) == 0
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _backoff(self) -> None:
+        self._failures = self._failures + 1
+        delay = min(self._interval * 2 ** (self._failures - 1), 300.0)
+        self._retry_at = time.monotonic() + delay
+
+    def _path(self, node_id: int) -> str | None:
+        path = self._paths.get(node_id)
+        if path is None:
+            for node in self._tree.registry.nodes.where(node_id=node_id):
+                path = meter_path(node.obj, node.bus)
+                self._paths[node_id] = path
+        return path
+
+    def _send(self, pending: list[tuple[int, Sample]]) -> None:
+        new_keys = list()
+        records = list()
+        for node_id, sample in pending:
+            path = self._path(node_id)
+            if path is None:
+                continue
+            key = self._keys.get(path)
+            if key is None:
+                key = len(self._keys)
+                self._keys[path] = key
+                new_keys.append((key, path))
+            value = sample.value if isinstance(sample.value, (int, float)) else math.nan
+            records.append(_RECORD.pack(key, float(value), sample.timestamp, sample.status))
+
+        out = list()
+        if len(new_keys) > 0:
+            out.append(_message(MSG_KEYS, b''.join(_KEY.pack(k, len(p.encode())) + p.encode()
+                                                   for k, p in new_keys)))
+        # batches are split to stay under the message limit
+        per_message = (MAX_MESSAGE - 1) // _RECORD.size
+        for i in range(0, len(records), per_message):
+            out.append(_message(MSG_BATCH, b''.join(records[i:i + per_message])))
+        self._sock.sendall(b''.join(out))
+
+class _CollectorHandler(socketserver.BaseRequestHandler):
+    def setup(self) -> None:
+        self.server.collector._opened(self.request)
+
+    def finish(self) -> None:
+        self.server.collector._closed(self.request)
+
+    def handle(self) -> None:
+        collector = self.server.collector
+        node = None
+        keys = dict()
+        while True:
+            header = self._read(_LENGTH.size)
+            if header is None:
+                break
+            length = _LENGTH.unpack(header)[0]
+            if length == 0 or length > MAX_MESSAGE:
+                logger.warning('collector: bad message length %s from %s', length, node)
+                break
+            payload = self._read(length)
+            if payload is None:
+                break
+
+            kind, body = payload[:1], payload[1:]
+            if kind == MSG_HELLO:
+                node = body.decode()
+                keys = dict()
+            elif node is None:
+                logger.warning('collector: message before hello, closing')
+                break
+            elif kind == MSG_KEYS:
+                offset = 0
+                while offset < len(body):
+                    key, size = _KEY.unpack_from(body, offset)
+                    offset = offset + _KEY.size
+                    keys[key] = body[offset:offset + size].decode()
+                    offset = offset + size
+            elif kind == MSG_BATCH:
+                samples = list()
+                for key, value, timestamp, status in _RECORD.iter_unpack(body):
+                    if key in keys:
+                        samples.append((keys[key], Sample(None if math.isnan(value) else value,
+                                                          timestamp, status)))
+                collector._merge(node, samples)
+
+    def _read(self, size: int) -> bytes | None:
+        chunks = list()
+        while size > 0:
+            chunk = self.request.recv(min(size, 65536))
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size = size - len(chunk)
+        return b''.join(chunks)
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+class Collector:
+    # Receives batches from many kits and merges them into one view keyed by (node, path).
+    # Samples are also aligned to buckets of align seconds, the last history buckets are kept.
+    def __init__(self, address: str, align: float = DEFAULT_ALIGN,
+                 history: int = DEFAULT_HISTORY):
+        self._address = address
+        self._align = align
+        self._history = history
+        self._lock = threading.Lock()
+        self._latest = dict()
+        self._buckets = OrderedDict()
+        self._received = 0
+        self._server = None
+        self._thread = None
+        self._connections = set()
+
+    @property
+    def address(self) -> str:
+        # with port 0 the bound port is filled in once started
+        if self._server is not None and self._server.address_family == socket.AF_INET:
+            host, port = self._server.server_address[:2]
+            return '{}:{}'.format(host, port)
+        return self._address
+
+    @property
+    def received(self) -> int:
+        return self._received
+
+    def start(self) -> None:
+        if self._server is not None:
+            return
+        family, addr = parse_address(self._address)
+        server_cls = _TCPServer if family == socket.AF_INET else _UnixServer
+        self._server = server_cls(addr, _CollectorHandler)
+        self._server.collector = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='sensorkit-collector-server', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._server = None
+        self._thread = None
+
+    def latest(self) -> dict[tuple[str, str], Sample]:
+        with self._lock:
+            return dict(self._latest)
+
+    def buckets(self) -> list[float]:
+        with self._lock:
+            return list(self._buckets)
+
+    def aligned(self, bucket: Optional[float] = None) -> dict[tuple[str, str], Sample]:
+        # the samples of one bucket, the newest sample per key, by default the newest bucket
+        with self._lock:
+            if len(self._buckets) == 0:
+                return dict()
+            if bucket is None:
+                bucket = next(reversed(self._buckets))
+            return dict(self._buckets.get(bucket, {}))
+
+    @property
+    def connections(self) -> int:
+        with self._lock:
+            return len(self._connections)
+
+    def _opened(self, conn) -> None:
+        with self._lock:
+            self._connections.add(conn)
+
+    def _closed(self, conn) -> None:
+        with self._lock:
+            self._connections.discard(conn)
+
+    def _merge(self, node: str, samples: list[tuple[str, Sample]]) -> None:
+        with self._lock:
+            for path, sample in samples:
+                key = (node, path)
+                current = self._latest.get(key)
+                if current is None or current.timestamp <= sample.timestamp:
+                    self._latest[key] = sample
+
+                bucket = math.floor(sample.timestamp / self._align) * self._align
+                slot = self._buckets.get(bucket)
+                if slot is None:
+                    slot = self._buckets[bucket] = dict()
+                    if len(self._buckets) > self._history:
+                        # buckets arrive roughly in order, drop the oldest
+                        oldest = min(self._buckets)
+                        del self._buckets[oldest]
+                        if oldest == bucket:
+                            continue
+                    self._buckets = OrderedDict(sorted(self._buckets.items()))
+                slot[key] = sample
+            self._received = self._received + len(samples)
@@ -1,11 +1,413 @@
-from typing import Any
+import builtins
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Optional
 import logging
 import os.path
+import socket
 
+from isodate import ISO8601Error, parse_duration
 import yaml
 
+from .datastructures import (
+        capabilities_selector,
+        deviceids_selector,
+        devicetypes_selector,
+        unitsaliases_selector,
+)
+
 logger = logging.getLogger(__name__)
 
+class ConfigError(ValueError):
+    """Raised when a configuration fails validation."""
+
+SENSOR_SELECTORS = ('name', 'address', 'channel_id', 'device_id')
+CALIBRATION_WHERE = ('real', 'abstract')
+CALIBRATION_AGGREGATIONS = ('average', 'first')
+
+@dataclass(frozen=True)
+class ParameterPlan:
+    property: str
+    value: Any
+
+@dataclass(frozen=True)
+class SensorPlan:
+    selectors: Mapping[str, Any]
+    parameters: tuple[ParameterPlan, ...]
+    reset_at_exit: bool
+
+@dataclass(frozen=True)
+class VirtualPlan:
+    name: str
+    kind: int
+    module: str
+    builder: str
+    capabilities: tuple[str, ...]
+    args: Mapping[str, Any]
+
+@dataclass(frozen=True)
+class CalibrationPlan:
+    target: str
+    device_name: str
+    measurement: int
+    where: str
+    by_property: bool
+    attribute: str
+    source_kind: str
+    source: str
+    aggregation: str
+    cast: Optional[Callable[[Any], Any]]
+    interval: Optional[float]
+    deadband: float
+    relative_deadband: float
+    min_interval: float
+    # units id the target takes, source values in other units are converted to it
+    units: Optional[str] = None
+
+    @property
+    def oneshot(self) -> bool:
+        return self.interval is None
+
+@dataclass(frozen=True)
+class StatePlan:
+    path: Optional[str]
+    max_age: Optional[float]
+
+@dataclass(frozen=True)
+class FilterPlan:
+    device_name: str
+    measurement: int
+    # Hampel test over the last window samples, disabled with a window of 0
+    window: int
+    threshold: float
+    min_deviation: float
+    # largest plausible change per second, None when unlimited
+    max_rate: Optional[float]
+    # explicit range limits, else the capability's when physical_range is set
+    low: Optional[float]
+    high: Optional[float]
+    physical_range: bool
+
+@dataclass(frozen=True)
+class AdaptivePlan:
+    measurement: int
+    # seconds between samples, stretched by factor while the value stays within deadband
+    min_interval: float
+    max_interval: float
+    deadband: float
+    factor: float
+
+@dataclass(frozen=True)
+class SamplerPlan:
+    interval: Optional[float]
+    shared_memory: Optional[str] = None
+    filters: tuple[FilterPlan, ...] = ()
+    adaptive: tuple[AdaptivePlan, ...] = ()
+
+@dataclass(frozen=True)
+class CollectorPlan:
+    address: str
+    node: str
+    interval: float
+    buffer: int
+
+@dataclass(frozen=True)
+class StreamPlan:
+    address: str
+    queue: int
+
+@dataclass(frozen=True)
+class HealthPlan:
+    # consecutive failed reads opening a device's circuit breaker, and the seconds before
+    # the first probe, doubled after every failed probe up to max_backoff
+    threshold: int = 3
+    backoff: float = 5.0
+    max_backoff: float = 600.0
+
+@dataclass(frozen=True)
+class ConfigPlan:
+    env: Mapping[str, Any]
+    state: StatePlan
+    sensors: tuple[SensorPlan, ...]
+    virtual_devices: Mapping[str, VirtualPlan]
+    calibrations: tuple[CalibrationPlan, ...]
+    presence_check: Optional[float]
+    sampler: SamplerPlan
+    collector: Optional[CollectorPlan] = None
+    stream: Optional[StreamPlan] = None
+    health: HealthPlan = HealthPlan()
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return MappingProxyType({ k: freeze(v) for k, v in value.items() })
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+def thaw(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return { k: thaw(v) for k, v in value.items() }
+    if isinstance(value, tuple):
+        return [ thaw(v) for v in value ]
+    return value
+
+def _duration(value: Any, where: str) -> float:
+    try:
+        return parse_duration(value).total_seconds()
+    except (ISO8601Error, TypeError, ValueError) as e:
+        raise ConfigError('{}: invalid duration {!r} - {}'.format(where, value, e))
+
+def _number(value: Any, where: str) -> float:
+    try:
+        return abs(float(value))
+    except (TypeError, ValueError):
+        raise ConfigError('{}: expected a number, got {!r}'.format(where, value))
+
+def _require(conf: Any, key: str, where: str) -> Any:
+    if not isinstance(conf, Mapping) or key not in conf:
+        raise ConfigError('{}: missing required key {!r}'.format(where, key))
+    return conf[key]
+
+def compile_sensor(sensor: Mapping[str, Any]) -> SensorPlan:
+    where = 'sensors'
+    selectors = _require(sensor, 'selectors', where)
+    if not isinstance(selectors, Mapping) or len(selectors) == 0:
+        raise ConfigError('{}: selectors cannot be empty'.format(where))
+
+    compiled = dict()
+    for key, value in selectors.items():
+        if key not in SENSOR_SELECTORS:
+            raise ConfigError('{}: unsupported selector {!r}'.format(where, key))
+        compiled[key] = value
+
+    if 'name' in compiled:
+        compiled['name'] = str(compiled['name']).upper()
+        if deviceids_selector('id', device_name=compiled['name']).found is False:
+            raise ConfigError('{}: unknown device name {!r}'.format(where, selectors['name']))
+    if 'channel_id' in compiled:
+        compiled['has_channel'] = True
+
+    parameters = list()
+    for param in sensor.get('parameters') or []:
+        parameters.append(ParameterPlan(_require(param, 'property', where),
+                                        _require(param, 'value', where)))
+
+    return SensorPlan(MappingProxyType(compiled), tuple(parameters),
+                      sensor.get('reset_at_exit') is True)
+
+def compile_virtual(name: str, conf: Mapping[str, Any]) -> VirtualPlan:
+    where = 'virtual-devices.{}'.format(name)
+    kind = _require(conf, 'type', where)
+    field = devicetypes_selector('type', device=kind)
+    if field.found is False:
+        raise ConfigError('{}: unknown device type {!r}'.format(where, kind))
+
+    capabilities = tuple(_require(conf, 'capabilities', where))
+    for cap in capabilities:
+        if capabilities_selector('id', capability=cap).found is False:
+            raise ConfigError('{}: unsupported capability {!r}'.format(where, cap))
+
+    return VirtualPlan(name, field.field, _require(conf, 'module', where),
+                       _require(conf, 'builder', where), capabilities,
+                       freeze(conf.get('args') or {}))
+
+def compile_calibration(target: str, conf: Mapping[str, Any],
+                        virtual_devices: Optional[Mapping[str, Any]] = None) -> CalibrationPlan:
+    where = 'calibrations.{}'.format(target)
+    device_name = target.upper()
+    if deviceids_selector('id', device_name=device_name).found is False:
+        raise ConfigError('{}: unknown device name {!r}'.format(where, target))
+
+    measurement = _require(conf, 'measurement', where)
+    field = capabilities_selector('id', capability=measurement)
+    if field.found is False:
+        raise ConfigError('{}: unsupported capability {!r}'.format(where, measurement))
+
+    target_conf = _require(conf, 'target', where)
+    target_where = _require(target_conf, 'where', where + '.target')
+    if target_where not in CALIBRATION_WHERE:
+        raise ConfigError('{}: target where must be one of {}'.format(where, CALIBRATION_WHERE))
+    if ('property' in target_conf) == ('method' in target_conf):
+        raise ConfigError('{}: target needs exactly one of property or method'.format(where))
+    by_property = 'property' in target_conf
+    attribute = target_conf['property'] if by_property else target_conf['method']
+
+    units = capabilities_selector('units', capability=measurement).field or None
+    if 'units' in target_conf:
+        field = unitsaliases_selector('units', alias=str(target_conf['units']))
+        if field.found is False:
+            raise ConfigError('{}: unknown target units {!r}'.format(where, target_conf['units']))
+        units = field.field
+
+    source_conf = _require(conf, 'source', where)
+    if ('meter' in source_conf) == ('virtual' in source_conf):
+        raise ConfigError('{}: source needs exactly one of meter or virtual'.format(where))
+    source_kind = 'meter' if 'meter' in source_conf else 'virtual'
+    source = source_conf[source_kind]
+    if source_kind == 'meter':
+        source = str(source).upper()
+        if deviceids_selector('id', device_name=source).found is False:
+            raise ConfigError('{}: unknown source meter {!r}'.format(where, source_conf['meter']))
+    elif virtual_devices is not None and source not in virtual_devices:
+        raise ConfigError('{}: unknown source virtual device {!r}'.format(where, source))
+
+    policy = _require(conf, 'policy', where)
+    aggregation = _require(policy, 'aggregation', where + '.policy')
+    if aggregation not in CALIBRATION_AGGREGATIONS:
+        raise ConfigError('{}: unsupported aggregation {!r}'.format(where, aggregation))
+
+    cast = None
+    if 'type' in policy:
+        cast = getattr(builtins, str(policy['type']), None)
+        if not isinstance(cast, type):
+            raise ConfigError('{}: unsupported type {!r}'.format(where, policy['type']))
+
+    interval = _require(policy, 'interval', where + '.policy')
+    interval = None if interval == 'oneshot' else _duration(interval, where + '.policy.interval')
+    if interval is not None and interval <= 0:
+        raise ConfigError('{}: interval must be positive'.format(where))
+
+    return CalibrationPlan(
+            target=target,
+            device_name=device_name,
+            measurement=field.field,
+            where=target_where,
+            by_property=by_property,
+            attribute=attribute,
+            source_kind=source_kind,
+            source=source,
+            aggregation=aggregation,
+            cast=cast,
+            interval=interval,
+            deadband=_number(policy.get('deadband', 0), where + '.policy.deadband'),
+            relative_deadband=_number(policy.get('relative_deadband', 0),
+                                      where + '.policy.relative_deadband'),
+            min_interval=_duration(policy['min_interval'], where + '.policy.min_interval') \
+                    if 'min_interval' in policy else 0.0,
+            units=units)
+
+def compile_filter(conf: Mapping[str, Any]) -> FilterPlan:
+    where = 'sampler.filters'
+    device_name = str(_require(conf, 'meter', where)).upper()
+    if deviceids_selector('id', device_name=device_name).found is False:
+        raise ConfigError('{}: unknown meter {!r}'.format(where, conf['meter']))
+
+    measurement = _require(conf, 'measurement', where)
+    field = capabilities_selector('id', capability=measurement)
+    if field.found is False:
+        raise ConfigError('{}: unsupported capability {!r}'.format(where, measurement))
+
+    hampel = conf.get('hampel', {})
+    if not isinstance(hampel, Mapping):
+        raise ConfigError('{}: hampel takes window, threshold and min-deviation'.format(where))
+    window = int(_number(hampel.get('window', 0), where + '.hampel.window'))
+    threshold = _number(hampel.get('threshold', 3), where + '.hampel.threshold')
+    min_deviation = _number(hampel.get('min-deviation', 0), where + '.hampel.min-deviation')
+
+    max_rate = conf.get('max-rate')
+    if max_rate is not None:
+        max_rate = _number(max_rate, where + '.max-rate')
+
+    # range: true (default) for the capability's limits, false for none, or [low, high]
+    low, high, physical_range = None, None, True
+    limits = conf.get('range', True)
+    if isinstance(limits, bool):
+        physical_range = limits
+    elif isinstance(limits, (list, tuple)) and len(limits) == 2:
+        try:
+            low, high = (None if v is None else float(v) for v in limits)
+        except (TypeError, ValueError):
+            raise ConfigError('{}: invalid range {!r}'.format(where, limits))
+    else:
+        raise ConfigError('{}: range must be true, false or [low, high]'.format(where))
+
+    return FilterPlan(device_name, field.field, window, threshold, min_deviation, max_rate,
+                      low, high, physical_range)
+
+def compile_adaptive(capability: str, conf: Mapping[str, Any],
+                     interval: Optional[float]) -> AdaptivePlan:
+    where = 'sampler.adaptive.{}'.format(capability)
+    if interval is None:
+        raise ConfigError('{}: adaptive sampling needs sampler.interval'.format(where))
+    field = capabilities_selector('id', capability=capability)
+    if field.found is False:
+        raise ConfigError('{}: unsupported capability {!r}'.format(where, capability))
+
+    min_interval = _duration(conf['min'], where + '.min') if 'min' in conf else interval
+    max_interval = _duration(_require(conf, 'max', where), where + '.max')
+    if min_interval <= 0 or max_interval < min_interval:
+        raise ConfigError('{}: need 0 < min <= max'.format(where))
+    factor = _number(conf.get('factor', 2), where + '.factor')
+    if factor <= 1:
+        raise ConfigError('{}: factor must be greater than 1'.format(where))
+
+    return AdaptivePlan(field.field, min_interval, max_interval,
+                        _number(_require(conf, 'deadband', where), where + '.deadband'), factor)
+
+def compile_config(config: 'Config') -> ConfigPlan:
+    state = config.state
+    state_plan = StatePlan(state.get('path'),
+                           _duration(state['max-age'], 'state.max-age') \
+                                   if 'max-age' in state else None)
+
+    sensors = tuple(compile_sensor(sensor) for sensor in config.sensors)
+
+    virtual_devices = config.virtual_devices
+    virtuals = MappingProxyType({ name: compile_virtual(name, virtual_devices[name])
+                                  for name in virtual_devices })
+
+    calibrations = list()
+    for target in config.calibrations:
+        for conf in config.calibrations[target]:
+            calibrations.append(compile_calibration(target, conf, virtual_devices))
+
+    presence_check = config.presence_check
+    if presence_check is not None:
+        presence_check = _duration(presence_check, 'presence-check')
+
+    sampler = config.sampler
+    interval = sampler.get('interval')
+    if interval is not None:
+        interval = _duration(interval, 'sampler.interval')
+        if interval <= 0:
+            raise ConfigError('sampler.interval: interval must be positive')
+    filters = tuple(compile_filter(conf) for conf in sampler.get('filters', ()))
+    adaptive = sampler.get('adaptive', {})
+    adaptive = tuple(compile_adaptive(cap, adaptive[cap], interval) for cap in adaptive)
+
+    collector = None
+    if len(config.collector) > 0:
+        collector_conf = config.collector
+        collector = CollectorPlan(
+                address=str(_require(collector_conf, 'address', 'collector')),
+                node=str(collector_conf.get('node', socket.gethostname())),
+                interval=_duration(collector_conf.get('interval', 'PT5S'), 'collector.interval'),
+                buffer=int(_number(collector_conf.get('buffer', 10000), 'collector.buffer')))
+        if collector.interval <= 0 or collector.buffer <= 0:
+            raise ConfigError('collector: interval and buffer must be positive')
+
+    stream = None
+    if len(config.stream) > 0:
+        stream = StreamPlan(address=str(config.stream.get('address', '127.0.0.1:8080')),
+                            queue=int(_number(config.stream.get('queue', 256), 'stream.queue')))
+        if stream.address.rpartition(':')[2].isdigit() is False or stream.queue <= 0:
+            raise ConfigError('stream: address needs host:port and queue must be positive')
+
+    health = config.health
+    health_plan = HealthPlan(
+            threshold=int(_number(health.get('threshold', 3), 'health.threshold')),
+            backoff=_duration(health.get('backoff', 'PT5S'), 'health.backoff'),
+            max_backoff=_duration(health.get('max-backoff', 'PT10M'), 'health.max-backoff'))
+    if health_plan.threshold < 1 or health_plan.backoff <= 0 or \
+            health_plan.max_backoff < health_plan.backoff:
+        raise ConfigError('health: need threshold >= 1 and 0 < backoff <= max-backoff')
+
+    return ConfigPlan(freeze(config.env), state_plan, sensors, virtuals, tuple(calibrations),
+                      presence_check,
+                      SamplerPlan(interval, sampler.get('shared-memory'), filters, adaptive),
+                      collector, stream, health_plan)
+
 class Config:
     def __init__(self, config: dict[str, Any]):
         self._data = config
@@ -14,6 +416,13 @@ class Config:
         self._virtual_devices = None
         self._calibrations = None
         self._env = None
+        self._state = None
+        self._presence_check = None
+        self._sampler = None
+        self._collector = None
+        self._stream = None
+        self._health = None
+        self._plan = None
 
     @property
     def env(self) -> dict[str, Any]:
@@ -54,3 +463,58 @@ class Config:
 
         self._calibrations = self._data.get('calibrations', {})
         return self._calibrations
+
+    @property
+    def state(self) -> dict[str, Any]:
+        if self._state is not None:
+            return self._state
+
+        self._state = self._data.get('state', {})
+        return self._state
+
+    @property
+    def presence_check(self) -> str | None:
+        if self._presence_check is not None:
+            return self._presence_check
+
+        self._presence_check = self._data.get('presence-check', None)
+        return self._presence_check
+
+    @property
+    def sampler(self) -> dict[str, Any]:
+        if self._sampler is not None:
+            return self._sampler
+
+        self._sampler = self._data.get('sampler', {})
+        return self._sampler
+
+    @property
+    def collector(self) -> dict[str, Any]:
+        if self._collector is not None:
+            return self._collector
+
+        self._collector = self._data.get('collector', {})
+        return self._collector
+
+    @property
+    def stream(self) -> dict[str, Any]:
+        if self._stream is not None:
+            return self._stream
+
+        self._stream = self._data.get('stream', {})
+        return self._stream
+
+    @property
+    def health(self) -> dict[str, Any]:
+        if self._health is not None:
+            return self._health
+
+        self._health = self._data.get('health', {})
+        return self._health
+
+    def compile(self) -> ConfigPlan:
+        if self._plan is not None:
+            return self._plan
+
+        self._plan = compile_config(self)
+        return self._plan
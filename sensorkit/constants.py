@@ -32,6 +32,8 @@ INFRARED                = 0x0200
 FULL_SPECTRUM           = 0x0400
 CO2                     = 0x0800
 PRESSURE_MSL            = 0x1000
+DEW_POINT               = 0x2000
+ABSOLUTE_HUMIDITY       = 0x4000
 
 # Units
 CELSIUS_UNITS                = 'Celsius (C)'
@@ -41,6 +43,7 @@ PERC_RELATIVE_HUMIDITY_UNITS = 'Percent Relative Humidity (% rH)'
 AMBIENT_LIGHT_UNITS          = 'Ambient Light Data'
 LUX_UNITS                    = 'Lux (Lx)'
 PPM_UNITS                    = 'Parts per Million (PPM)'
+GRAMS_PER_CUBIC_METER_UNITS  = 'Grams per Cubic Meter (g/m3)'
 
 # Breakout boards / DeviceIDs
 VIRTUAL_DEVICE = 0xFFFF
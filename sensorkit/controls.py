@@ -1,7 +1,9 @@
 import abc
 from collections.abc import Iterator
 import logging
+import time
 from typing import Literal
+import weakref
 
 logger = logging.getLogger(__name__)
 
@@ -11,21 +13,74 @@ import adafruit_tca9548a
 
 from . import constants
 from . import devices
+from .arbiter import BusArbiter
 from .tools.mixins import NodeMixin
 
+# multiplexer with a channel currently selected, per parent bus, so that selecting a channel
+# on one mux first disconnects the channel left selected on a sibling
+_active = weakref.WeakKeyDictionary()
+
 class ChannelProxy(NodeMixin):
-    def __init__(self, index: int, channel):
+    def __init__(self, index: int, channel, mux: 'Multiplexer | None' = None):
         super().__init__()
         self._index = index
         self._channel = channel
+        self._mux = mux
+
+        # (mux address, channel) hops from the root bus, cached for the life of the channel
+        upstream = getattr(mux.bus, 'path', ()) if mux is not None else ()
+        self._path = tuple(upstream) + ((mux.address if mux is not None else None, index),)
 
     @property
     def channel_id(self) -> int:
         return self._index
 
+    @property
+    def path(self) -> tuple[tuple[int, int], ...]:
+        return self._path
+
+    def try_lock(self) -> bool:
+        if self._mux is None:
+            return self._channel.try_lock()
+
+        # locking the parent bus selects every upstream hop, each only when it changed
+        while not self._mux.bus.try_lock():
+            time.sleep(0)
+        self._mux.select(self._index)
+        return True
+
+    def unlock(self) -> None:
+        if self._mux is None:
+            return self._channel.unlock()
+
+        self._mux.release_selection()
+        return self._mux.bus.unlock()
+
     def __getattr__(self, attr):
         return getattr(self._channel, attr)
 
+class BusProxy(NodeMixin):
+    def __init__(self, index: int, bus: I2C):
+        super().__init__()
+        self._index = index
+        self._bus = bus
+        self._arbiter = BusArbiter('bus-{}'.format(index))
+
+    @property
+    def bus_id(self) -> int:
+        return self._index
+
+    @property
+    def arbiter(self) -> BusArbiter:
+        return self._arbiter
+
+    @property
+    def bus(self) -> I2C:
+        return self._bus
+
+    def __getattr__(self, attr):
+        return getattr(self._bus, attr)
+
 class MuxInterface(metaclass=abc.ABCMeta):
     @classmethod
     def __subclasshook__(cls, subclass):
@@ -45,27 +100,88 @@ class MuxInterface(metaclass=abc.ABCMeta):
     def __len__(self):
         raise NotImplementedError
 
-class PCA9546A(NodeMixin, devices.Device, MuxInterface):
+class Multiplexer(NodeMixin, devices.Device, MuxInterface):
+    _driver = None
+
     def __init__(self, bus: I2C, name: str, device_id: int, capabilities: list[int],
                  address: int | str = 112):
         super().__init__(bus, name, device_id, capabilities, address)
-        self._mux = adafruit_tca9548a.PCA9546A(bus, address)
-        self._channels = [None] * 4
+        self._mux = self._driver(bus, address)
+        self._selected = None
+        self._cache_selection = True
+        self._channels = [None] * len(self._mux)
 
         for i in range(len(self._mux)):
-            self._channels[i] = ChannelProxy(i, self._mux[i])
+            self._channels[i] = ChannelProxy(i, self._mux[i], self)
 
-    def __len__(self) -> Literal[4]:
+    def __len__(self) -> int:
         return len(self._mux)
 
+    @property
+    def bus(self):
+        return self._bus
+
     @property
     def real_device(self):
         return self._mux
 
+    @property
+    def cache_selection(self) -> bool:
+        return self._cache_selection
+
+    @cache_selection.setter
+    def cache_selection(self, enabled: bool) -> None:
+        # with caching the selected channel stays connected after unlock and reselecting it
+        # costs nothing, without it every unlock disconnects all channels
+        self._cache_selection = enabled
+
     def channels(self) -> Iterator[int]:
         for c in self._channels:
             yield c
 
+    def select(self, index: int) -> None:
+        # caller holds the parent bus lock
+        active = _active.get(self._bus)
+        if active is not None and active is not self:
+            active._write_selection(0)
+
+        self._write_selection(1 << index)
+        _active[self._bus] = self
+
+    def release_selection(self) -> None:
+        # caller holds the parent bus lock
+        if self._cache_selection is False:
+            self._write_selection(0)
+
+    def deselect(self) -> None:
+        while not self._bus.try_lock():
+            time.sleep(0)
+        try:
+            self._write_selection(0)
+        finally:
+            self._bus.unlock()
+
+    def _write_selection(self, switch: int) -> None:
+        if self._selected == switch:
+            return
+
+        self._bus.writeto(self._address, bytes([switch]))
+        self._selected = switch
+        if switch == 0 and _active.get(self._bus) is self:
+            del _active[self._bus]
+
+class PCA9546A(Multiplexer):
+    _driver = adafruit_tca9548a.PCA9546A
+
+    def __len__(self) -> Literal[4]:
+        return len(self._mux)
+
+class TCA9548A(Multiplexer):
+    _driver = adafruit_tca9548a.TCA9548A
+
+    def __len__(self) -> Literal[8]:
+        return len(self._mux)
+
 class MuxFactory:
     def __init__(self):
         self._ctors = {}
@@ -83,3 +199,4 @@ class MuxFactory:
 
 mux_factory = MuxFactory()
 mux_factory.register_mux(constants.PCA9546A, PCA9546A)
+mux_factory.register_mux(constants.TCA9548A, TCA9548A)
@@ -1,5 +1,7 @@
 from collections import namedtuple
+import itertools
 import logging
+from types import MappingProxyType
 from typing import Any, Optional
 
 import littletable as db
@@ -21,26 +23,89 @@ device_types = db.Table('device_types')
 device_types.create_index('type', unique=True)
 device_types.csv_import(device_type_data, transforms={'type': int})
 
+# units is the canonical units id of the capability, see units_data, empty when unitless.
+# low and high bound the physically plausible values in those units, empty when unbounded,
+# raw 16 bit light channels stop short of 0xffff as that is what a saturated sensor returns
 capabilities_data = f"""\
-id,capability
-{constants.FOUR_CHANNEL},four_channel
-{constants.EIGHT_CHANNEL},eight_channel
-{constants.PRESSURE},pressure
-{constants.TEMPERATURE},temperature
-{constants.ALTITUDE},altitude
-{constants.RELATIVE_HUMIDITY},relative_humidity
-{constants.AMBIENT_LIGHT},ambient_light
-{constants.LUX},lux
-{constants.VISIBLE},visible
-{constants.INFRARED},infrared
-{constants.FULL_SPECTRUM},full_spectrum
-{constants.CO2},co2
-{constants.PRESSURE_MSL},pressure_msl"""
+id,capability,units,low,high
+{constants.FOUR_CHANNEL},four_channel,,,
+{constants.EIGHT_CHANNEL},eight_channel,,,
+{constants.PRESSURE},pressure,hPa,300,1250
+{constants.TEMPERATURE},temperature,C,-40,125
+{constants.ALTITUDE},altitude,m,-500,9000
+{constants.RELATIVE_HUMIDITY},relative_humidity,%rH,0,100
+{constants.AMBIENT_LIGHT},ambient_light,,0,65534
+{constants.LUX},lux,lx,0,120000
+{constants.VISIBLE},visible,,0,
+{constants.INFRARED},infrared,,0,65534
+{constants.FULL_SPECTRUM},full_spectrum,,0,65534
+{constants.CO2},co2,ppm,0,40000
+{constants.PRESSURE_MSL},pressure_msl,hPa,870,1085
+{constants.DEW_POINT},dew_point,C,-60,60
+{constants.ABSOLUTE_HUMIDITY},absolute_humidity,g/m3,0,200"""
+
+def _optional_float(value: str) -> Optional[float]:
+    return float(value) if value != '' else None
 
 capabilities = db.Table('capabilities')
 capabilities.create_index('id', unique=True)
 capabilities.create_index('capability', unique=True)
-capabilities.csv_import(capabilities_data, transforms={'id': int})
+capabilities.csv_import(capabilities_data, transforms={'id': int, 'low': _optional_float,
+                                                      'high': _optional_float})
+
+# a value in units is value * scale + offset in the base units of its dimension
+units_data = """\
+units,dimension,scale,offset
+C,temperature,1,0
+F,temperature,0.5555555555555556,-17.77777777777778
+K,temperature,1,-273.15
+Pa,pressure,1,0
+hPa,pressure,100,0
+kPa,pressure,1000,0
+inHg,pressure,3386.389,0
+mmHg,pressure,133.322387415,0
+m,length,1,0
+ft,length,0.3048,0
+%rH,relative_humidity,1,0
+lx,illuminance,1,0
+ppm,concentration,1,0
+g/m3,density,1,0"""
+
+units = db.Table('units')
+units.create_index('units', unique=True)
+units.csv_import(units_data, transforms={'scale': float, 'offset': float})
+
+# free form units strings, from devices and from virtual device sources, to units ids
+units_aliases_data = f"""\
+alias,units
+{constants.CELSIUS_UNITS},C
+{constants.HECTOPASCAL_UNITS},hPa
+{constants.METER_UNITS},m
+{constants.PERC_RELATIVE_HUMIDITY_UNITS},%rH
+{constants.LUX_UNITS},lx
+{constants.PPM_UNITS},ppm
+{constants.GRAMS_PER_CUBIC_METER_UNITS},g/m3
+°C,C
+°F,F
+%,%rH
+ft,ft
+m,m
+hPa,hPa
+Pa,Pa
+kPa,kPa
+inHg,inHg
+mmHg,mmHg
+C,C
+F,F
+K,K
+lx,lx
+ppm,ppm
+g/m³,g/m3
+g/m3,g/m3"""
+
+units_aliases = db.Table('units_aliases')
+units_aliases.create_index('alias', unique=True)
+units_aliases.csv_import(units_aliases_data)
 
 device_ids_data = f"""\
 id,device_name
@@ -58,122 +123,187 @@ device_ids.create_index('id', unique=True)
 device_ids.create_index('device_name', unique=True)
 device_ids.csv_import(device_ids_data, transforms={'id': int})
 
-links = db.Table('links')
-links.create_index('node', unique=True)
-links.create_index('parent')
-
-nodes = db.Table('nodes')
-nodes.create_index('uuid', unique=True)
-nodes.create_index('kind')
-
-multiplexer_attributes = db.Table('multiplexer_attributes')
-multiplexer_attributes.create_index('uuid', unique=True)
-channel_attributes = db.Table('channel_attributes')
-channel_attributes.create_index('uuid', unique=True)
-device_attributes = db.Table('device_attributes')
-device_attributes.create_index('uuid', unique=True)
-device_attributes.create_index('name')
-device_attributes.create_index('device_id')
-device_attributes.create_index('channel_id')
-device_attributes.create_index('address')
-meter_attributes = db.Table('meter_attributes')
-meter_attributes.create_index('uuid', unique=True)
-meter_attributes.create_index('measurement')
-detector_attributes = db.Table('detector_attributes')
-detector_attributes.create_index('uuid', unique=True)
-detector_attributes.create_index('name')
-detector_attributes.create_index('address')
-detector_attributes.create_index('has_channel')
-detector_attributes.create_index('channel_id')
-virtual_attributes = db.Table('virtual_attributes')
-virtual_attributes.create_index('uuid', unique=True)
-virtual_attributes.create_index('name')
-virtual_attributes.create_index('measurement')
-
-# Joins
-def join_devices():
-    devices = device_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
-                                           other=nodes,
-                                           attrlist=[
-                                               (nodes, 'uuid'),
-                                               (nodes, 'kind'),
-                                               (nodes, 'obj'),
-                                               (nodes, 'is_virtual'),
-                                               (device_attributes, 'uuid'),
-                                               (device_attributes, '_address', 'address'),
-                                               (device_attributes, '_has_channel', 'has_channel'),
-                                               (device_attributes, '_channel_id', 'channel_id'),
-                                               (device_attributes, '_name', 'name'),
-                                               (device_attributes, '_caps', 'capabilities'),
-                                               (device_attributes, '_device_id', 'device_id'),
-                                           ],
-                                           uuid='uuid')('devices')
-    return devices.where(kind=constants.DEVICE)
-
-def join_meters():
-    meters = meter_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
-                                         other=nodes,
-                                         attrlist=[
-                                             (nodes, 'uuid'),
-                                             (nodes, 'kind'),
-                                             (nodes, 'obj'),
-                                             (nodes, 'is_virtual'),
-                                             (meter_attributes, 'uuid'),
-                                             (meter_attributes, '_measurement', 'measurement'),
-                                         ],
-                                         uuid='uuid')('meters')
-    return meters.where(kind=constants.METER)
-
-def join_virtuals():
-    virtuals = virtual_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
+# parent id of nodes linked directly below the root
+ROOT_NODE = 0
+
+class NodeRecord:
+    __slots__ = ('node_id', 'kind', 'obj', 'is_virtual', 'bus')
+
+    def __init__(self, node_id: int, kind: int, obj: Any, is_virtual: bool,
+                 bus: Optional[int] = None):
+        self.node_id = node_id
+        self.kind = kind
+        self.obj = obj
+        self.is_virtual = is_virtual
+        self.bus = bus
+
+class LinkRecord:
+    __slots__ = ('node', 'parent')
+
+    def __init__(self, node: int, parent: int):
+        self.node = node
+        self.parent = parent
+
+class VirtualRecord:
+    __slots__ = ('node_id', 'name', 'measurement', 'capability')
+
+    def __init__(self, node_id: int, name: str, measurement: int, capability: str):
+        self.node_id = node_id
+        self.name = name
+        self.measurement = measurement
+        self.capability = capability
+
+class Registry:
+    # Owns the node tables of one kit or tree. Registries are independent of each other and
+    # release() drops every row at once.
+    def __init__(self):
+        self._node_ids = itertools.count(ROOT_NODE + 1)
+
+        self.links = db.Table('links')
+        self.links.create_index('node', unique=True)
+        self.links.create_index('parent')
+
+        self.nodes = db.Table('nodes')
+        self.nodes.create_index('node_id', unique=True)
+        self.nodes.create_index('kind')
+
+        self.multiplexer_attributes = db.Table('multiplexer_attributes')
+        self.multiplexer_attributes.create_index('node_id', unique=True)
+        self.channel_attributes = db.Table('channel_attributes')
+        self.channel_attributes.create_index('node_id', unique=True)
+        self.device_attributes = db.Table('device_attributes')
+        self.device_attributes.create_index('node_id', unique=True)
+        self.device_attributes.create_index('name')
+        self.device_attributes.create_index('device_id')
+        self.device_attributes.create_index('channel_id')
+        self.device_attributes.create_index('address')
+        self.meter_attributes = db.Table('meter_attributes')
+        self.meter_attributes.create_index('node_id', unique=True)
+        self.meter_attributes.create_index('measurement')
+        self.detector_attributes = db.Table('detector_attributes')
+        self.detector_attributes.create_index('node_id', unique=True)
+        self.detector_attributes.create_index('name')
+        self.detector_attributes.create_index('address')
+        self.detector_attributes.create_index('has_channel')
+        self.detector_attributes.create_index('channel_id')
+        self.virtual_attributes = db.Table('virtual_attributes')
+        self.virtual_attributes.create_index('node_id', unique=True)
+        self.virtual_attributes.create_index('name')
+        self.virtual_attributes.create_index('measurement')
+
+    def next_id(self) -> int:
+        return next(self._node_ids)
+
+    def tables(self) -> list[db.Table]:
+        return [ self.links, self.nodes, self.multiplexer_attributes, self.channel_attributes,
+                 self.device_attributes, self.meter_attributes, self.detector_attributes,
+                 self.virtual_attributes ]
+
+    def attribute_tables(self) -> list[db.Table]:
+        return self.tables()[2:]
+
+    def release(self) -> None:
+        for table in self.tables():
+            table.clear()
+
+    # Joins
+    def join_devices(self):
+        nodes = self.nodes
+        device_attributes = self.device_attributes
+        devices = device_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
+                                               other=nodes,
+                                               attrlist=[
+                                                   (nodes, 'node_id'),
+                                                   (nodes, 'kind'),
+                                                   (nodes, 'obj'),
+                                                   (nodes, 'is_virtual'),
+                                                   (device_attributes, 'node_id'),
+                                                   (device_attributes, '_address', 'address'),
+                                                   (device_attributes, '_has_channel',
+                                                    'has_channel'),
+                                                   (device_attributes, '_channel_id',
+                                                    'channel_id'),
+                                                   (device_attributes, '_name', 'name'),
+                                                   (device_attributes, '_caps', 'capabilities'),
+                                                   (device_attributes, '_device_id', 'device_id'),
+                                               ],
+                                               node_id='node_id')('devices')
+        return devices.where(kind=constants.DEVICE)
+
+    def join_meters(self):
+        nodes = self.nodes
+        meter_attributes = self.meter_attributes
+        meters = meter_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
                                              other=nodes,
                                              attrlist=[
-                                                 (nodes, 'uuid'),
+                                                 (nodes, 'node_id'),
                                                  (nodes, 'kind'),
                                                  (nodes, 'obj'),
                                                  (nodes, 'is_virtual'),
-                                                 (virtual_attributes, 'uuid'),
-                                                 (virtual_attributes, 'name'),
-                                                 (virtual_attributes, 'measurement'),
+                                                 (meter_attributes, 'node_id'),
+                                                 (meter_attributes, '_measurement', 'measurement'),
                                              ],
-                                             uuid='uuid')('virtuals')
-    return virtuals.where(is_virtual=True)
-
-def join_devices_meters():
-    devices = device_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
-                                           other=links,
-                                           attrlist=[
-                                               (links, 'node'),
-                                               (links, 'parent'),
-                                               (device_attributes, 'uuid'),
-                                               (device_attributes, '_name', 'name'),
-                                               (device_attributes, '_address', 'address'),
-                                               (device_attributes, '_has_channel', 'has_channel'),
-                                               (device_attributes, '_channel_id', 'channel_id'),
-                                               (device_attributes, '_device_id', 'device_id'),
-                                           ],
-                                           uuid='parent')('devices')
-
-    meters = meter_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
-                                         other=nodes,
-                                         attrlist=[
-                                             (nodes, 'uuid'),
-                                             (nodes, 'obj', 'meter_obj'),
-                                             (meter_attributes, '_measurement', 'measurement'),
-                                         ],
-                                         uuid='uuid')('meters')
-
-    children = devices.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
-                                  other=meters,
-                                  attrlist=[
-                                      (devices,'name'),
-                                      (devices,'uuid'),
-                                      (meters,'uuid','child_uuid'),
-                                      (meters,'meter_obj'),
-                                      (meters,'measurement'),
-                                  ],
-                                  node='uuid')('device_meters')
-    return children
+                                             node_id='node_id')('meters')
+        return meters.where(kind=constants.METER)
+
+    def join_virtuals(self):
+        nodes = self.nodes
+        virtual_attributes = self.virtual_attributes
+        virtuals = virtual_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
+                                                 other=nodes,
+                                                 attrlist=[
+                                                     (nodes, 'node_id'),
+                                                     (nodes, 'kind'),
+                                                     (nodes, 'obj'),
+                                                     (nodes, 'is_virtual'),
+                                                     (virtual_attributes, 'node_id'),
+                                                     (virtual_attributes, 'name'),
+                                                     (virtual_attributes, 'measurement'),
+                                                 ],
+                                                 node_id='node_id')('virtuals')
+        return virtuals.where(is_virtual=True)
+
+    def join_devices_meters(self):
+        nodes = self.nodes
+        links = self.links
+        device_attributes = self.device_attributes
+        meter_attributes = self.meter_attributes
+        devices = device_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
+                                               other=links,
+                                               attrlist=[
+                                                   (links, 'node'),
+                                                   (links, 'parent'),
+                                                   (device_attributes, 'node_id'),
+                                                   (device_attributes, '_name', 'name'),
+                                                   (device_attributes, '_address', 'address'),
+                                                   (device_attributes, '_has_channel',
+                                                    'has_channel'),
+                                                   (device_attributes, '_channel_id',
+                                                    'channel_id'),
+                                                   (device_attributes, '_device_id', 'device_id'),
+                                               ],
+                                               node_id='parent')('devices')
+
+        meters = meter_attributes.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
+                                             other=nodes,
+                                             attrlist=[
+                                                 (nodes, 'node_id'),
+                                                 (nodes, 'obj', 'meter_obj'),
+                                                 (meter_attributes, '_measurement', 'measurement'),
+                                             ],
+                                             node_id='node_id')('meters')
+
+        children = devices.outer_join(join_type=db.Table.FULL_OUTER_JOIN,
+                                      other=meters,
+                                      attrlist=[
+                                          (devices,'name'),
+                                          (devices,'node_id'),
+                                          (meters,'node_id','child_id'),
+                                          (meters,'meter_obj'),
+                                          (meters,'measurement'),
+                                      ],
+                                      node='node_id')('device_meters')
+        return children
 
 class NonUniqueRecordQueryError(Exception):
     """Non Unique Query"""
@@ -224,6 +354,37 @@ class UniqueRecordFieldByWhere:
                         self._table.table_name, clauses)
                 raise NonUniqueRecordQueryError(msg)
 
-devicetypes_selector  = UniqueRecordFieldByWhere(device_types)
-capabilities_selector = UniqueRecordFieldByWhere(capabilities)
-deviceids_selector    = UniqueRecordFieldByWhere(device_ids)
+class UniqueRecordFieldByKey(UniqueRecordFieldByWhere):
+    # For static tables. Every column holding unique values is mapped value -> record once, so
+    # single clause lookups on such a column are a dict hit instead of a where().
+    def __init__(self, table: db.Table[db.TableContent]):
+        super().__init__(table)
+
+        maps = dict()
+        columns = table.info()['fields'] if len(table) > 0 else []
+        for column in columns:
+            by_value = dict()
+            for rec in table:
+                by_value.setdefault(getattr(rec, column), []).append(rec)
+            if all(len(recs) == 1 for recs in by_value.values()):
+                maps[column] = MappingProxyType({ k: v[0] for k, v in by_value.items() })
+        self._maps = MappingProxyType(maps)
+
+    def __call__(self, field: str, where: Optional[dict[str, Any]] = None,
+                 **kwargs: Any) -> Field:
+        clauses = {**where, **kwargs} if where is not None else kwargs
+        if len(clauses) == 1:
+            column, value = next(iter(clauses.items()))
+            by_value = self._maps.get(column)
+            if by_value is not None:
+                rec = by_value.get(value)
+                if rec is None:
+                    return Field(False, None)
+                return Field(True, getattr(rec, field))
+        return super().__call__(field, where, **kwargs)
+
+devicetypes_selector  = UniqueRecordFieldByKey(device_types)
+capabilities_selector = UniqueRecordFieldByKey(capabilities)
+deviceids_selector    = UniqueRecordFieldByKey(device_ids)
+units_selector        = UniqueRecordFieldByKey(units)
+unitsaliases_selector = UniqueRecordFieldByKey(units_aliases)
@@ -1,18 +1,31 @@
 import abc
+from collections import namedtuple
 import logging
+import threading
+import time
 import typing
+from typing import Any, Optional
 
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError):
+    # off the Pi, detectors need a gpio such as tools.gpio.SimulatedGPIO
+    GPIO = None
 from adafruit_tsl2591 import ENABLE_NPAIEN, CLEAR_ALL_INTERRUPTS
 
 from . import constants
+from .arbiter import PRIORITY_INTERRUPT
 from .devices import Device
-from .datastructures import join_devices
+from .datastructures import Registry
 from .devicetree import DeviceTree
+from .events import DetectionEvent, EventDispatcher, default_dispatcher
+from .sampler import Burst, Sampler
 from .tools.mixins import NodeMixin
 
 logger = logging.getLogger(__name__)
 
+DetectorStats = namedtuple('DetectorStats', 'delivered debounced coalesced dropped')
+
 class DetectorInterface(metaclass=abc.ABCMeta):
     @classmethod
     def __subclasshook__(cls, subclass):
@@ -73,7 +86,10 @@ class DetectorInterface(metaclass=abc.ABCMeta):
         raise NotImplementedError
 
 class Detector(DetectorInterface):
-    def __init__(self, device: Device, pin: int, resistor: int, edge: int, on_detection: callable):
+    def __init__(self, device: Device, pin: int, resistor: int, edge: int, on_detection: callable,
+                 dispatcher: Optional[EventDispatcher] = None, debounce: float = 0.0,
+                 coalesce: bool = False, gpio=None, sampler: Optional[Sampler] = None,
+                 burst: Optional[Burst] = None):
         super().__init__()
         self._device = device
         self._pin = pin
@@ -90,9 +106,60 @@ class Detector(DetectorInterface):
             raise ValueError('callback must be callable')
         self._on_detection = on_detection
 
+        self._gpio = gpio if gpio is not None else GPIO
+        if self._gpio is None:
+            raise ValueError('RPi.GPIO is unavailable, a gpio must be given')
+
+        # edges closer than debounce seconds to the last accepted one are ignored, with
+        # coalesce an edge is ignored while an event of this detector is still queued
+        self._dispatcher = dispatcher if dispatcher is not None else default_dispatcher()
+        self._debounce = debounce
+        self._coalesce = coalesce
+        self._lock = threading.Lock()
+        self._last_edge = None
+        self._pending = 0
+        self._counts = [0, 0, 0, 0]
+
+        # on detection the meters of the device are sampled in a burst, before on_detection
+        if burst is not None and sampler is None:
+            raise ValueError('burst needs a sampler')
+        self._sampler = sampler
+        self._burst = Burst(**burst) if isinstance(burst, dict) else burst
+
     def __call__(self, channel):
+        # runs on the GPIO callback thread, only queues the event
+        now = time.monotonic()
+        with self._lock:
+            if self._last_edge is not None and now - self._last_edge < self._debounce:
+                self._counts[1] = self._counts[1] + 1
+                return
+            if self._coalesce and self._pending > 0:
+                self._counts[2] = self._counts[2] + 1
+                return
+            self._last_edge = now
+            self._pending = self._pending + 1
+
+        if not self._dispatcher.submit(DetectionEvent(self, channel, time.time())):
+            with self._lock:
+                self._pending = self._pending - 1
+                self._counts[3] = self._counts[3] + 1
+            logger.warning('detector %s event queue full, event dropped', self._name)
+
+    def _deliver(self, event: DetectionEvent) -> None:
+        # runs on a dispatcher worker
+        with self._lock:
+            self._pending = self._pending - 1
+            self._counts[0] = self._counts[0] + 1
+        if self._burst is not None:
+            self._sampler.burst([ self._device ], self._burst)
+
         logger.debug("called in Detector wrapper")
-        self._on_detection(self, channel)
+        self._on_detection(self, event.channel)
+
+    @property
+    def stats(self) -> DetectorStats:
+        with self._lock:
+            return DetectorStats(*self._counts)
 
     @property
     def address(self) -> int:
@@ -127,28 +194,35 @@ class Detector(DetectorInterface):
         return self._device
 
 class Tsl2591Detector(NodeMixin, Detector):
-    def __init__(self, device, pin: int, resistor: int, edge: int, on_detection: callable):
-        super().__init__(device, pin, resistor, edge, on_detection)
+    def __init__(self, device, pin: int, resistor: int, edge: int, on_detection: callable,
+                 **options):
+        super().__init__(device, pin, resistor, edge, on_detection, **options)
 
         self._enabled = False
 
     def enable(self):
         if self._enabled is False:
-            GPIO.setup(self._pin, GPIO.IN, pull_up_down=self._resistor)
-            GPIO.add_event_detect(self._pin, self._edge, callback=self)
+            self._gpio.setup(self._pin, self._gpio.IN, pull_up_down=self._resistor)
+            self._gpio.add_event_detect(self._pin, self._edge, callback=self)
 
-            self._device.real_device.enable_interrupt(ENABLE_NPAIEN)
+            with self._device.access(PRIORITY_INTERRUPT):
+                self._device.real_device.enable_interrupt(ENABLE_NPAIEN)
             self._enabled = True
 
     def disable(self):
         if self._enabled is True:
-            self._device.real_device.disable_interrupt(ENABLE_NPAIEN)
-
-            GPIO.cleanup()
-            self._enabled = False
+            # the edge callback is released even when the device no longer answers
+            try:
+                with self._device.access(PRIORITY_INTERRUPT):
+                    self._device.real_device.disable_interrupt(ENABLE_NPAIEN)
+            finally:
+                self._gpio.remove_event_detect(self._pin)
+                self._gpio.cleanup(self._pin)
+                self._enabled = False
 
     def clear(self):
-        self._device.real_device.clear_interrupt(CLEAR_ALL_INTERRUPTS)
+        with self._device.access(PRIORITY_INTERRUPT):
+            self._device.real_device.clear_interrupt(CLEAR_ALL_INTERRUPTS)
 
 class DetectorFactory:
     def __init__(self):
@@ -158,8 +232,9 @@ class DetectorFactory:
         self._ctors[device_id] = ctor
 
     def get_detector(self, pin: int, resistor: int, edge: int, on_detection: callable,
+                     registry: Registry, options: Optional[dict[str, Any]] = None,
                      **kwargs) -> [ list[DetectorInterface] | None]:
-        devices = join_devices()
+        devices = registry.join_devices()
         records = devices.where(**kwargs)
         if len(records) == 0:
             return None
@@ -169,7 +244,7 @@ class DetectorFactory:
         detectors = [None] * len(records)
         for i, record in enumerate(records):
             detectors[i] = self._ctors[record.device_id](record.obj, pin, resistor, edge,
-                                                         on_detection)
+                                                         on_detection, **(options or {}))
 
         return detectors
 
@@ -177,15 +252,21 @@ detector_factory = DetectorFactory()
 detector_factory.register_detector(constants.TSL2591, Tsl2591Detector)
 
 def make_detector(pin: int, resistor: int, edge: int, on_detection: callable,
-                  tree: [DeviceTree | None] = None, **kwargs) -> [list[DetectorInterface] | None]:
-    detectors = detector_factory.get_detector(pin, resistor, edge, on_detection, **kwargs)
-
-    if tree is not None:
-        for detector in detectors:
-            tree.add(detector, constants.DETECTOR, detector.device)
-            logger.debug('added Detector %s:%s:%s to device tree', detector.name, detector.address,
-                         detector.channel_id)
-    else:
-        logger.debug('no devicetree provided - detectors are not searchable')
+                  tree: [DeviceTree | None] = None, options: Optional[dict[str, Any]] = None,
+                  **kwargs) -> [list[DetectorInterface] | None]:
+    # The devices to watch are looked up in the tree's registry. options are handed to each
+    # detector: dispatcher, debounce, coalesce, gpio, and sampler with burst.
+    if tree is None:
+        raise ValueError('tree cannot be None')
+
+    detectors = detector_factory.get_detector(pin, resistor, edge, on_detection, tree.registry,
+                                              options, **kwargs)
+    if detectors is None:
+        return None
+
+    for detector in detectors:
+        tree.add(detector, constants.DETECTOR, detector.device)
+        logger.debug('added Detector %s:%s:%s to device tree', detector.name, detector.address,
+                     detector.channel_id)
 
     return detectors
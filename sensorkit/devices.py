@@ -1,6 +1,8 @@
 import abc
 from collections.abc import Iterator
+from contextlib import nullcontext
 import logging
+from operator import attrgetter, itemgetter
 from typing import Any, Optional
 
 import adafruit_bmp3xx
@@ -12,6 +14,7 @@ from busio import I2C
 
 from . import constants
 from . import profiles
+from .arbiter import BusArbiter
 from .tools.mixins import (
         NodeMixin,
         RunnableInterface,
@@ -22,6 +25,32 @@ logger = logging.getLogger(__name__)
 class DeviceCapabilityError(Exception):
     """Raised when Device cannot read requested capability."""
 
+def compile_accessor(prop: str) -> callable:
+    # 'prop' reads an attribute of the real device, 'prop:index' an item of it, e.g.
+    # 'raw_luminosity:0'
+    name, _, index = prop.partition(':')
+    getter = attrgetter(name)
+    if index == '':
+        return getter
+
+    item = itemgetter(int(index))
+    return lambda dev: item(getter(dev))
+
+class _PropertyMap(dict):
+    # capability -> property, each entry is compiled into an accessor as it is set so reads
+    # never parse the property string
+    def __init__(self):
+        super().__init__()
+        self.accessors = dict()
+
+    def __setitem__(self, capability: int, prop: str) -> None:
+        self.accessors[capability] = compile_accessor(prop)
+        super().__setitem__(capability, prop)
+
+    def __delitem__(self, capability: int) -> None:
+        super().__delitem__(capability)
+        del self.accessors[capability]
+
 class DeviceInterface(metaclass=abc.ABCMeta):
     @classmethod
     def __subclasshook__(cls, subclass):
@@ -43,6 +72,8 @@ class DeviceInterface(metaclass=abc.ABCMeta):
                 callable(subclass.capabilities_gen) and
                 hasattr(subclass, 'read_capability') and
                 callable(subclass.read_capability) and
+                hasattr(subclass, 'read_capabilities') and
+                callable(subclass.read_capabilities) and
                 hasattr(subclass, 'capability_units') and
                 callable(subclass.capability_units) or
                 NotImplemented)
@@ -83,6 +114,10 @@ class DeviceInterface(metaclass=abc.ABCMeta):
     def read_capability(self, capability: int) -> [ int | float ]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def read_capabilities(self, capabilities: list[int]) -> dict[int, int | float]:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def capability_units(self, capability: int) -> str:
         raise NotImplementedError
@@ -95,8 +130,10 @@ class Device(DeviceInterface):
         self._device_id = device_id
         self._caps = capabilities
         self._dev = None
-        self._property_map = dict()
+        self._property_map = _PropertyMap()
         self._capability_units = dict()
+        self._arbiter = None
+        self._health = None
 
         self._address = address
         self._has_channel = False
@@ -126,19 +163,54 @@ class Device(DeviceInterface):
     def capabilities(self) -> list[int]:
         return self._caps
 
+    @property
+    def arbiter(self) -> BusArbiter | None:
+        return self._arbiter
+
+    @arbiter.setter
+    def arbiter(self, arbiter: BusArbiter | None) -> None:
+        self._arbiter = arbiter
+
+    @property
+    def health(self) -> Any:
+        # health.DeviceHealth circuit breaker guarding reads, None until added to a tree
+        return self._health
+
+    @health.setter
+    def health(self, health: Any) -> None:
+        self._health = health
+
+    def access(self, level: Optional[int] = None):
+        # arbitrated access to the bus this device sits on, a no-op until the device is
+        # added to a tree
+        if self._arbiter is None:
+            return nullcontext()
+        return self._arbiter.access(level)
+
     def capabilities_gen(self) -> Iterator[int]:
         for cap in self._caps:
             yield cap
 
     def read_capability(self, capability: int) -> [ int | float ]:
+        accessor = self._accessor(capability)
+        with self._guard(), self.access():
+            return accessor(self._dev)
+
+    def read_capabilities(self, capabilities: list[int]) -> dict[int, int | float]:
+        # every requested capability in one arbitrated bus access
+        accessors = [ (cap, self._accessor(cap)) for cap in capabilities ]
+        with self._guard(), self.access():
+            return { cap: accessor(self._dev) for cap, accessor in accessors }
+
+    def _guard(self):
+        # an open circuit breaker fails the read before it waits for the bus
+        if self._health is None:
+            return nullcontext()
+        return self._health.guard()
+
+    def _accessor(self, capability: int) -> callable:
         try:
-            prop = self._property_map[capability]
-            chk_field = prop.split(':')
-            if len(chk_field) > 1:
-                prop = chk_field[0]
-                field = int(chk_field[1])
-            else:
-                field = -1
+            accessor = self._property_map.accessors[capability]
         except KeyError:
             raise DeviceCapabilityError('capability ({}) is unsupported by device ({})'.format(
                 capability, self._device_id))
@@ -146,11 +218,7 @@ class Device(DeviceInterface):
         if self._dev is None:
             msg = 'device initialized without real device ({})'.format(self._device_id)
             raise DeviceCapabilityError(msg)
-
-        v = getattr(self._dev, prop)
-        if field != -1:
-            return v[field]
-        return v
+        return accessor
 
     def capability_units(self, capability: int) -> str:
         try:
@@ -171,6 +239,11 @@ class Device(DeviceInterface):
             return self._channel_id
         return None
 
+    @property
+    def channel_path(self) -> tuple[tuple[int, int], ...]:
+        # (mux address, channel) hops from the root bus, empty on the root bus
+        return getattr(self._bus, 'path', ())
+
 class Bmp390(NodeMixin, Device):
     def __init__(self, bus: I2C, name: str, device_id: int,
                  address: int = 119, env: Optional[dict[str, Any]] = None):
@@ -241,14 +314,16 @@ class Scd41(NodeMixin, Device, RunnableInterface):
         return self._dev
 
     def run(self):
-        if 'indoors' in self._env:
-            enable = not self._env['indoors']
-            self._dev.self_calibration_enabled = enable
+        with self.access():
+            if 'indoors' in self._env:
+                enable = not self._env['indoors']
+                self._dev.self_calibration_enabled = enable
 
-        self._dev.start_periodic_measurement()
+            self._dev.start_periodic_measurement()
 
     def stop(self):
-        self._dev.stop_periodic_measurement()
+        with self.access():
+            self._dev.stop_periodic_measurement()
 
 class Tsl2591(NodeMixin, Device):
     def __init__(self, bus: I2C, name: str, device_id: int,
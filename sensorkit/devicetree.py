@@ -1,5 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from collections.abc import Iterator
+import threading
+import time
 from typing import Any, Optional
 
 import board
@@ -7,8 +10,11 @@ from busio import I2C
 
 from . import constants
 from . import controls
+from .arbiter import BusArbiter, PRIORITY_POLL
+from .config import HealthPlan
 from . import datastructures
 from . import devices
+from .health import DeviceHealth
 from . import meters
 from . import profiles
 from .tools.mixins import NodeMixin
@@ -16,71 +22,276 @@ from .tools.mixins import NodeMixin
 logger = logging.getLogger(__name__)
 
 class DeviceTree:
-    def __init__(self, i2c: I2C, env: Optional[dict[str, Any]] = None):
-        self._i2c = i2c
+    def __init__(self, i2c: I2C | list[I2C], env: Optional[dict[str, Any]] = None,
+                 registry: Optional[datastructures.Registry] = None,
+                 health: Optional[HealthPlan] = None):
+        self._i2c = list(i2c) if isinstance(i2c, (list, tuple)) else [ i2c ]
         self._env = env
+        # circuit breaker policy of every device added to the tree
+        self._health = health if health is not None else HealthPlan()
+        self._registry = registry if registry is not None else datastructures.Registry()
+        self._lock = threading.RLock()
+        self._roots = [ controls.BusProxy(i, bus) for i, bus in enumerate(self._i2c) ]
+
+        # scanned buses keyed by the parent id their devices link to: (bus, parent, filter)
+        self._buses = dict()
+        # addresses visible on each scanned bus at discovery, keyed the same way
+        self._seen = dict()
+
+    @property
+    def registry(self) -> datastructures.Registry:
+        return self._registry
+
+    @property
+    def buses(self) -> list[controls.BusProxy]:
+        return list(self._roots)
 
     def build(self) -> None:
-        self._build_tree(self._i2c, None, self._env)
+        # every root bus is discovered by its own worker, the tables are shared
+        for root in self._roots:
+            self.add(root, constants.BUS, None)
+
+        if len(self._roots) == 1:
+            self._build_tree(self._roots[0].bus, self._roots[0], self._env)
+            return
+
+        with ThreadPoolExecutor(max_workers=len(self._roots),
+                                thread_name_prefix='sensorkit-discovery') as pool:
+            futures = [ pool.submit(self._build_tree, root.bus, root, self._env)
+                        for root in self._roots ]
+            for future in futures:
+                future.result()
 
     def add(self, obj: NodeMixin | None, kind: int, parent: NodeMixin | None):
-        datastructures.links.insert({'node': obj.uuid,
-                                     'parent': parent.uuid if parent is not None else '__none__'})
-        datastructures.nodes.insert({'uuid': obj.uuid, 'kind': kind, 'obj': obj,
-                                     'is_virtual': bool(kind & constants.VIRTUAL)})
+        with self._lock:
+            self._add(obj, kind, parent)
+
+    def _add(self, obj: NodeMixin | None, kind: int, parent: NodeMixin | None):
+        registry = self._registry
+        if kind == constants.BUS:
+            bus = obj.bus_id
+        elif parent is not None:
+            bus = self._registry.nodes.where(node_id=parent.node_id)[0].bus
+        else:
+            bus = None
+
+        if obj.node_id is None:
+            obj._node_id = self._registry.next_id()
+
+        parent_id = parent.node_id if parent is not None else datastructures.ROOT_NODE
+        registry.links.insert(datastructures.LinkRecord(obj.node_id, parent_id))
+        registry.nodes.insert(datastructures.NodeRecord(obj.node_id, kind, obj,
+                                                        bool(kind & constants.VIRTUAL), bus))
+
+        if kind in (constants.DEVICE, constants.MUX) and bus is not None:
+            obj.arbiter = self._roots[bus].arbiter
+        if kind == constants.DEVICE and isinstance(obj, devices.Device) and obj.health is None:
+            obj.health = DeviceHealth(obj.name, self._health)
 
         match kind:
+            case constants.BUS:
+                pass
             case constants.MUX:
-                datastructures.multiplexer_attributes.insert(obj)
+                registry.multiplexer_attributes.insert(obj)
             case constants.CHANNEL:
-                datastructures.channel_attributes.insert(obj)
+                registry.channel_attributes.insert(obj)
             case constants.DEVICE:
-                datastructures.device_attributes.insert(obj)
+                registry.device_attributes.insert(obj)
             case constants.METER:
-                datastructures.meter_attributes.insert(obj)
+                registry.meter_attributes.insert(obj)
             case constants.DETECTOR:
-                datastructures.detector_attributes.insert(obj)
+                registry.detector_attributes.insert(obj)
             case constants.METER | constants.DETECTOR:
-                datastructures.meter_attributes.insert(obj)
-                datastructures.detector_attributes.insert(obj)
+                registry.meter_attributes.insert(obj)
+                registry.detector_attributes.insert(obj)
             case _:
                 if bool(kind & (constants.VIRTUAL | constants.METER)):
-                    datastructures.virtual_attributes.insert(
-                            {'uuid': obj.uuid, 'name': obj.name, 'measurement': obj.measurement,
-                             'capability': obj._capability})
+                    registry.virtual_attributes.insert(
+                            datastructures.VirtualRecord(obj.node_id, obj.name, obj.measurement,
+                                                         obj._capability))
                 else:
                     raise ValueError('unsupported kind {}'.format(kind))
 
-    def _build_tree(self, i2c, parent: NodeMixin | None, env: Optional[dict[str, Any]] = None,
+    def remove(self, obj: NodeMixin) -> list[NodeMixin]:
+        with self._lock:
+            return self._remove(obj)
+
+    def _remove(self, obj: NodeMixin) -> list[NodeMixin]:
+        # removes obj and everything linked below it, returns the removed objects
+        removed = list()
+        for child in self.children(obj):
+            removed.extend(self._remove(child))
+
+        node_id = obj.node_id
+        self._registry.links.delete(node=node_id)
+        self._registry.nodes.delete(node_id=node_id)
+
+        for table in self._registry.attribute_tables():
+            table.delete(node_id=node_id)
+        self._buses.pop(node_id, None)
+        self._seen.pop(node_id, None)
+
+        removed.append(obj)
+        return removed
+
+    def release(self) -> None:
+        # drops every node and scanned bus, the tree has to be built again before use
+        with self._lock:
+            self._buses.clear()
+            self._seen.clear()
+            self._registry.release()
+
+    def children(self, obj: NodeMixin | None) -> list[NodeMixin]:
+        parent = obj.node_id if obj is not None else datastructures.ROOT_NODE
+        children = list()
+        with self._lock:
+            for link in self._registry.links.where(parent=parent):
+                for node in self._registry.nodes.where(node_id=link.node):
+                    children.append(node.obj)
+        return children
+
+    def health(self) -> dict[int, Any]:
+        # node id -> health.HealthStatus of every device
+        with self._lock:
+            return { rec.node_id: rec.obj.health.status
+                     for rec in self._registry.nodes.where(kind=constants.DEVICE)
+                     if getattr(rec.obj, 'health', None) is not None }
+
+    def arbiter(self, obj: NodeMixin) -> BusArbiter | None:
+        # the arbiter of the root bus obj is reached through, None for virtual nodes
+        with self._lock:
+            records = self._registry.nodes.where(node_id=obj.node_id)
+            if len(records) == 0 or records[0].bus is None:
+                return None
+            return self._roots[records[0].bus].arbiter
+
+    def meters_by_bus(self) -> dict[int | None, list[Any]]:
+        # meters grouped by the root bus they are read through, virtual meters under None
+        groups = dict()
+        with self._lock:
+            for node in self._registry.nodes:
+                if node.obj is not None and bool(node.kind & constants.METER):
+                    groups.setdefault(node.bus, []).append(node.obj)
+        return groups
+
+    def descendants(self, obj: NodeMixin) -> list[NodeMixin]:
+        found = list()
+        for child in self.children(obj):
+            found.append(child)
+            found.extend(self.descendants(child))
+        return found
+
+    def rescan(self, channel: NodeMixin | None = None) -> tuple[list[NodeMixin], list[NodeMixin]]:
+        # Rescans one root bus or mux channel, or every root bus when channel is None,
+        # constructing only devices at new addresses and removing the nodes of devices that no
+        # longer answer. Returns the (added, removed) nodes, descendants included.
+        if channel is None:
+            added, removed = list(), list()
+            for root in self._roots:
+                a, r = self.rescan(root)
+                added.extend(a)
+                removed.extend(r)
+            return added, removed
+
+        key = channel.node_id
+        if key not in self._buses:
+            raise ValueError('bus {} has not been scanned by this tree'.format(key))
+
+        bus, parent, addr_filter = self._buses[key]
+        present = set(n for n in self._scan(bus, parent) if n not in addr_filter)
+        known = self._attached(parent)
+
+        removed = list()
+        for addr in set(known) - present:
+            logger.info('device at address %s vanished, removing', hex(addr))
+            removed.extend(self.remove(known[addr]))
+
+        added = list()
+        for addr in sorted(present - set(known)):
+            node = self._probe(bus, addr, parent, self._env)
+            if node is not None:
+                added.append(node)
+                added.extend(self.descendants(node))
+
+        return added, removed
+
+    def presence_changed(self) -> list[NodeMixin]:
+        # Cheap presence check, one scan per known bus and no device construction. Returns the
+        # root buses and channels whose addresses differ from the tree.
+        changed = list()
+        for key in list(self._buses):
+            bus, parent, addr_filter = self._buses[key]
+            try:
+                present = set(n for n in self._scan(bus, parent) if n not in addr_filter)
+            except Exception as e:
+                logger.warning('presence check scan failed, %s', e)
+                continue
+
+            if present != set(self._attached(parent)):
+                changed.append(parent)
+        return changed
+
+    def _attached(self, parent: NodeMixin) -> dict[int, NodeMixin]:
+        attached = dict()
+        for child in self.children(parent):
+            for node in self._registry.nodes.where(node_id=child.node_id):
+                if node.kind in (constants.DEVICE, constants.MUX):
+                    attached[child.address] = child
+        return attached
+
+    def _scan(self, i2c, parent: NodeMixin) -> list[int]:
+        with self.arbiter(parent).access(PRIORITY_POLL):
+            # a channel left selected by a downstream mux would show up in this scan
+            for child in self.children(parent):
+                if isinstance(child, controls.Multiplexer):
+                    child.deselect()
+
+            if not hasattr(i2c, 'try_lock'):
+                return i2c.scan()
+
+            # the bus lock may still be held by code that does not go through the arbiter
+            while not i2c.try_lock():
+                time.sleep(0)
+            try:
+                return i2c.scan()
+            finally:
+                i2c.unlock()
+
+    def _build_tree(self, i2c, parent: NodeMixin, env: Optional[dict[str, Any]] = None,
                     addr_filter: set = set()):
-        try:
-            if i2c.try_lock():
-                devs = i2c.scan()
-            i2c.unlock()
-        except AttributeError:
-            devs = i2c.scan()
+        self._buses[parent.node_id] = (i2c, parent, set(addr_filter))
+        devs = self._scan(i2c, parent)
 
         logger.debug('initial scan results: %s, applying filter: %s',
                      [hex(n) for n in devs],
                      [hex(n) for n in addr_filter])
 
         devs = [n for n in devs if n not in addr_filter]
+        self._seen[parent.node_id] = set(devs)
 
         for addr in devs:
-            logger.info('building node for address: %s', hex(addr))
+            self._probe(i2c, addr, parent, env)
 
-            try:
-                record = profiles.profile_selector(address=addr)
+    def _probe(self, i2c, addr: int, parent: NodeMixin | None,
+               env: Optional[dict[str, Any]] = None) -> NodeMixin | None:
+        logger.info('building node for address: %s', hex(addr))
+
+        try:
+            # discovery may write to the device, e.g. the mux control register, so it holds
+            # the bus like any other access
+            with self.arbiter(parent).access(PRIORITY_POLL):
+                record = profiles.discover(i2c, addr)
                 if record.found is False:
                     message = 'bus scan reports unsupported address {}, continuing...'.format(
                         hex(addr))
                     logger.warning(message)
-                    continue
+                    return None
 
-                self._build_node(i2c, addr, record.record, parent, env)
-            except Exception as e:
-                message = 'bus scan raised exception, {}'.format(e)
-                logger.warning(message)
+                return self._build_node(i2c, addr, record.record, parent, env)
+        except Exception as e:
+            message = 'bus scan raised exception, {}'.format(e)
+            logger.warning(message)
+            return None
 
     def _build_node(self, i2c, address, profile, parent: NodeMixin | None,
                     env: Optional[dict[str, Any]] = None):
@@ -92,14 +303,24 @@ class DeviceTree:
                                                profile.capabilities, address)
             logger.info('multiplexer supported channels: %s', len(mux))
 
-            self.add(mux, constants.MUX, None)
+            self.add(mux, constants.MUX, parent)
+
+            # Everything visible on the parent bus is also visible through each channel. A
+            # selection may only stay cached when nothing but muxes sits on the parent bus,
+            # otherwise a parent device could collide with one behind the channel.
+            visible = self._seen.get(parent.node_id, set())
+            if len(visible - profiles.mux_addresses) > 0:
+                logger.info('multiplexer %s shares its bus with devices, not caching selection',
+                            hex(address))
+                mux.cache_selection = False
 
+            addr_set = set(self._buses[parent.node_id][2]) | visible
+            addr_set.add(mux.address)
             for channel in mux.channels():
                 self.add(channel, constants.CHANNEL, mux)
-
-                addr_set = set()
-                addr_set.add(mux.address)
                 self._build_tree(channel, channel, env, addr_set)
+
+            return mux
         else:
             dev = devices.device_factory.get_device(i2c, profile.name, profile.device_id,
                                                     address, env)
@@ -107,6 +328,8 @@ class DeviceTree:
             self.add(dev, constants.DEVICE, parent)
             self._build_leaves(i2c, dev)
 
+            return dev
+
     def _build_leaves(self, i2c, parent):
         for cap in parent.capabilities_gen():
             try:
@@ -0,0 +1,76 @@
+from collections import namedtuple
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 64
+
+DetectionEvent = namedtuple('DetectionEvent', 'detector channel timestamp')
+
+class EventDispatcher:
+    # Detection events are queued by the GPIO callback thread and handled by a pool of
+    # workers, so a slow on_detection never holds up the next edge. The queue is bounded,
+    # events arriving while it is full are dropped and counted on their detector.
+    def __init__(self, workers: int = DEFAULT_WORKERS, maxsize: int = DEFAULT_QUEUE_SIZE):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+
+        self._workers = workers
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = list()
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        with self._lock:
+            if len(self._threads) > 0:
+                return
+            for i in range(self._workers):
+                t = threading.Thread(target=self._work, name='sensorkit-detector-{}'.format(i),
+                                     daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, wait: bool = True) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, list()
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def submit(self, event: DetectionEvent) -> bool:
+        # called on the GPIO callback thread, never blocks
+        self.start()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            return False
+        return True
+
+    def _work(self) -> None:
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            try:
+                event.detector._deliver(event)
+            except Exception as e:
+                logger.warning('detection handler for %s raised %s', event.detector.name, e)
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_dispatcher() -> EventDispatcher:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = EventDispatcher()
+        return _default
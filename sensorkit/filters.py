@@ -0,0 +1,120 @@
+import bisect
+from collections import deque
+import logging
+from typing import Any, Optional
+
+from .config import FilterPlan
+from .datastructures import capabilities_selector
+from .units import conversion, meter_units
+
+logger = logging.getLogger(__name__)
+
+REJECT_RANGE   = 'range'
+REJECT_RATE    = 'rate'
+REJECT_OUTLIER = 'outlier'
+
+# scales the median absolute deviation to a standard deviation for normally distributed noise
+MAD_SCALE = 1.4826
+
+class MeterFilter:
+    # Plausibility checks of one meter's samples, in order: physical range, rate of change
+    # against the last accepted sample, then a Hampel test against the median and MAD of the
+    # recent window. The window keeps outlier rejects too, a sustained step is accepted once
+    # it holds the majority of the window. Range and rate rejects are glitches and left out.
+    def __init__(self, plan: FilterPlan, low: Optional[float] = None,
+                 high: Optional[float] = None):
+        self._plan = plan
+        self._low = low
+        self._high = high
+
+        self._window = deque()
+        self._sorted = list()
+        self._last = None
+        self._rejected = { REJECT_RANGE: 0, REJECT_RATE: 0, REJECT_OUTLIER: 0 }
+
+    @property
+    def plan(self) -> FilterPlan:
+        return self._plan
+
+    @property
+    def limits(self) -> tuple[Optional[float], Optional[float]]:
+        return (self._low, self._high)
+
+    @property
+    def rejected(self) -> dict[str, int]:
+        return dict(self._rejected)
+
+    def __call__(self, value: Any, timestamp: float) -> Optional[str]:
+        # None when value is accepted, otherwise why it is rejected
+        if not isinstance(value, (int, float)):
+            return None
+
+        reason = self._check(value, timestamp)
+        if reason is None or reason == REJECT_OUTLIER:
+            self._push(value)
+        if reason is None:
+            self._last = (value, timestamp)
+        else:
+            self._rejected[reason] = self._rejected[reason] + 1
+        return reason
+
+    def _check(self, value: float, timestamp: float) -> Optional[str]:
+        if self._low is not None and value < self._low:
+            return REJECT_RANGE
+        if self._high is not None and value > self._high:
+            return REJECT_RANGE
+
+        if self._plan.max_rate is not None and self._last is not None:
+            last, at = self._last
+            elapsed = timestamp - at
+            if elapsed > 0 and abs(value - last) / elapsed > self._plan.max_rate:
+                return REJECT_RATE
+
+        # the window needs a majority of samples before a median means anything
+        if self._plan.window > 0 and len(self._sorted) > self._plan.window // 2:
+            median = self._median(self._sorted)
+            mad = self._median(sorted(abs(v - median) for v in self._sorted))
+            spread = max(MAD_SCALE * mad, self._plan.min_deviation)
+            if spread > 0 and abs(value - median) > self._plan.threshold * spread:
+                return REJECT_OUTLIER
+
+        return None
+
+    def _push(self, value: float) -> None:
+        if self._plan.window <= 0:
+            return
+        if len(self._window) == self._plan.window:
+            old = self._window.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        self._window.append(value)
+        bisect.insort(self._sorted, value)
+
+    @staticmethod
+    def _median(values: list[float]) -> float:
+        n = len(values)
+        mid = n // 2
+        if n % 2 == 1:
+            return values[mid]
+        return (values[mid - 1] + values[mid]) / 2
+
+def make_filter(plan: FilterPlan, meter: Any) -> MeterFilter:
+    # range limits come from the plan, or else from the capability in its canonical units,
+    # converted to the units the meter reports in
+    low, high = plan.low, plan.high
+    if low is None and high is None and plan.physical_range:
+        cap_low = capabilities_selector('low', id=plan.measurement)
+        cap_high = capabilities_selector('high', id=plan.measurement)
+        low = cap_low.field if cap_low.found else None
+        high = cap_high.field if cap_high.found else None
+
+        canonical = capabilities_selector('units', id=plan.measurement).field
+        source = meter_units(meter)
+        if canonical and source is not None and source != canonical:
+            try:
+                conv = conversion(canonical, source)
+                low, high = conv(low), conv(high)
+            except ValueError as e:
+                logger.warning('range of %s not applied, %s', meter.name, e)
+                low, high = None, None
+
+    return MeterFilter(plan, low, high)
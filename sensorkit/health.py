@@ -0,0 +1,113 @@
+from collections import namedtuple
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from .config import HealthPlan
+from .devices import DeviceCapabilityError
+
+logger = logging.getLogger(__name__)
+
+class DeviceUnavailableError(DeviceCapabilityError):
+    """Raised without touching the bus while a device's circuit breaker is open."""
+
+HEALTH_CLOSED    = 'closed'
+HEALTH_OPEN      = 'open'
+HEALTH_HALF_OPEN = 'half-open'
+
+HealthStatus = namedtuple('HealthStatus', 'state failures retry_in last_error')
+
+class DeviceHealth:
+    # Circuit breaker of one device. After threshold consecutive failed reads the breaker
+    # opens and reads fail at once with DeviceUnavailableError. Once the backoff has passed a
+    # single read is let through as a probe, success closes the breaker, failure opens it again
+    # for twice the backoff, up to max_backoff.
+    def __init__(self, name: str, plan: HealthPlan):
+        self._name = name
+        self._plan = plan
+        self._lock = threading.Lock()
+
+        self._state = HEALTH_CLOSED
+        self._failures = 0
+        self._backoff = plan.backoff
+        self._retry_at = None
+        self._last_error = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    @property
+    def status(self) -> HealthStatus:
+        with self._lock:
+            retry_in = None
+            if self._retry_at is not None:
+                retry_in = max(0.0, self._retry_at - time.monotonic())
+            return HealthStatus(self._state, self._failures, retry_in, self._last_error)
+
+    @contextmanager
+    def guard(self):
+        # wraps one bus read of the device
+        self._admit()
+        try:
+            yield
+        except DeviceCapabilityError:
+            # not a bus failure, e.g. an unsupported capability
+            self._release()
+            raise
+        except Exception as e:
+            self._failed(e)
+            raise
+        else:
+            self._succeeded()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._state == HEALTH_CLOSED:
+                return
+            if self._state == HEALTH_OPEN and time.monotonic() >= self._retry_at:
+                logger.info('probing %s after %ss', self._name, self._backoff)
+                self._state = HEALTH_HALF_OPEN
+                return
+            raise DeviceUnavailableError('device {} unavailable, {} consecutive failures'.format(
+                self._name, self._failures))
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._state == HEALTH_HALF_OPEN:
+                self._state = HEALTH_OPEN
+
+    def _succeeded(self) -> None:
+        with self._lock:
+            if self._state != HEALTH_CLOSED:
+                logger.info('device %s responding again', self._name)
+            self._close()
+
+    def _failed(self, error: Exception) -> None:
+        with self._lock:
+            self._failures = self._failures + 1
+            self._last_error = str(error)
+            if self._state == HEALTH_HALF_OPEN:
+                self._backoff = min(self._backoff * 2, self._plan.max_backoff)
+                self._open()
+            elif self._failures >= self._plan.threshold:
+                logger.warning('device %s failed %s reads in a row, %s', self._name,
+                               self._failures, error)
+                self._open()
+
+    def _open(self) -> None:
+        self._state = HEALTH_OPEN
+        self._retry_at = time.monotonic() + self._backoff
+
+    def _close(self) -> None:
+        self._state = HEALTH_CLOSED
+        self._failures = 0
+        self._backoff = self._plan.backoff
+        self._retry_at = None
+        self._last_error = None
@@ -9,6 +9,8 @@ from .tools.mixins import NodeMixin
 logger = logging.getLogger(__name__)
 
 class MeterInterface(metaclass=abc.ABCMeta):
+    __slots__ = ()
+
     @classmethod
     def __subclasshook__(cls, subclass):
         return (hasattr(subclass, 'measure') and
@@ -56,11 +58,17 @@ class MeterInterface(metaclass=abc.ABCMeta):
         raise NotImplementedError
 
 class Meter(NodeMixin, MeterInterface):
+    __slots__ = ('_device', '_measurement')
+
     def __init__(self, device: devices.Device, measurement: int):
         super().__init__()
         self._device = device
         self._measurement = measurement
 
+    @property
+    def device(self) -> devices.Device:
+        return self._device
+
     @property
     def address(self) -> int:
         return self._device._address
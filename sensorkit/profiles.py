@@ -1,10 +1,17 @@
+from collections.abc import Callable
 from dataclasses import dataclass
 import logging
+import time
+from typing import Any, Optional
 
 import littletable as db
 
 from .constants import *
-from .datastructures import UniqueRecordByWhere
+from .datastructures import (
+        NonUniqueRecordQueryError,
+        Record,
+        UniqueRecordByWhere,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +23,8 @@ class DeviceProfile:
     device_id: int
     capabilities: list[int]
     kind: int
+    # discriminates between profiles sharing an address, called as probe(bus, address)
+    probe: Optional[Callable[[Any, int], bool]] = None
 
     def is_mux(self) -> bool:
         return True if self.kind == MUX else False
@@ -29,10 +38,41 @@ class DeviceProfile:
     def has_capability(self, cap: int) -> bool:
         return True if cap in self.capabilities else False
 
+# Mux probes write a pattern to the control register and read it back. A TCA9548A keeps all
+# eight channel bits, a PCA9546A only implements the four low ones and reads 0 in the high
+# nibble. Anything else at a mux address is left alone.
+MUX_PROBE_PATTERN = 0x85
+
+def _read_back(bus, address: int, pattern: int) -> int | None:
+    # the control register after writing pattern to it, None when the device does not take a
+    # bare one byte write and read. Every channel is deselected afterwards.
+    buf = bytearray(1)
+    while not bus.try_lock():
+        time.sleep(0)
+    try:
+        bus.writeto(address, bytes([pattern]))
+        bus.readfrom_into(address, buf)
+        bus.writeto(address, bytes([0x00]))
+    except OSError as e:
+        logger.debug('no mux control register at %s, %s', hex(address), e)
+        return None
+    finally:
+        bus.unlock()
+    return buf[0]
+
+def probe_four_channel(bus, address: int) -> bool:
+    return _read_back(bus, address, MUX_PROBE_PATTERN) == MUX_PROBE_PATTERN & 0x0f
+
+def probe_eight_channel(bus, address: int) -> bool:
+    return _read_back(bus, address, MUX_PROBE_PATTERN) == MUX_PROBE_PATTERN
+
 profiles = db.Table('profiles')
-profiles.insert(DeviceProfile('PCA9546A', 0x70, PCA9546A, [ FOUR_CHANNEL ], MUX))
-# FIXME need discovery discrimination before this will work
-#profiles.insert(DeviceProfile('TCA9548A', 0x70, TCA9548A, [ EIGHT_CHANNEL ], MUX))
+# the muxes are address configurable, 0x77 is left to the BMP390
+for addr in range(0x70, 0x77):
+    profiles.insert(DeviceProfile('PCA9546A', addr, PCA9546A, [ FOUR_CHANNEL ], MUX,
+                                  probe_four_channel))
+    profiles.insert(DeviceProfile('TCA9548A', addr, TCA9548A, [ EIGHT_CHANNEL ], MUX,
+                                  probe_eight_channel))
 profiles.insert(DeviceProfile('BMP390', 0x77, BMP390, [ PRESSURE, TEMPERATURE, ALTITUDE ], METER))
 profiles.insert(DeviceProfile('SHT41', 0x44, SHT41, [ TEMPERATURE, RELATIVE_HUMIDITY ], METER))
 profiles.insert(DeviceProfile('VEML7700', 0x10, VEML7700, [ AMBIENT_LIGHT, LUX ], METER))
@@ -45,3 +85,23 @@ profiles.create_index('name')
 profiles.create_index('address')
 profiles.create_index('device_id')
 profile_selector = UniqueRecordByWhere(profiles)
+
+mux_addresses = frozenset(p.address for p in profiles if p.is_mux())
+
+def discover(bus, address: int) -> Record:
+    # profile for a scanned address, probing the bus when a profile has a probe. Not found
+    # when no probe matches and no profile at the address goes without one.
+    candidates = profiles.where(address=address)
+    unprobed = [ c for c in candidates if c.probe is None ]
+    if len(unprobed) > 1:
+        msg = 'Table {} - address: {} - could not discriminate between {}'.format(
+                profiles.table_name, hex(address), [ c.name for c in unprobed ])
+        raise NonUniqueRecordQueryError(msg)
+
+    for candidate in candidates:
+        if candidate.probe is not None and candidate.probe(bus, address):
+            return Record(True, candidate)
+
+    if len(unprobed) == 1:
+        return Record(True, unprobed[0])
+    return Record(False, None)
@@ -0,0 +1,377 @@
+from collections import namedtuple
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Optional
+
+from .devices import DeviceCapabilityError
+from .health import DeviceUnavailableError
+from .meters import MeterInterface
+from .tools.mixins import SchedulableInterface
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_OK       = 0
+SAMPLE_ERROR    = 1
+# read fine but failed a plausibility filter, the value is kept for inspection
+SAMPLE_REJECTED = 2
+
+Sample = namedtuple('Sample', 'value timestamp status')
+
+# high rate sampling of a few meters for at most duration seconds and count samples
+Burst = namedtuple('Burst', 'interval duration count')
+
+class _ActiveBurst:
+    __slots__ = ('job_id', 'deadline', 'remaining')
+
+    def __init__(self, job_id: str, deadline: float, remaining: int | None):
+        self.job_id = job_id
+        self.deadline = deadline
+        self.remaining = remaining
+
+class _Cadence:
+    # adaptive sampling state of one meter
+    __slots__ = ('plan', 'interval', 'due', 'reference')
+
+    def __init__(self, plan: Any):
+        self.plan = plan
+        self.interval = plan.min_interval
+        self.due = 0.0
+        self.reference = None
+
+class Sampler(SchedulableInterface):
+    def __init__(self, tree, scheduler, interval: Optional[float] = None):
+        self._tree = tree
+        self._scheduler = scheduler
+        self._interval = interval
+        self._job = None
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+        self._latest = dict()
+        self._listeners = list()
+        self._inputs = list()
+        self._bursts = dict()
+        self._burst_ids = itertools.count()
+        self._filters = dict()
+        self._adaptive = dict()
+        self._cadence = dict()
+
+    @property
+    def interval(self) -> Optional[float]:
+        return self._interval
+
+    def schedule(self, immediate: bool) -> None:
+        if self._job is not None or self._interval is None:
+            return
+
+        if immediate:
+            self.sample()
+        self._job = self._scheduler.add_job(self.sample, 'interval', seconds=self._interval,
+                                            max_instances=1, coalesce=True)
+
+    def unschedule(self) -> None:
+        if self._job is not None:
+            self._job.remove()
+            self._job = None
+
+        with self._lock:
+            bursts, self._bursts = self._bursts, dict()
+        for burst in bursts.values():
+            self._remove_burst_job(burst.job_id)
+
+        # a sample still running keeps the pool it submitted to until its reads are done
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def add_listener(self, listener: callable) -> None:
+        # listeners are called with each new frame, {node_id: Sample}, on the sampling thread
+        if not callable(listener):
+            raise ValueError('listener must be callable')
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: callable) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def add_input(self, feed: callable) -> None:
+        # Feeds are called with the readings of each frame before the virtual meters are read,
+        # then with the virtual readings, so a meter computed from them is current in the
+        # frame it is read in. Meters computed from other virtual meters lag one frame.
+        if not callable(feed):
+            raise ValueError('feed must be callable')
+        self._inputs.append(feed)
+
+    def remove_input(self, feed: callable) -> None:
+        if feed in self._inputs:
+            self._inputs.remove(feed)
+
+    def set_filter(self, node_id: int, meter_filter: Optional[callable]) -> None:
+        # meter_filter(value, timestamp) returns None to accept a sample or the reason it is
+        # rejected, see filters.MeterFilter, None removes the meter's filter
+        with self._lock:
+            if meter_filter is None:
+                self._filters.pop(node_id, None)
+            else:
+                self._filters[node_id] = meter_filter
+
+    @property
+    def filters(self) -> dict[int, callable]:
+        with self._lock:
+            return dict(self._filters)
+
+    def set_adaptive(self, plans: Iterable[Any]) -> None:
+        # Meters of a measurement with a plan, see config.AdaptivePlan, are sampled only when
+        # due. A meter whose value stays within the deadband of the last change has its interval
+        # stretched by the factor up to the maximum, any larger change, or a failed or rejected
+        # sample, brings it back to the minimum. Other meters are sampled every interval.
+        plans = { plan.measurement: plan for plan in plans }
+        with self._lock:
+            if plans != self._adaptive:
+                self._adaptive = plans
+                self._cadence = dict()
+
+    @property
+    def intervals(self) -> dict[int, float]:
+        # current interval of every adaptively sampled meter
+        with self._lock:
+            return { node_id: cadence.interval for node_id, cadence in self._cadence.items() }
+
+    def latest(self, node_id: Optional[int] = None) -> dict[int, Sample] | Sample | None:
+        with self._lock:
+            if node_id is None:
+                return dict(self._latest)
+            return self._latest.get(node_id)
+
+    def forget(self, node_ids: Iterable[int]) -> None:
+        # drops the latest samples, filters and cadences of nodes removed from the tree
+        with self._lock:
+            for node_id in node_ids:
+                self._latest.pop(node_id, None)
+                self._filters.pop(node_id, None)
+                self._cadence.pop(node_id, None)
+
+    def sample(self) -> dict[int, Sample]:
+        # one worker per root bus, buses are read concurrently and the meters on a bus in
+        # order, virtual meters are read on the calling thread once the buses are done
+        groups = self._tree.meters_by_bus()
+        frame = dict()
+
+        now = time.monotonic()
+        if len(self._adaptive) > 0:
+            groups = self._due(groups, now)
+
+        futures = list()
+        buses = [ bus for bus in groups if bus is not None ]
+        if len(buses) > 0:
+            with self._pool_lock:
+                pool = self._executor(len(self._tree.buses))
+                futures = [ pool.submit(self._read, groups[bus]) for bus in buses ]
+
+        for future in futures:
+            frame.update(future.result())
+        self._filter(frame)
+        self._feed(frame)
+
+        if None in groups:
+            virtual = self._read(groups[None])
+            self._filter(virtual)
+            self._feed(virtual)
+            frame.update(virtual)
+
+        self._publish(frame)
+        if len(self._adaptive) > 0:
+            self._adapt(groups, frame, now)
+        return frame
+
+    def _due(self, groups: dict[Any, list[Any]], now: float) -> dict[Any, list[Any]]:
+        # a meter due before the next tick is read now, not a whole interval late
+        horizon = now + (self._interval or 0) / 2
+        due = dict()
+        with self._lock:
+            for bus, meters in groups.items():
+                meters = [ m for m in meters if m.measurement not in self._adaptive or
+                           m.node_id not in self._cadence or
+                           self._cadence[m.node_id].due <= horizon ]
+                if len(meters) > 0:
+                    due[bus] = meters
+        return due
+
+    def _adapt(self, groups: dict[Any, list[Any]], frame: dict[int, Sample],
+               now: float) -> None:
+        with self._lock:
+            for meters in groups.values():
+                for meter in meters:
+                    plan = self._adaptive.get(meter.measurement)
+                    sample = frame.get(meter.node_id)
+                    if plan is None or sample is None:
+                        continue
+                    cadence = self._cadence.get(meter.node_id)
+                    if cadence is None:
+                        cadence = _Cadence(plan)
+                        self._cadence[meter.node_id] = cadence
+                    self._stretch(cadence, sample, now)
+
+    @staticmethod
+    def _stretch(cadence: _Cadence, sample: Sample, now: float) -> None:
+        plan = cadence.plan
+        value = sample.value
+        if sample.status != SAMPLE_OK or not isinstance(value, (int, float)):
+            cadence.interval = plan.min_interval
+        elif cadence.reference is None or abs(value - cadence.reference) > plan.deadband:
+            cadence.interval = plan.min_interval
+            cadence.reference = value
+        else:
+            cadence.interval = min(cadence.interval * plan.factor, plan.max_interval)
+        cadence.due = now + cadence.interval
+
+    @property
+    def bursts(self) -> int:
+        with self._lock:
+            return len(self._bursts)
+
+    def burst(self, targets: list[Any], burst: Burst) -> None:
+        # Samples the target meters, or every meter of target devices, every burst.interval
+        # seconds alongside the normal cadence, until burst.duration or burst.count runs out.
+        # Listeners receive these frames too, holding only the burst meters. A burst already
+        # running on the same meters is extended rather than doubled.
+        meters = list()
+        for target in targets:
+            if isinstance(target, MeterInterface):
+                meters.append(target)
+            else:
+                meters.extend(c for c in self._tree.children(target)
+                              if isinstance(c, MeterInterface))
+        if len(meters) == 0:
+            return
+
+        key = frozenset(m.node_id for m in meters)
+        deadline = time.monotonic() + burst.duration
+        with self._lock:
+            active = self._bursts.get(key)
+            if active is not None:
+                active.deadline = deadline
+                active.remaining = burst.count
+                return
+
+            job_id = 'sensorkit-burst-{}'.format(next(self._burst_ids))
+            self._bursts[key] = _ActiveBurst(job_id, deadline, burst.count)
+
+        logger.debug('burst sampling %s meters every %ss', len(meters), burst.interval)
+        self._scheduler.add_job(self._burst_sample, 'interval', seconds=burst.interval,
+                                args=(key, meters), id=job_id,
+                                next_run_time=datetime.now(timezone.utc),
+                                max_instances=1, coalesce=True)
+
+    def _burst_sample(self, key: frozenset, meters: list[Any]) -> None:
+        with self._lock:
+            active = self._bursts.get(key)
+            if active is None:
+                return
+            done = time.monotonic() >= active.deadline or \
+                    (active.remaining is not None and active.remaining <= 0)
+            if done:
+                del self._bursts[key]
+            elif active.remaining is not None:
+                active.remaining = active.remaining - 1
+
+        if done:
+            self._remove_burst_job(active.job_id)
+            return
+
+        frame = self._read(meters)
+        self._filter(frame)
+        self._feed(frame)
+        self._publish(frame)
+
+    def _remove_burst_job(self, job_id: str) -> None:
+        try:
+            self._scheduler.remove_job(job_id)
+        except Exception as e:
+            logger.debug('burst job %s already gone, %s', job_id, e)
+
+    def _filter(self, frame: dict[int, Sample]) -> None:
+        with self._lock:
+            for node_id, meter_filter in self._filters.items():
+                sample = frame.get(node_id)
+                if sample is None or sample.status != SAMPLE_OK:
+                    continue
+                reason = meter_filter(sample.value, sample.timestamp)
+                if reason is not None:
+                    logger.debug('sample %s of %s rejected, %s', sample.value, node_id, reason)
+                    frame[node_id] = Sample(sample.value, sample.timestamp, SAMPLE_REJECTED)
+
+    def _feed(self, frame: dict[int, Sample]) -> None:
+        for feed in list(self._inputs):
+            try:
+                feed(frame)
+            except Exception as e:
+                logger.warning('sample input %s raised %s', feed, e)
+
+    def _publish(self, frame: dict[int, Sample]) -> None:
+        # frame is filtered already
+        with self._lock:
+            self._latest.update(frame)
+
+        for listener in list(self._listeners):
+            try:
+                listener(frame)
+            except Exception as e:
+                logger.warning('sample listener %s raised %s', listener, e)
+
+    def _executor(self, workers: int) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=max(1, workers),
+                                            thread_name_prefix='sensorkit-bus')
+        return self._pool
+
+    def _read(self, meters: list[Any]) -> dict[int, Sample]:
+        # meters of one device are adjacent in the tree, each device is read in a single bulk
+        # call, falling back to meter by meter reads when a capability cannot be read in bulk
+        frame = dict()
+        for device, group in itertools.groupby(meters, key=lambda m: getattr(m, 'device', None)):
+            group = list(group)
+            if device is not None and len(group) > 1:
+                try:
+                    values = device.read_capabilities([ m.measurement for m in group ])
+                    now = time.time()
+                    for meter in group:
+                        frame[meter.node_id] = Sample(values[meter.measurement], now, SAMPLE_OK)
+                    continue
+                except DeviceUnavailableError:
+                    # the breaker is open, reading meter by meter would fail the same way
+                    pass
+                except DeviceCapabilityError as e:
+                    logger.debug('bulk read of %s failed, %s', device.name, e)
+                    for meter in group:
+                        frame.update(self._read_one(meter))
+                    continue
+                except Exception as e:
+                    # a bus error, retrying meter by meter would count it against the
+                    # device's breaker once per meter
+                    logger.warning('sampling %s failed, %s', device.name, e)
+
+                now = time.time()
+                for meter in group:
+                    frame[meter.node_id] = Sample(None, now, SAMPLE_ERROR)
+                continue
+
+            for meter in group:
+                frame.update(self._read_one(meter))
+        return frame
+
+    def _read_one(self, meter: Any) -> dict[int, Sample]:
+        try:
+            return { meter.node_id: Sample(meter.measure, time.time(), SAMPLE_OK) }
+        except DeviceUnavailableError:
+            return { meter.node_id: Sample(None, time.time(), SAMPLE_ERROR) }
+        except Exception as e:
+            logger.warning('sampling %s:%s failed, %s', meter.name, meter.measurement, e)
+            return { meter.node_id: Sample(None, time.time(), SAMPLE_ERROR) }
@@ -1,71 +1,110 @@
+from collections.abc import Mapping
 from importlib import import_module
 import logging
 from typing import Any, Optional
 
 from busio import I2C
 
+from .arbiter import PRIORITY_CALIBRATION
 from .calibration import Calibration
-from .config import Config
-from .constants import VIRTUAL
-from .datastructures import (
-        join_devices,
-        devicetypes_selector,
-        nodes,
+from .collector import CollectorClient
+from .config import (
+        CalibrationPlan,
+        Config,
+        FilterPlan,
+        ParameterPlan,
+        SensorPlan,
+        VirtualPlan,
+        thaw,
 )
+from .constants import VIRTUAL
+from .datastructures import Registry
+from .detectors import DetectorInterface
 from .devices import device_factory, DeviceInterface
 from .devicetree import DeviceTree
+from .filters import make_filter
+from .health import HealthStatus
+from .sampler import Sampler
+from .shm import LatestValuesWriter
+from .state import StateStore
+from .stream import StreamServer
 from .tools.mixins import RunnableInterface, SchedulableInterface
 
 logger = logging.getLogger(__name__)
 
 class SensorParameters(RunnableInterface):
-    def __init__(self, selectors: dict[str, Any], parameters: dict[str, dict[str, Any]],
-                 reset_at_exit: Optional[bool] = None):
-        self._reset = reset_at_exit if (reset_at_exit is not None and
-                                        reset_at_exit is True) else False
-        self._selectors = None
-        self._parameters = None
-
-        if selectors is not None:
-            self._selectors = selectors
-            if 'name' in self._selectors:
-                self._selectors['name'] = self._selectors['name'].upper()
-
-            if 'channel_id' in self._selectors:
-                self._selectors['has_channel'] = True
-        else:
-            raise ValueError('selectors cannot be None')
-
-        if parameters is not None:
-            self._parameters = parameters
+    def __init__(self, plan: SensorPlan, registry: Registry,
+                 state: Optional[StateStore] = None):
+        if plan is None:
+            raise ValueError('plan cannot be None')
+
+        self._plan = plan
+        self._registry = registry
+        self._reset = plan.reset_at_exit
+        self._selectors = plan.selectors
+        self._parameters = plan.parameters
+        self._state = state
+        self._saved = dict()
+
+    @property
+    def plan(self) -> SensorPlan:
+        return self._plan
 
     @property
-    def selectors(self) -> dict[str, Any]:
+    def selectors(self) -> Mapping[str, Any]:
         return self._selectors
 
     @property
-    def parameter(self) -> dict[str, Any]:
+    def parameter(self) -> tuple[ParameterPlan, ...]:
         return self._parameters
 
     def pre_run(self):
-        devices = join_devices()
+        devices = self._registry.join_devices()
 
         for device in devices.where(**self._selectors):
-            chan = device.channel_id if device.has_channel is True else '-'
-            logger.info('applying config to device {} {} {}'.format(device.name,
-                                                                    device.address,
-                                                                    chan))
-            dev = device.obj
-            for param in self._parameters:
-                if hasattr(dev.real_device, param['property']):
-                    param['saved_value'] = getattr(dev.real_device, param['property'])
-                    setattr(dev.real_device, param['property'], param['value'])
+            self._apply(device)
+
+    def apply_to(self, obj) -> None:
+        # applies the parameters to a single, newly discovered device when it matches
+        devices = self._registry.join_devices()
+
+        for device in devices.where(**self._selectors, node_id=obj.node_id):
+            self._apply(device)
+
+    def _apply(self, device) -> None:
+        chan = device.channel_id if device.has_channel is True else '-'
+        logger.info('applying config to device {} {} {}'.format(device.name,
+                                                                device.address,
+                                                                chan))
+        dev = device.obj
+        for param in self._parameters:
+            if hasattr(dev.real_device, param.property):
+                key = self._state_key(device, param.property)
+                with dev.access(PRIORITY_CALIBRATION):
+                    current = getattr(dev.real_device, param.property)
+
+                # the saved original survives restarts, a crash would otherwise leave the
+                # configured value behind as the "original"
+                entry = self._state.get(key) if self._state is not None else None
+                if entry is not None:
+                    self._saved[key] = entry.value
+                else:
+                    self._saved[key] = current
+                    if self._state is not None:
+                        self._state.set(key, current)
+
+                if current == param.value:
+                    logger.debug('%s already set to %s, skipping write', param.property,
+                                 current)
+                    continue
+                with dev.access(PRIORITY_CALIBRATION):
+                    setattr(dev.real_device, param.property, param.value)
 
     def run(self):
         pass
 
     def stop(self):
-        devices = join_devices()
+        devices = self._registry.join_devices()
 
         for device in devices.where(**self._selectors):
             chan = device.channel_id if device.has_channel is True else '-'
@@ -74,55 +113,114 @@ class SensorParameters(RunnableInterface):
                                                                             chan))
             dev = device.obj
             for param in self._parameters:
-                if hasattr(dev.real_device, param['property']):
-                    setattr(dev.real_device, param['property'], param['saved_value'])
+                key = self._state_key(device, param.property)
+                if hasattr(dev.real_device, param.property) and key in self._saved:
+                    with dev.access(PRIORITY_CALIBRATION):
+                        setattr(dev.real_device, param.property, self._saved.pop(key))
+                    if self._state is not None:
+                        self._state.delete(key)
+
+    def _state_key(self, device, prop: str) -> str:
+        chan = device.channel_id if device.has_channel is True else '-'
+        return 'parameter:{}:{}:{}:{}'.format(device.name, hex(device.address), chan, prop)
 
 class SensorKit(RunnableInterface):
-    def __init__(self, bus: I2C, config: dict[str, Any] | Config, scheduler):
+    def __init__(self, bus: I2C | list[I2C], config: dict[str, Any] | Config, scheduler):
         self._bus = bus
         self._config = Config(config) if isinstance(config, dict) else config
+        self._plan = self._config.compile()
 
         self._env = self._config.env
 
-        self._tree = DeviceTree(bus, self._env)
+        self._registry = Registry()
+        self._tree = DeviceTree(bus, self._env, self._registry, self._plan.health)
         self._tree.build()
         self._scheduler = scheduler
 
         self._listeners = []
 
-        self._static_args = {
-            'scheduler': self._scheduler,
-        }
+        self._state = None
+        if self._plan.state.path is not None:
+            self._state = StateStore(self._plan.state.path, self._plan.state.max_age)
 
-        for sensor in self._config.sensors:
-            logger.info('preparing sensor config for application {}'.format(sensor))
-            self.register_listener(SensorParameters(**sensor))
+        self._running = False
+        self._presence_job = None
+        self._sensor_params = []
+        self._virtuals = {}
+        self._calibrations = []
 
-        self._virtual_devices = self._config.virtual_devices
-        for dev in self._virtual_devices:
-            conf = self._virtual_devices[dev]
-            objs = self._instantiate_device(dev, conf)
+        for plan in self._plan.sensors:
+            self._add_sensor(plan)
 
-            for d in objs:
-                field = devicetypes_selector('type', device=conf['type'])
-                if field.found is False:
-                    logger.warning('skipping unknown device: %s', conf['type'])
-                    continue
+        # virtual devices may be derived from sampled values, the sampler comes first
+        self._sampler = Sampler(self._tree, self._scheduler, self._plan.sampler.interval)
 
-                self._tree.add(d, (field.field | VIRTUAL), None)
+        self._static_args = {
+            'scheduler': self._scheduler,
+            'sampler': self._sampler,
+            'registry': self._registry,
+        }
 
-        calibrations = self._config.calibrations
-        self._build_calibrations(calibrations)
+        for plan in self._plan.virtual_devices.values():
+            self._add_virtual(plan)
+        self._resolve_virtuals()
+
+        for plan in self._plan.calibrations:
+            self._add_calibration(plan)
+
+        self.register_listener(self._sampler)
+        self._apply_filters(self._plan.sampler.filters)
+        self._sampler.set_adaptive(self._plan.sampler.adaptive)
+
+        # latest values published for other processes, see shm.LatestValuesReader
+        self._latest_values = None
+        if self._plan.sampler.shared_memory is not None:
+            self._latest_values = LatestValuesWriter(self._plan.sampler.shared_memory,
+                                                     self._tree)
+            self._sampler.add_listener(self._latest_values)
+
+        # frames pushed in batches to a fleet collector, runs and stops with the kit
+        self._collector = None
+        if self._plan.collector is not None:
+            collector = self._plan.collector
+            self._collector = CollectorClient(collector.node, collector.address, self._tree,
+                                              collector.interval, collector.buffer)
+            self._sampler.add_listener(self._collector)
+            self.register_listener(self._collector)
+
+        # live change-only deltas for dashboards, served while the kit runs
+        self._stream = None
+        if self._plan.stream is not None:
+            self._stream = StreamServer(self._tree, self._plan.stream.address,
+                                        self._plan.stream.queue)
+            self._sampler.add_listener(self._stream)
+            self.register_listener(self._stream)
 
     def register_listener(self, obj: [RunnableInterface | SchedulableInterface]):
         if not isinstance(obj, RunnableInterface) and not isinstance(obj, SchedulableInterface):
             raise ValueError('must be a RunnableInterface or SchedulableInterface')
         self._listeners.append(obj)
 
+    def unregister_listener(self, obj: [RunnableInterface | SchedulableInterface]):
+        if obj in self._listeners:
+            self._listeners.remove(obj)
+
     @property
     def tree(self) -> DeviceTree:
         return self._tree
 
+    @property
+    def config(self) -> Config:
+        return self._config
+
+    @property
+    def sampler(self) -> Sampler:
+        return self._sampler
+
+    def health(self) -> dict[int, HealthStatus]:
+        # circuit breaker state of every device, keyed by node id
+        return self._tree.health()
+
     def run(self):
         # Order:
         #   Pre:
@@ -138,11 +236,21 @@ class SensorKit(RunnableInterface):
                 obj.pre_run()
                 obj.run()
 
-        for node in nodes:
+        for node in self._registry.nodes:
             if node.obj is not None and isinstance(node.obj, RunnableInterface):
                 node.obj.run()
 
+        if self._plan.presence_check is not None:
+            self._presence_job = self._scheduler.add_job(self.check_presence, 'interval',
+                                                         seconds=self._plan.presence_check)
+
+        self._running = True
+
     def stop(self):
+        if self._presence_job is not None:
+            self._presence_job.remove()
+            self._presence_job = None
+
         # Order:
         #   Pre:
         #     - SchedulableInterfaces
@@ -156,25 +264,280 @@ class SensorKit(RunnableInterface):
             if isinstance(obj, RunnableInterface):
                 obj.stop()
 
-        for node in nodes:
+        for node in self._registry.nodes:
             if node.obj is not None and isinstance(node.obj, RunnableInterface):
                 node.obj.stop()
 
-    def _build_calibrations(self, calibrations) -> None:
-        for c in calibrations:
-            for d in join_devices().where(name=c.upper()):
-                for conf in calibrations[c]:
-                    cobj = Calibration(c, conf, d.obj, self._tree, self._scheduler)
-                    self.register_listener(cobj)
-
-    def _instantiate_device(self, name: str, config: dict[str, Any]) -> DeviceInterface:
-        module = import_module(config['module'], package='sensorkit')
+        self._running = False
+
+    def release(self) -> None:
+        # Tears the kit down for good, stopping it when running and dropping every node so the
+        # devices and meters it built can be reclaimed. The kit cannot be run again.
+        if self._running:
+            self.stop()
+
+        for obj in list(self._listeners):
+            self.unregister_listener(obj)
+        for name in list(self._virtuals):
+            _, objs = self._virtuals.pop(name)
+            for obj in objs:
+                obj.retire()
+        self._sensor_params = []
+        self._calibrations = []
+
+        if self._collector is not None:
+            self._sampler.remove_listener(self._collector)
+            self._collector = None
+        if self._stream is not None:
+            self._sampler.remove_listener(self._stream)
+            self._stream = None
+        if self._latest_values is not None:
+            self._sampler.remove_listener(self._latest_values)
+            self._latest_values.close()
+            self._latest_values = None
+
+        self._tree.release()
+
+    def reload(self, config: dict[str, Any] | Config) -> None:
+        # Applies only the differences between the running and the new config. The device
+        # tree is left alone, env and state changes need a restart. The new config is compiled
+        # before anything is touched so an invalid config leaves the kit as it was.
+        config = Config(config) if isinstance(config, dict) else config
+        plan = config.compile()
+
+        # sections only read when the kit is built
+        for section, current, wanted in (
+                ('env', self._plan.env, plan.env),
+                ('state', self._plan.state, plan.state),
+                ('health', self._plan.health, plan.health),
+                ('presence-check', self._plan.presence_check, plan.presence_check),
+                ('sampler interval', self._plan.sampler.interval, plan.sampler.interval),
+                ('sampler shared-memory', self._plan.sampler.shared_memory,
+                 plan.sampler.shared_memory),
+                ('collector', self._plan.collector, plan.collector),
+                ('stream', self._plan.stream, plan.stream)):
+            if current != wanted:
+                logger.warning('reload: %s changes are not applied, restart to apply them',
+                               section)
+
+        # sensors
+        wanted = list(plan.sensors)
+        kept = []
+        for sensor in self._sensor_params:
+            if sensor.plan in wanted:
+                wanted.remove(sensor.plan)
+                kept.append(sensor)
+            else:
+                logger.info('reload: removing sensor config %s', sensor.plan)
+                self._retire_listener(sensor)
+        self._sensor_params = kept
+        for sensor_plan in wanted:
+            obj = self._add_sensor(sensor_plan)
+            if self._running:
+                obj.pre_run()
+                obj.run()
 
-        builder_name = config['builder']
-        builder = getattr(module, builder_name)
-        build_obj = builder(name, config['capabilities'])
+        # virtual devices
+        changed = set()
+        for name in list(self._virtuals):
+            if plan.virtual_devices.get(name) != self._virtuals[name][0]:
+                logger.info('reload: retiring virtual device %s', name)
+                self._remove_virtual(name)
+                changed.add(name)
+        for name, virtual_plan in plan.virtual_devices.items():
+            if name not in self._virtuals:
+                logger.info('reload: adding virtual device %s', name)
+                objs = self._add_virtual(virtual_plan)
+                changed.add(name)
+                if self._running:
+                    for obj in objs:
+                        if isinstance(obj, RunnableInterface):
+                            obj.run()
+        if len(changed) > 0:
+            self._resolve_virtuals()
+
+        # calibrations, rebuilt when their entry changed or their virtual source was replaced
+        wanted = list(plan.calibrations)
+        kept = []
+        for calibration_plan, objs in self._calibrations:
+            if calibration_plan in wanted and not (calibration_plan.source_kind == 'virtual' and
+                                                   calibration_plan.source in changed):
+                wanted.remove(calibration_plan)
+                kept.append((calibration_plan, objs))
+            else:
+                logger.info('reload: removing calibration %s', calibration_plan)
+                for obj in objs:
+                    self._retire_listener(obj)
+        self._calibrations = kept
+        for calibration_plan in wanted:
+            logger.info('reload: adding calibration %s', calibration_plan)
+            objs = self._add_calibration(calibration_plan)
+            if self._running:
+                for obj in objs:
+                    obj.schedule(True)
+
+        if plan.sampler.filters != self._plan.sampler.filters:
+            self._apply_filters(plan.sampler.filters)
+        if plan.sampler.adaptive != self._plan.sampler.adaptive:
+            self._sampler.set_adaptive(plan.sampler.adaptive)
+
+        self._config = config
+        self._plan = plan
+
+    def rescan(self, channel=None) -> tuple[list[Any], list[Any]]:
+        # Incrementally rescans the root bus, or one mux channel, and brings sensor parameters
+        # and calibrations in line with the devices that appeared or vanished.
+        added, removed = self._tree.rescan(channel)
+        if len(added) == 0 and len(removed) == 0:
+            return added, removed
+
+        # stop what the vanished devices left running, detectors release their edge callbacks
+        for obj in removed:
+            try:
+                if isinstance(obj, DetectorInterface):
+                    obj.disable()
+                elif self._running and isinstance(obj, RunnableInterface):
+                    obj.stop()
+            except Exception as e:
+                logger.warning('rescan: unable to stop removed %s cleanly, %s', obj, e)
+
+        gone = set(obj.node_id for obj in removed)
+        self._sampler.forget(gone)
+        new_devices = [ obj for obj in added if isinstance(obj, DeviceInterface) ]
+        new_names = set(obj.name for obj in new_devices)
+
+        for obj in new_devices:
+            for sensor in self._sensor_params:
+                sensor.apply_to(obj)
+            if self._running and isinstance(obj, RunnableInterface):
+                obj.run()
 
-        args = { **self._static_args, **config['args'] }
+        # rebuild calibrations that target or read from any device that came or went, and
+        # retry those left without a source. The new objects are built before the old ones
+        # are retired so a failed rebuild keeps the calibration.
+        kept = list()
+        for plan, objs in self._calibrations:
+            touched = len(objs) == 0 or plan.device_name in new_names or \
+                    (plan.source_kind == 'meter' and plan.source in new_names) or \
+                    any(obj.device.node_id in gone or
+                        any(s.node_id in gone for s in obj.sources) for obj in objs)
+            if not touched:
+                kept.append((plan, objs))
+                continue
+
+            try:
+                rebuilt = self._build_calibration(plan)
+            except Exception as e:
+                logger.warning('rescan: unable to rebuild calibration %s, %s', plan, e)
+                kept.append((plan, objs))
+                continue
+
+            logger.info('rescan: rebuilding calibration %s', plan)
+            for obj in objs:
+                self._retire_listener(obj)
+            for obj in rebuilt:
+                self.register_listener(obj)
+                if self._running:
+                    obj.schedule(True)
+            kept.append((plan, rebuilt))
+        self._calibrations = kept
+
+        self._resolve_virtuals()
+        self._apply_filters(self._plan.sampler.filters)
+        return added, removed
+
+    def check_presence(self) -> None:
+        for channel in self._tree.presence_changed():
+            logger.info('presence check found changes on %s, rescanning', channel.node_id)
+            self.rescan(channel)
+
+    def _apply_filters(self, plans: tuple[FilterPlan, ...]) -> None:
+        # one filter per meter, a filter whose plan is unchanged keeps its window
+        wanted = dict()
+        devices = self._registry.join_devices()
+        for plan in plans:
+            for device in devices.where(name=plan.device_name):
+                for meter in self._tree.children(device.obj):
+                    if getattr(meter, 'measurement', None) == plan.measurement:
+                        wanted[meter.node_id] = (plan, meter)
+
+        current = self._sampler.filters
+        for node_id, meter_filter in current.items():
+            if node_id not in wanted or wanted[node_id][0] != meter_filter.plan:
+                self._sampler.set_filter(node_id, None)
+        for node_id, (plan, meter) in wanted.items():
+            if node_id not in current or current[node_id].plan != plan:
+                self._sampler.set_filter(node_id, make_filter(plan, meter))
+
+    def _add_sensor(self, plan: SensorPlan) -> SensorParameters:
+        logger.info('preparing sensor config for application {}'.format(plan))
+        obj = SensorParameters(plan, self._registry, state=self._state)
+        self._sensor_params.append(obj)
+        self.register_listener(obj)
+        return obj
+
+    def _add_virtual(self, plan: VirtualPlan) -> list[Any]:
+        objs = self._instantiate_device(plan)
+        for d in objs:
+            self._tree.add(d, (plan.kind | VIRTUAL), None)
+
+        self._virtuals[plan.name] = (plan, objs)
+        return objs
+
+    def _resolve_virtuals(self) -> None:
+        # virtual devices may read from any node, including virtual devices declared after
+        # them, their sources are looked up again whenever nodes came or went
+        for _, objs in self._virtuals.values():
+            for resolve in dict.fromkeys(obj.resolve for obj in objs):
+                resolve()
+
+    def _remove_virtual(self, name: str) -> None:
+        _, objs = self._virtuals.pop(name)
+        for obj in objs:
+            if self._running and isinstance(obj, RunnableInterface):
+                obj.stop()
+            obj.retire()
+            self._tree.remove(obj)
+        self._sampler.forget(obj.node_id for obj in objs)
+
+    def _add_calibration(self, plan: CalibrationPlan) -> list[Calibration]:
+        objs = self._build_calibration(plan)
+        for cobj in objs:
+            self.register_listener(cobj)
+
+        self._calibrations.append((plan, objs))
+        return objs
+
+    def _build_calibration(self, plan: CalibrationPlan) -> list[Calibration]:
+        # one calibration per target device, none while the source is missing, the plan is
+        # kept and retried on the next rescan
+        objs = []
+        for d in self._registry.join_devices().where(name=plan.device_name):
+            cobj = Calibration(plan, d.obj, self._tree, self._scheduler, self._state,
+                               sampler=self._sampler)
+            if len(cobj.sources) == 0:
+                logger.warning('calibration %s of %s: no %s source %s, retried on the next '
+                               'rescan', plan.attribute, plan.device_name, plan.source_kind,
+                               plan.source)
+                return []
+            objs.append(cobj)
+        return objs
+
+    def _retire_listener(self, obj: [RunnableInterface | SchedulableInterface]) -> None:
+        if isinstance(obj, SchedulableInterface):
+            obj.unschedule()
+        if self._running and isinstance(obj, RunnableInterface):
+            obj.stop()
+        self.unregister_listener(obj)
+
+    def _instantiate_device(self, plan: VirtualPlan) -> list[DeviceInterface]:
+        module = import_module(plan.module, package='sensorkit')
+
+        builder = getattr(module, plan.builder)
+        build_obj = builder(plan.name, list(plan.capabilities))
+
+        # builders own their arguments, hand them a mutable copy of the frozen plan
+        args = { **self._static_args, **thaw(plan.args) }
         objects = build_obj(**args)
 
         return objects
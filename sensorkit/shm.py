@@ -0,0 +1,210 @@
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Any, Optional
+
+from .datastructures import capabilities_selector
+from .sampler import Sample
+
+logger = logging.getLogger(__name__)
+
+# Layout of the latest-values file, little endian:
+#
+#   header  magic, version, capacity, index size, index sequence
+#   slots   capacity slots of sequence, node id, value, timestamp, status
+#   index   JSON {key: slot}, key is 'bus:mux hops:name:address:measurement', see meter_key
+#
+# Slots and the index use a seqlock. The writer makes the sequence odd, writes, then makes it
+# even again, a reader retries while the sequence is odd or changed under it.
+MAGIC = b'SKLV'
+VERSION = 2
+
+_HEADER = struct.Struct('<4sHxxIII')
+_SLOT = struct.Struct('<IIddB7x')
+
+DEFAULT_CAPACITY = 256
+DEFAULT_INDEX_SIZE = 64 * 1024
+READ_RETRIES = 1000
+
+def meter_key(meter: Any, bus: int | None) -> str:
+    # Root bus, every (mux address, channel) hop, then device and measurement, unique even for
+    # identical devices on other buses or behind other muxes, e.g.
+    # bus0:0x70.1/0x71.2:BMP390:0x77:pressure. Virtual meters have no bus or hops.
+    measurement = capabilities_selector('capability', id=meter.measurement)
+    device = getattr(meter, 'device', meter)
+    hops = '/'.join('{}.{}'.format(hex(addr) if addr is not None else '-', chan)
+                    for addr, chan in getattr(device, 'channel_path', ()))
+    return '{}:{}:{}:{}:{}'.format('bus{}'.format(bus) if bus is not None else 'virtual',
+                                   hops or '-', meter.name, hex(meter.address),
+                                   measurement.field if measurement.found else meter.measurement)
+
+def _slot_offset(slot: int) -> int:
+    return _HEADER.size + slot * _SLOT.size
+
+class LatestValuesWriter:
+    # Sampler listener publishing the latest sample of every meter into a shared file, readers
+    # in other processes never touch the bus
+    def __init__(self, path: str, tree, capacity: int = DEFAULT_CAPACITY,
+                 index_size: int = DEFAULT_INDEX_SIZE):
+        self._path = path
+        self._tree = tree
+        self._capacity = capacity
+        self._index_size = index_size
+        self._slots = dict()
+        self._keys = dict()
+        self._lock = threading.Lock()
+
+        size = _HEADER.size + capacity * _SLOT.size + index_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        _HEADER.pack_into(self._map, 0, MAGIC, VERSION, capacity, index_size, 0)
+        self._write_index()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def __call__(self, frame: dict[int, Sample]) -> None:
+        with self._lock:
+            if self._map is None:
+                return
+
+            changed = False
+            for node_id, sample in frame.items():
+                slot = self._slots.get(node_id)
+                if slot is None:
+                    slot = self._assign(node_id)
+                    if slot is None:
+                        continue
+                    changed = True
+                self._write_slot(slot, node_id, sample)
+
+            if changed:
+                self._write_index()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+    def _assign(self, node_id: int) -> int | None:
+        key = None
+        for node in self._tree.registry.nodes.where(node_id=node_id):
+            key = meter_key(node.obj, node.bus)
+        if key is None:
+            return None
+
+        # a meter found again by a rescan or reload gets a new node id but keeps its key, it
+        # takes over the slot of the node it replaces so readers keep their index entry
+        slot = self._keys.get(key)
+        if slot is not None:
+            for stale in [ n for n, s in self._slots.items() if s == slot ]:
+                del self._slots[stale]
+            self._slots[node_id] = slot
+            return slot
+
+        if len(self._keys) >= self._capacity:
+            logger.warning('latest values table full, meter %s not published', node_id)
+            return None
+
+        slot = len(self._keys)
+        self._slots[node_id] = slot
+        self._keys[key] = slot
+        return slot
+
+    def _write_slot(self, slot: int, node_id: int, sample: Sample) -> None:
+        offset = _slot_offset(slot)
+        seq = struct.unpack_from('<I', self._map, offset)[0]
+        struct.pack_into('<I', self._map, offset, (seq + 1) & 0xffffffff)
+        value = sample.value if isinstance(sample.value, (int, float)) else math.nan
+        _SLOT.pack_into(self._map, offset, (seq + 1) & 0xffffffff, node_id, float(value),
+                        sample.timestamp, sample.status)
+        struct.pack_into('<I', self._map, offset, (seq + 2) & 0xffffffff)
+
+    def _write_index(self) -> None:
+        data = json.dumps(self._keys, separators=(',', ':')).encode()
+        if len(data) + 4 > self._index_size:
+            logger.warning('latest values index exceeds %s bytes, not updated', self._index_size)
+            return
+
+        seq_at = _HEADER.size - 4
+        seq = struct.unpack_from('<I', self._map, seq_at)[0]
+        struct.pack_into('<I', self._map, seq_at, (seq + 1) & 0xffffffff)
+        offset = _slot_offset(self._capacity)
+        struct.pack_into('<I', self._map, offset, len(data))
+        self._map[offset + 4:offset + 4 + len(data)] = data
+        struct.pack_into('<I', self._map, seq_at, (seq + 2) & 0xffffffff)
+
+class LatestValuesReader:
+    # Lock free reads of a table published by LatestValuesWriter, in this or another process
+    def __init__(self, path: str):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self._map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        magic, version, capacity, index_size, _ = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a sensorkit latest values table'.format(path))
+        self._capacity = capacity
+        self._index_seq = None
+        self._index = dict()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def names(self) -> list[str]:
+        return list(self._load_index())
+
+    def read(self, name: str) -> Optional[Sample]:
+        slot = self._load_index().get(name)
+        if slot is None:
+            return None
+        return self._read_slot(slot)
+
+    def read_all(self) -> dict[str, Sample]:
+        return { name: self._read_slot(slot) for name, slot in self._load_index().items() }
+
+    def _read_slot(self, slot: int) -> Sample:
+        offset = _slot_offset(slot)
+        for _ in range(READ_RETRIES):
+            seq, _, value, timestamp, status = _SLOT.unpack_from(self._map, offset)
+            if seq & 1 == 0 and struct.unpack_from('<I', self._map, offset)[0] == seq:
+                if math.isnan(value):
+                    value = None
+                return Sample(value, timestamp, status)
+            time.sleep(0)
+        raise TimeoutError('slot {} kept changing while read'.format(slot))
+
+    def _load_index(self) -> dict[str, int]:
+        seq_at = _HEADER.size - 4
+        for _ in range(READ_RETRIES):
+            seq = struct.unpack_from('<I', self._map, seq_at)[0]
+            if seq == self._index_seq:
+                return self._index
+            if seq & 1 == 1:
+                time.sleep(0)
+                continue
+
+            offset = _slot_offset(self._capacity)
+            length = struct.unpack_from('<I', self._map, offset)[0]
+            data = bytes(self._map[offset + 4:offset + 4 + length])
+            if struct.unpack_from('<I', self._map, seq_at)[0] != seq:
+                continue
+
+            self._index = json.loads(data) if length > 0 else dict()
+            self._index_seq = seq
+            return self._index
+        raise TimeoutError('index kept changing while read')
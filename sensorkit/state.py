@@ -0,0 +1,87 @@
+from collections import namedtuple
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+StateEntry = namedtuple('StateEntry', 'value timestamp')
+
+class StateStore:
+    def __init__(self, path: str, max_age: Optional[float] = None):
+        self._path = path
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # held from the snapshot through the replace so an older snapshot never lands last
+        self._save_lock = threading.Lock()
+        self._entries = dict()
+
+        self.load()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def max_age(self) -> Optional[float]:
+        return self._max_age
+
+    def load(self) -> None:
+        try:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.info('no saved state at %s, starting clean', self._path)
+            return
+        except (OSError, ValueError) as e:
+            logger.warning('unable to load saved state from %s: %s', self._path, e)
+            return
+
+        with self._lock:
+            self._entries = { k: StateEntry(v['value'], v['timestamp']) for k, v in data.items() }
+
+    def save(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self._path))
+        with self._save_lock:
+            with self._lock:
+                data = { k: { 'value': e.value, 'timestamp': e.timestamp }
+                         for k, e in self._entries.items() }
+
+            tmp = None
+            try:
+                fd, tmp = tempfile.mkstemp(dir=directory, prefix='.sensorkit-state-')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp, self._path)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning('unable to save state to %s: %s', self._path, e)
+                if tmp is not None:
+                    try:
+                        os.unlink(tmp)
+                    except FileNotFoundError:
+                        pass
+
+    def get(self, key: str) -> Optional[StateEntry]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def age(self, key: str) -> Optional[float]:
+        entry = self.get(key)
+        if entry is None:
+            return None
+        return max(0.0, time.time() - entry.timestamp)
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = StateEntry(value, time.time())
+        self.save()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return
+        self.save()
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Any
+import urllib.parse
+
+from .collector import meter_path
+from .datastructures import capabilities_selector
+from .sampler import Sample
+from .tools.mixins import RunnableInterface
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 256
+
+class _Subscriber:
+    # one streaming client, filters and its own bounded queue of pending deltas
+    def __init__(self, filters: dict[str, set[str]], size: int):
+        self.filters = filters
+        self.queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+
+    def wants(self, meta: dict[str, Any]) -> bool:
+        for field, accepted in self.filters.items():
+            if str(meta.get(field)) not in accepted:
+                return False
+        return True
+
+    def offer(self, item: bytes) -> None:
+        # a slow client loses its oldest deltas, never holds up the others or the sampler
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped = self.dropped + 1
+        self.queue.put_nowait(item)
+
+class StreamServer(RunnableInterface):
+    # Sampler listener streaming change-only deltas over chunked HTTP, one JSON object per
+    # line. GET /stream takes name, measurement and channel filters, repeatable, e.g.
+    # /stream?name=BMP390&measurement=pressure. A new client first gets the latest values.
+    def __init__(self, tree, address: str = '127.0.0.1:8080',
+                 queue_size: int = DEFAULT_QUEUE_SIZE):
+        host, _, port = address.rpartition(':')
+        self._host = host or '127.0.0.1'
+        self._port = int(port)
+        self._tree = tree
+        self._queue_size = queue_size
+
+        self._meta = dict()
+        self._last = dict()
+        self._subscribers = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    @property
+    def port(self) -> int:
+        # the bound port, also when started on port 0
+        if self._server is not None:
+            return self._server.sockets[0].getsockname()[1]
+        return self._port
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def __call__(self, frame: dict[int, Sample]) -> None:
+        # on the sampling thread, the deltas are computed and encoded once on the loop thread
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._fanout, frame)
+
+    def run(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._serve, name='sensorkit-stream',
+                                        daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+        # the server could not listen, e.g. the port is taken
+        if self._error is not None:
+            error, self._error = self._error, None
+            self._thread.join()
+            self._thread = None
+            self._ready.clear()
+            raise error
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self._ready.clear()
+
+    def _serve(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                    asyncio.start_server(self._client, self._host, self._port))
+            logger.info('streaming readings on %s:%s', self._host, self.port)
+        except Exception as e:
+            self._error = e
+            self._loop.close()
+            self._loop = None
+            return
+        finally:
+            self._ready.set()
+
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+            self._server = None
+            self._loop = None
+            self._subscribers.clear()
+
+    def _describe(self, node_id: int) -> dict[str, Any] | None:
+        meta = self._meta.get(node_id)
+        if meta is None:
+            for node in self._tree.registry.nodes.where(node_id=node_id):
+                meter = node.obj
+                measurement = capabilities_selector('capability', id=meter.measurement)
+                device = getattr(meter, 'device', meter)
+                meta = {
+                    'path': meter_path(meter, node.bus),
+                    'name': meter.name,
+                    'measurement': measurement.field if measurement.found \
+                            else meter.measurement,
+                    'channel': device.channel_id if device.channel_id is not None else '-',
+                }
+                self._meta[node_id] = meta
+        return meta
+
+    def _encode(self, meta: dict[str, Any], sample: Sample) -> bytes:
+        line = json.dumps({ **meta, 'value': sample.value, 'timestamp': sample.timestamp,
+                            'status': sample.status }, separators=(',', ':')) + '\n'
+        data = line.encode()
+        return b'%x\r\n%s\r\n' % (len(data), data)
+
+    def _fanout(self, frame: dict[int, Sample]) -> None:
+        for node_id, sample in frame.items():
+            last = self._last.get(node_id)
+            self._last[node_id] = sample
+            if last is not None and last.value == sample.value and last.status == sample.status:
+                continue
+            if len(self._subscribers) == 0:
+                continue
+
+            meta = self._describe(node_id)
+            if meta is None:
+                continue
+            chunk = self._encode(meta, sample)
+            for subscriber in self._subscribers:
+                if subscriber.wants(meta):
+                    subscriber.offer(chunk)
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriber = None
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request.decode('latin-1').split()
+            url = urllib.parse.urlsplit(parts[1]) if len(parts) >= 2 else None
+            if url is None or parts[0] != 'GET' or url.path != '/stream':
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n'
+                             b'Connection: close\r\n\r\n')
+                await writer.drain()
+                return
+
+            query = urllib.parse.parse_qs(url.query)
+            filters = { field: set(query[field]) for field in ('name', 'measurement', 'channel')
+                        if field in query }
+            subscriber = _Subscriber(filters, self._queue_size)
+
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                         b'Transfer-Encoding: chunked\r\nCache-Control: no-cache\r\n\r\n')
+            for node_id, sample in list(self._last.items()):
+                meta = self._describe(node_id)
+                if meta is not None and subscriber.wants(meta):
+                    subscriber.offer(self._encode(meta, sample))
+            self._subscribers.add(subscriber)
+
+            while True:
+                writer.write(await subscriber.queue.get())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # client gone, or the server stopping
+            pass
+        finally:
+            if subscriber is not None:
+                self._subscribers.discard(subscriber)
+                if subscriber.dropped > 0:
+                    logger.info('stream client dropped %s deltas', subscriber.dropped)
+            writer.close()
@@ -0,0 +1,88 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# the RPi.GPIO names detectors use
+BCM = 11
+IN = 1
+OUT = 0
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+class SimulatedGPIO:
+    # Stand-in for RPi.GPIO off the Pi. Edges are injected with trigger() and callbacks run on
+    # a single callback thread, the way RPi.GPIO runs them.
+    BCM = BCM
+    IN = IN
+    OUT = OUT
+    PUD_OFF = PUD_OFF
+    PUD_DOWN = PUD_DOWN
+    PUD_UP = PUD_UP
+    RISING = RISING
+    FALLING = FALLING
+    BOTH = BOTH
+
+    def __init__(self):
+        self._pins = dict()
+        self._callbacks = dict()
+        self._edges = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def setmode(self, mode: int) -> None:
+        pass
+
+    def setup(self, pin: int, direction: int, pull_up_down: int = PUD_OFF) -> None:
+        self._pins[pin] = (direction, pull_up_down)
+
+    def add_event_detect(self, pin: int, edge: int, callback: callable = None,
+                         bouncetime: int | None = None) -> None:
+        if pin not in self._pins:
+            raise RuntimeError('pin {} has not been set up'.format(pin))
+        if pin in self._callbacks:
+            raise RuntimeError('conflicting edge detection on pin {}'.format(pin))
+
+        self._callbacks[pin] = callback
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='gpio-callbacks',
+                                                daemon=True)
+                self._thread.start()
+
+    def remove_event_detect(self, pin: int) -> None:
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self, pin: int | None = None) -> None:
+        if pin is None:
+            self._pins.clear()
+            self._callbacks.clear()
+            return
+        self._pins.pop(pin, None)
+        self._callbacks.pop(pin, None)
+
+    def trigger(self, pin: int, count: int = 1) -> None:
+        # queues count edges on pin, returns without waiting for the callbacks
+        for _ in range(count):
+            self._edges.put(pin)
+
+    def drain(self) -> None:
+        # waits until every triggered edge has been handed to its callback
+        self._edges.join()
+
+    def _run(self) -> None:
+        while True:
+            pin = self._edges.get()
+            try:
+                callback = self._callbacks.get(pin)
+                if callback is not None:
+                    callback(pin)
+            except Exception as e:
+                logger.warning('gpio callback on pin %s raised %s', pin, e)
+            finally:
+                self._edges.task_done()
@@ -0,0 +1,107 @@
+import http.client
+import logging
+import threading
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10.0
+
+class HttpError(Exception):
+    """Raised when a request fails before a response is read."""
+
+class Response:
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self._status = status
+        self._headers = headers
+        self._body = body
+
+    @property
+    def status(self) -> int:
+        return self._status
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return self._headers
+
+    def read(self) -> bytes:
+        return self._body
+
+class HttpClient:
+    # Keeps idle keep-alive connections per (scheme, host, port) and hands them out to one
+    # request at a time, every request is bounded by the timeout.
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, max_idle: int = 2):
+        self._timeout = timeout
+        self._max_idle = max_idle
+        self._idle = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self) -> float:
+        return self._timeout
+
+    def get(self, url: str, timeout: float | None = None) -> Response:
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = path + '?' + parts.query
+
+        # a pooled connection may have been closed by the server, retry once on a fresh one
+        for attempt in (0, 1):
+            conn, reused = self._checkout(key, timeout)
+            try:
+                conn.request('GET', path, headers={ 'Connection': 'keep-alive' })
+                resp = conn.getresponse()
+                body = resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                if reused and attempt == 0:
+                    logger.debug('pooled connection to %s failed, reconnecting: %s',
+                                 parts.hostname, e)
+                    continue
+                raise HttpError('GET {} failed: {}'.format(parts.hostname, e)) from e
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return Response(resp.status, dict(resp.getheaders()), body)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, dict()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _checkout(self, key, timeout: float | None):
+        with self._lock:
+            conns = self._idle.get(key)
+            conn = conns.pop() if conns else None
+        if conn is not None:
+            conn.timeout = self._timeout if timeout is None else timeout
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(conn.timeout)
+                return conn, True
+            except OSError:
+                # the socket is gone already, open a fresh connection instead
+                conn.close()
+
+        scheme, host, port = key
+        timeout = self._timeout if timeout is None else timeout
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=timeout), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def _checkin(self, key, conn) -> None:
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self._max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+# shared by every getter in the process
+default_client = HttpClient()
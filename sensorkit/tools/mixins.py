@@ -1,20 +1,33 @@
 import abc
 import logging
+import time
 from typing import Any
 import urllib.parse
-import urllib.request
 import uuid
 
+from .httpclient import HttpClient, HttpError, default_client
+
 logger = logging.getLogger(__name__)
 
 class NodeMixin():
+    __slots__ = ('_node_id', '_uuid')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._uuid = uuid.uuid4()
+        self._node_id = None
+        self._uuid = None
+
+    @property
+    def node_id(self) -> int | None:
+        # compact id assigned when the node is added to a tree, the key of every table row
+        return self._node_id
 
     @property
-    def uuid(self) -> uuid.UUID:
-        return str(self._uuid)
+    def uuid(self) -> str:
+        # stable external identifier, only generated when exported
+        if self._uuid is None:
+            self._uuid = str(uuid.uuid4())
+        return self._uuid
 
 class GetterMixin(metaclass=abc.ABCMeta):
     @classmethod
@@ -25,19 +38,55 @@ class GetterMixin(metaclass=abc.ABCMeta):
                 callable(subclass.location) or
                 NotImplemented)
 
-    def url_get(self, params: dict) -> None:
-        endpoint = self.location + urllib.parse.urlencode(params)
+    # backoff after failed fetches, doubling from the first to the max delay in seconds
+    BACKOFF_MIN = 30.0
+    BACKOFF_MAX = 3600.0
+
+    def __init__(self, *args, client: HttpClient | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client = client if client is not None else default_client
+        self._cached_until = 0.0
+        self._retry_at = 0.0
+        self._failures = 0
+
+    def url_get(self, params: dict, force: bool = False) -> None:
+        # Never raises, so a failing API cannot block the scheduler job. Fetches are skipped
+        # while the last response is still current, or while backing off after failures.
+        now = time.time()
+        if not force and (now < self._cached_until or now < self._retry_at):
+            return
+
+        endpoint = self.location + urllib.parse.urlencode(params, safe=',')
 
         logger.debug('calling api endpoint %s', endpoint)
-        contents = urllib.request.urlopen(endpoint)
-        self._handler(contents)
+        try:
+            contents = self._client.get(endpoint)
+            if contents.status != 200:
+                raise HttpError('status {}'.format(contents.status))
+            expires = self._handler(contents)
+        except Exception as e:
+            self._failures = self._failures + 1
+            delay = min(self.BACKOFF_MIN * 2 ** (self._failures - 1), self.BACKOFF_MAX)
+            self._retry_at = time.time() + delay
+            logger.warning('api %s failed (%s in a row), retrying in %ss: %s', self.location,
+                           self._failures, delay, e)
+            return
+
+        self._failures = 0
+        self._retry_at = 0.0
+        self._cached_until = expires if expires is not None else 0.0
+
+    @property
+    def failures(self) -> int:
+        return self._failures
 
     @abc.abstractmethod
     def location(self):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def _handler(self, state, contents):
+    def _handler(self, contents) -> float | None:
+        # returns the time until which the response stays current, None to not cache it
         raise NotImplementedError
 
 class SchedulableInterface(metaclass=abc.ABCMeta):
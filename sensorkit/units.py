@@ -0,0 +1,142 @@
+from collections.abc import Iterable, Mapping, Sequence
+from dataclasses import dataclass
+import functools
+import logging
+from typing import Any, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .datastructures import (
+        capabilities_selector,
+        units_selector,
+        unitsaliases_selector,
+)
+from .devices import DeviceCapabilityError
+from .sampler import Sample
+
+logger = logging.getLogger(__name__)
+
+def units_id(units: Optional[str]) -> Optional[str]:
+    # canonical id of a free form units string, None when it is not known
+    if units is None:
+        return None
+    field = unitsaliases_selector('units', alias=units.strip())
+    return field.field if field.found else None
+
+def meter_units(meter) -> Optional[str]:
+    # units id of what meter measures, None while unknown, e.g. before a virtual device fetched
+    try:
+        return units_id(meter.units)
+    except DeviceCapabilityError:
+        return None
+
+def canonical_units(capability: int | str) -> Optional[str]:
+    # units id every value of capability can be converted to, None for unitless capabilities
+    if isinstance(capability, str):
+        field = capabilities_selector('units', capability=capability)
+    else:
+        field = capabilities_selector('units', id=capability)
+    return (field.field or None) if field.found else None
+
+@dataclass(frozen=True)
+class Conversion:
+    # linear conversion, converted = value * scale + offset
+    scale: float
+    offset: float
+
+    @property
+    def identity(self) -> bool:
+        return self.scale == 1.0 and self.offset == 0.0
+
+    def __call__(self, value: Optional[float]) -> Optional[float]:
+        if value is None:
+            return None
+        return value * self.scale + self.offset
+
+    def many(self, values: Iterable[float]) -> Any:
+        # Converts a whole sequence with one scale and offset. With numpy any sequence is
+        # converted in one vectorised pass and a float ndarray is returned, without it the
+        # values are converted in a plain loop and a list is returned.
+        if numpy is not None:
+            if not isinstance(values, (numpy.ndarray, Sequence)):
+                values = list(values)
+            values = numpy.asarray(values, dtype=float)
+            return values if self.identity else values * self.scale + self.offset
+        if self.identity:
+            return [ float(v) for v in values ]
+        scale, offset = self.scale, self.offset
+        return [ v * scale + offset for v in values ]
+
+IDENTITY = Conversion(1.0, 0.0)
+
+@functools.lru_cache(maxsize=128)
+def conversion(from_units: str, to_units: str) -> Conversion:
+    # from_units and to_units are units ids or any alias of one, ValueError when they are
+    # unknown or measure different things
+    source = units_id(from_units) or from_units
+    target = units_id(to_units) or to_units
+    if source == target:
+        return IDENTITY
+
+    src = units_selector('dimension', units=source)
+    dst = units_selector('dimension', units=target)
+    if src.found is False or dst.found is False:
+        raise ValueError('unknown units {!r}'.format(from_units if src.found is False \
+                                                     else to_units))
+    if src.field != dst.field:
+        raise ValueError('cannot convert {} {} to {} {}'.format(src.field, source, dst.field,
+                                                                target))
+
+    # to the base units of the dimension, then out of them
+    src_scale = units_selector('scale', units=source).field
+    src_offset = units_selector('offset', units=source).field
+    dst_scale = units_selector('scale', units=target).field
+    dst_offset = units_selector('offset', units=target).field
+    return Conversion(src_scale / dst_scale, (src_offset - dst_offset) / dst_scale)
+
+def convert(values: Iterable[float] | float, from_units: str, to_units: str) -> Any:
+    # a single value, or a sequence converted in bulk, see Conversion.many
+    conv = conversion(from_units, to_units)
+    if isinstance(values, (int, float)):
+        return conv(values)
+    return conv.many(values)
+
+def convert_frame(frame: Mapping[int, Sample], registry,
+                  preferred: Mapping[str, str]) -> dict[int, Sample]:
+    # A sampler frame or snapshot with the values of every capability listed in preferred,
+    # capability -> units, converted. Samples are grouped by conversion so each group is
+    # converted in one pass, samples without a value or known units are passed through.
+    converted = dict(frame)
+    groups = dict()
+    for node_id, sample in frame.items():
+        if not isinstance(sample.value, (int, float)):
+            continue
+        meter = None
+        for node in registry.nodes.where(node_id=node_id):
+            meter = node.obj
+        if meter is None:
+            continue
+
+        capability = capabilities_selector('capability', id=meter.measurement)
+        if capability.found is False or capability.field not in preferred:
+            continue
+        source = meter_units(meter)
+        if source is None:
+            continue
+        try:
+            conv = conversion(source, preferred[capability.field])
+        except ValueError as e:
+            logger.debug('not converting %s: %s', node_id, e)
+            continue
+        if not conv.identity:
+            groups.setdefault(conv, []).append(node_id)
+
+    for conv, node_ids in groups.items():
+        values = conv.many([ frame[n].value for n in node_ids ])
+        for node_id, value in zip(node_ids, values):
+            sample = frame[node_id]
+            converted[node_id] = Sample(float(value), sample.timestamp, sample.status)
+    return converted
@@ -0,0 +1,229 @@
+import ast
+import logging
+import math
+import threading
+
+from ..constants import (
+        CELSIUS_UNITS,
+        GRAMS_PER_CUBIC_METER_UNITS,
+        HECTOPASCAL_UNITS,
+)
+from ..datastructures import capabilities_selector
+from ..sampler import Sample, SAMPLE_OK, SAMPLE_REJECTED
+from ..tools.mixins import NodeMixin
+from .virtual import Virtual
+
+logger = logging.getLogger(__name__)
+
+def dew_point(t: float, rh: float) -> float:
+    # Magnus formula, t in C, rh in %
+    g = math.log(rh / 100.0) + 17.62 * t / (243.12 + t)
+    return 243.12 * g / (17.62 - g)
+
+def absolute_humidity(t: float, rh: float) -> float:
+    # g/m3, t in C, rh in %
+    return 6.112 * math.exp(17.67 * t / (t + 243.5)) * rh * 2.1674 / (273.15 + t)
+
+def msl_pressure(p: float, altitude: float, t: float = 15.0) -> float:
+    # station pressure reduced to sea level, hPa, altitude in m, t in C
+    return p * (1.0 - 0.0065 * altitude / (t + 0.0065 * altitude + 273.15)) ** -5.257
+
+FUNCTIONS = {
+    'dew_point': dew_point,
+    'absolute_humidity': absolute_humidity,
+    'msl_pressure': msl_pressure,
+    'abs': abs,
+    'min': min,
+    'max': max,
+    'round': round,
+    'exp': math.exp,
+    'log': math.log,
+    'sqrt': math.sqrt,
+}
+
+DEFAULT_UNITS = {
+    'dew_point': CELSIUS_UNITS,
+    'absolute_humidity': GRAMS_PER_CUBIC_METER_UNITS,
+    'pressure_msl': HECTOPASCAL_UNITS,
+}
+
+_ALLOWED = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant,
+            ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv, ast.USub,
+            ast.UAdd, ast.IfExp, ast.Compare, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+def compile_expression(expression: str, inputs: set[str]):
+    # only arithmetic, comparisons, the listed functions and the declared inputs are accepted
+    tree = ast.parse(expression, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED):
+            raise ValueError('{!r}: {} not allowed'.format(expression, type(node).__name__))
+        if isinstance(node, ast.Call) and \
+                not (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS):
+            raise ValueError('{!r}: unknown function'.format(expression))
+        if isinstance(node, ast.Name) and node.id not in inputs and node.id not in FUNCTIONS:
+            raise ValueError('{!r}: unknown input {!r}'.format(expression, node.id))
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError('{!r}: only numeric constants are allowed'.format(expression))
+    return compile(tree, '<derived>', 'eval')
+
+class _DerivedMeter(NodeMixin, Virtual):
+    def __init__(self, name: str, capability: str, expression: str, inputs: set[str],
+                 units: str | None):
+        super().__init__(name, capability)
+        self._expression = expression
+        self._code = compile_expression(expression, inputs)
+        self._names = set(n.id for n in ast.walk(ast.parse(expression, mode='eval'))
+                          if isinstance(n, ast.Name) and n.id in inputs)
+        self._units = units
+        self._value = None
+
+    @property
+    def measure(self) -> float | None:
+        return self._value
+
+    @property
+    def measurement(self) -> int:
+        return self._measurement
+
+    @property
+    def units(self) -> str | None:
+        return self._units
+
+    @property
+    def expression(self) -> str:
+        return self._expression
+
+    @property
+    def names(self) -> set[str]:
+        return self._names
+
+    def evaluate(self, values: dict[str, float]) -> None:
+        if any(values.get(n) is None for n in self._names):
+            self._value = None
+            return
+        try:
+            self._value = eval(self._code, { '__builtins__': {}, **FUNCTIONS }, values)
+        except (ArithmeticError, ValueError) as e:
+            logger.debug('derived %s:%s failed, %s', self._name, self._capability, e)
+            self._value = None
+
+class _DerivedInputs:
+    # Sampler input feeding the derived meters of one virtual device. Inputs are taken from
+    # the sampled frames, never read from the bus, and a meter is recomputed only when one of
+    # its inputs changed.
+    def __init__(self, registry, sampler, inputs: dict[str, dict[str, str]]):
+        self._registry = registry
+        self._sampler = sampler
+        self._inputs = inputs
+        self._nodes = dict()
+        self._values = dict()
+        self._meters = list()
+        self._listening = False
+        self._lock = threading.Lock()
+
+    def add(self, meter: _DerivedMeter) -> None:
+        self._meters.append(meter)
+
+    def resolve(self) -> None:
+        # input name -> node id of the source meter, a real device or a virtual device. Run
+        # again whenever nodes came or went, an input whose source vanished reads None.
+        nodes = dict()
+        for name, source in self._inputs.items():
+            field = capabilities_selector('id', capability=source['measurement'])
+            if field.found is False:
+                raise ValueError('input {}: unsupported measurement {!r}'.format(
+                    name, source['measurement']))
+
+            if 'meter' in source:
+                found = self._find_meters(str(source['meter']).upper(), field.field)
+            else:
+                found = [ r.node_id for r in self._registry.join_virtuals().where(
+                            name=source['virtual'], measurement=field.field) ]
+            if len(found) == 0:
+                logger.warning('derived input %s: no source %s', name, source)
+                continue
+            nodes[found[0]] = name
+
+        with self._lock:
+            previous = { name: node_id for node_id, name in self._nodes.items() }
+            current = { name: node_id for node_id, name in nodes.items() }
+            lost = set(name for name, node_id in previous.items()
+                       if current.get(name) != node_id)
+            self._nodes = nodes
+            for name in lost:
+                self._values.pop(name, None)
+            for meter in self._meters:
+                if not lost.isdisjoint(meter.names):
+                    meter.evaluate(self._values)
+
+        if not self._listening:
+            self._sampler.add_input(self)
+            self._listening = True
+
+        # start from what has been sampled already
+        latest = self._sampler.latest()
+        self({ nid: latest[nid] for nid in nodes if nid in latest })
+
+    def retire(self) -> None:
+        self._sampler.remove_input(self)
+        self._listening = False
+
+    def _find_meters(self, device_name: str, measurement: int) -> list[int]:
+        # node ids of the meters of every device named device_name measuring measurement
+        found = list()
+        for device in self._registry.join_devices().where(name=device_name):
+            for link in self._registry.links.where(parent=device.node_id):
+                for node in self._registry.nodes.where(node_id=link.node):
+                    if getattr(node.obj, 'measurement', None) == measurement:
+                        found.append(node.node_id)
+        return found
+
+    def __call__(self, frame: dict[int, Sample]) -> None:
+        with self._lock:
+            changed = set()
+            for node_id, name in self._nodes.items():
+                sample = frame.get(node_id)
+                if sample is None or sample.status == SAMPLE_REJECTED:
+                    continue
+                value = sample.value if sample.status == SAMPLE_OK else None
+                if self._values.get(name) != value:
+                    self._values[name] = value
+                    changed.add(name)
+
+            if len(changed) == 0:
+                return
+            for meter in self._meters:
+                if not changed.isdisjoint(meter.names):
+                    meter.evaluate(self._values)
+
+class DerivedBuilder:
+    def __init__(self, name: str, capabilities: list[str]):
+        self._name = name
+        self._caps = capabilities
+
+    def __call__(self, inputs: dict[str, dict[str, str]], expressions: dict[str, str],
+                 sampler, registry, units: dict[str, str] | None = None,
+                 **_ignored) -> list[_DerivedMeter]:
+        # inputs: name -> { meter: SHT41 | virtual: <name>, measurement: temperature }
+        # expressions: capability -> expression over the input names, e.g.
+        # dew_point: dew_point(t, rh)
+        units = units or {}
+        for name, source in inputs.items():
+            if ('meter' in source) == ('virtual' in source) or 'measurement' not in source:
+                raise ValueError('input {} needs measurement and one of meter or virtual'.format(
+                    name))
+
+        feed = _DerivedInputs(registry, sampler, inputs)
+        devs = []
+        for cap in self._caps:
+            if cap not in expressions:
+                raise ValueError('need expression for capability {}'.format(cap))
+            obj = _DerivedMeter(self._name, cap, expressions[cap], set(inputs),
+                                units.get(cap, DEFAULT_UNITS.get(cap)))
+            obj.resolve = feed.resolve
+            obj.retire = feed.retire
+            feed.add(obj)
+            devs.append(obj)
+
+        # inputs are resolved by the kit once every virtual device is in the tree
+        return devs
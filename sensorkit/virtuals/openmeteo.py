@@ -1,6 +1,10 @@
 import abc
+import bisect
+from datetime import datetime, timezone
 import json
 import logging
+import time
+from types import MappingProxyType
 from typing import Any
 
 from isodate import parse_duration
@@ -13,9 +17,6 @@ from ..constants import (
         TEMPERATURE,
         RELATIVE_HUMIDITY,
 )
-from ..datastructures import (UniqueRecordFieldByWhere,
-                              capabilities_selector,
-)
 from ..meters import MeterInterface
 from ..tools.mixins import (
         GetterMixin,
@@ -34,7 +35,9 @@ id,capability,open_meteo_capability
 open_meteo = db.Table('open_meteo')
 open_meteo.csv_import(open_meteo_data, transforms={"id": int})
 
-fields = UniqueRecordFieldByWhere(open_meteo)
+# sensorkit capability -> open meteo variable, capabilities not listed keep their own name
+open_meteo_names = MappingProxyType({ rec.capability: rec.open_meteo_capability
+                                      for rec in open_meteo })
 
 class _OpenMeteoInterface(metaclass=abc.ABCMeta):
     @classmethod
@@ -48,35 +51,37 @@ class _OpenMeteoInterface(metaclass=abc.ABCMeta):
         raise NotImplementedError
 
 class _OpenMeteoCurrentGetterImpl(GetterMixin, SchedulableInterface):
-    def __new__(cls, *args, **kwargs):
-        if not hasattr(cls, '_instance'):
-            cls._instance = super(_OpenMeteoCurrentGetterImpl, cls).__new__(cls)
-        return cls._instance
-    
-    def __init__(self, capabilities: list[str], interval: str, params: dict[str, int | str],
-                 scheduler):
+    # Fetches the current values of every location and variable registered with it in one
+    # request, the API takes comma separated coordinates and answers with one result per
+    # location, in order.
+    _section = 'current'
+
+    def __init__(self, interval: str, params: dict[str, int | str], scheduler):
+        super().__init__()
         self._location = 'https://api.open-meteo.com/v1/forecast?'
         self._handlers = {}
 
-        self._interval = parse_duration(interval).seconds
-        self._params = params
-        self._capabilities = capabilities
+        self._interval = parse_duration(interval).total_seconds()
+        self._params = { k: v for k, v in params.items() if k not in ('latitude', 'longitude') }
         self._scheduler = scheduler
         self._job = None
 
-        param = [ c if not fields('open_meteo_capability', capability=c).found else \
-                fields('open_meteo_capability', capability=c).field for c in capabilities ]
-        self._params['current'] = ','.join(param)
+        self._locations = []
+        self._index = {}
+        self._names = {}
 
     def schedule(self, immediate: bool) -> None:
-        if self._job is not None:
-            return
-
+        # a getter is shared, later builders only need the fetch when they added a location or
+        # variable, otherwise the cached response covers them
         if immediate:
             self.url_get(self._params)
 
+        if self._job is not None:
+            return
+
         self._job = self._scheduler.add_job(self.url_get, 'interval', seconds=self._interval,
-                                            kwargs = { 'params': self._params })
+                                            kwargs = { 'params': self._params },
+                                            max_instances=1, coalesce=True)
 
     def unschedule(self) -> None:
         if self._job is None:
@@ -85,44 +90,135 @@ class _OpenMeteoCurrentGetterImpl(GetterMixin, SchedulableInterface):
         self._job.remove()
         self._job = None
 
-    def set_handler(self, capability: str, handler: callable) -> None:
-        if capability not in self._capabilities:
-            logger.warning('open meteo impl: requested unset cap: %s', capability)
-            return
+    def set_handler(self, location: tuple[float, float], capability: str,
+                    handler: callable) -> None:
+        self._handlers[handler] = (location, capability)
+        self._rebuild()
 
-        self._handlers[capability] = handler
+    def remove_handler(self, handler: callable) -> None:
+        self._handlers.pop(handler, None)
+        if len(self._handlers) == 0:
+            self.unschedule()
+            _release_getter(self)
+            return
+        self._rebuild()
 
     @property
     def location(self) -> str:
         return self._location
 
-    def _handler(self, contents) -> None:
-        if contents.status != 200:
-            logger.warning('open meteo impl: API failed GET - %s', contents.status)
+    @property
+    def locations(self) -> list[tuple[float, float]]:
+        return list(self._locations)
+
+    def _rebuild(self) -> None:
+        locations = list(dict.fromkeys(loc for loc, _ in self._handlers.values()))
+        names = { c: open_meteo_names.get(c, c) for _, c in self._handlers.values() }
+        if locations == self._locations and names.keys() == self._names.keys():
             return
 
-        data = contents.read()
-        obj = json.loads(data)
+        # resolved here, the handler runs on every update
+        self._locations = locations
+        self._index = { loc: i for i, loc in enumerate(locations) }
+        self._names = names
+        self._params['latitude'] = ','.join(str(lat) for lat, _ in locations)
+        self._params['longitude'] = ','.join(str(lon) for _, lon in locations)
+        self._params[self._section] = ','.join(sorted(set(names.values())))
 
-        current_values = obj['current']
-        current_units = obj['current_units']
+        # the cached response lacks the new location or variable
+        self._cached_until = 0.0
 
-        for c in self._handlers:
-            func = self._handlers[c]
-            om_cap = fields('open_meteo_capability', capability=c)
-            v = current_values[c] if not om_cap.found else current_values[om_cap.field]
-            u = current_units[c] if not om_cap.found  else current_units[om_cap.field]
-            func(c, v, u)
+    def _handler(self, contents) -> float | None:
+        data = contents.read()
+        obj = json.loads(data)
+        results = obj if isinstance(obj, list) else [ obj ]
+        if len(results) != len(self._locations):
+            raise ValueError('expected {} locations, got {}'.format(len(self._locations),
+                                                                   len(results)))
+        return self._dispatch(results)
+
+    def _dispatch(self, results: list[dict[str, Any]]) -> float | None:
+        observed = [ _observed_at(r['current'], r.get('utc_offset_seconds', 0))
+                     for r in results ]
+        for func, (loc, c) in list(self._handlers.items()):
+            i = self._index[loc]
+            name = self._names[c]
+            func(c, results[i]['current'][name], results[i]['current_units'][name], observed[i])
+
+        # current values only change with the next model update, skip fetches until then
+        interval = results[0]['current'].get('interval')
+        if observed[0] is None or interval is None:
+            return None
+        expires = min(o for o in observed if o is not None) + interval
+        return expires if expires > time.time() else None
+
+class _OpenMeteoHourlyGetterImpl(_OpenMeteoCurrentGetterImpl):
+    # Fetches the hourly forecast series, meant to run every few hours. Times are requested as
+    # unix time so the meters can interpolate without parsing.
+    _section = 'hourly'
+
+    def __init__(self, interval: str, params: dict[str, int | str], scheduler):
+        super().__init__(interval, params, scheduler)
+        self._params['timeformat'] = 'unixtime'
+
+    def _dispatch(self, results: list[dict[str, Any]]) -> float | None:
+        fetched = time.time()
+        for func, (loc, c) in list(self._handlers.items()):
+            result = results[self._index[loc]]
+            name = self._names[c]
+            func(c, result['hourly']['time'], result['hourly'][name],
+                 result['hourly_units'][name], fetched)
+
+        # the series covers the hours until the next scheduled fetch
+        return None
+
+# getters shared by virtual devices that can be fetched together, keyed by the scheduler, the
+# interval and every parameter besides the coordinates
+_getters = {}
+
+def _getter_key(cls: type, interval: str, params: dict[str, int | str], scheduler) -> tuple:
+    rest = tuple(sorted((k, str(v)) for k, v in params.items()
+                        if k not in ('latitude', 'longitude', cls._section)))
+    return (cls, id(scheduler), parse_duration(interval).total_seconds(), rest)
+
+def _shared_getter(cls: type, interval: str, params: dict[str, int | str],
+                   scheduler) -> _OpenMeteoCurrentGetterImpl:
+    key = _getter_key(cls, interval, params, scheduler)
+    getter = _getters.get(key)
+    if getter is None:
+        getter = cls(interval, params, scheduler)
+        _getters[key] = getter
+    return getter
+
+def _release_getter(getter: _OpenMeteoCurrentGetterImpl) -> None:
+    for key, value in list(_getters.items()):
+        if value is getter:
+            del _getters[key]
+
+def _observed_at(values: dict[str, Any], utc_offset: int) -> float | None:
+    # 'time' is unix time with timeformat=unixtime, otherwise ISO local to the requested timezone
+    stamp = values.get('time')
+    if stamp is None:
+        return None
+    if isinstance(stamp, (int, float)):
+        return float(stamp)
+    local = datetime.fromisoformat(stamp).replace(tzinfo=timezone.utc)
+    return local.timestamp() - utc_offset
 
 class _OpenMeteoCurrent(NodeMixin, Virtual, _OpenMeteoInterface):
     def __init__(self, name: str, capability: str, interval: str,
-                 params: dict[str, int | str], scheduler):
+                 params: dict[str, int | str], scheduler,
+                 getter: _OpenMeteoCurrentGetterImpl | None = None):
         super().__init__(name, capability)
-        self._measure = 0.0
+        # None until the first successful fetch, consumers skip it rather than use a made up 0
+        self._measure = None
         self._units = None
+        self._observed = None
+        self._getter = getter
+        self._coordinates = (float(params['latitude']), float(params['longitude']))
 
     @property
-    def measure(self) -> float:
+    def measure(self) -> float | None:
         return self._measure
 
     @property
@@ -133,7 +229,19 @@ class _OpenMeteoCurrent(NodeMixin, Virtual, _OpenMeteoInterface):
     def units(self) -> str:
         return self._units
 
-    def _handler(self, capability: str, value: float | int, units: str) -> None:
+    @property
+    def coordinates(self) -> tuple[float, float]:
+        return self._coordinates
+
+    @property
+    def age(self) -> float | None:
+        # seconds since the model produced the served value, it is kept when fetches fail
+        if self._observed is None:
+            return None
+        return time.time() - self._observed
+
+    def _handler(self, capability: str, value: float | int, units: str,
+                 observed: float | None = None) -> None:
         logger.debug('open_meteo_handler called with %s %s %s',
                      capability, value, units)
 
@@ -144,6 +252,12 @@ class _OpenMeteoCurrent(NodeMixin, Virtual, _OpenMeteoInterface):
 
         self._measure = value
         self._units = units
+        self._observed = observed if observed is not None else time.time()
+
+    def retire(self) -> None:
+        if self._getter is not None:
+            self._getter.remove_handler(self._handler)
+            self._getter = None
 
 class OpenMeteoCurrentBuilder:
     def __init__(self, name: str, capabilities: list[str]):
@@ -155,12 +269,100 @@ class OpenMeteoCurrentBuilder:
         # the builder knows what this is, put your smarts here when building other layered
         # virtual devices
 
-        getter_impl = _OpenMeteoCurrentGetterImpl(self._caps, interval, params, scheduler)
+        # virtual devices fetched on the same schedule share one getter, and one request
+        getter_impl = _shared_getter(_OpenMeteoCurrentGetterImpl, interval, params, scheduler)
+
+        devs = []
+        for cap in self._caps:
+            obj = _OpenMeteoCurrent(self._name, cap, interval, params, scheduler, getter_impl)
+            getter_impl.set_handler(obj.coordinates, cap, obj._handler)
+            devs.append(obj)
+
+        getter_impl.schedule(True)
+
+        return devs
+
+class _OpenMeteoHourly(NodeMixin, Virtual, _OpenMeteoInterface):
+    def __init__(self, name: str, capability: str, params: dict[str, int | str],
+                 getter: _OpenMeteoHourlyGetterImpl | None = None):
+        super().__init__(name, capability)
+        self._series = ([], [])
+        self._units = None
+        self._fetched = None
+        self._getter = getter
+        self._coordinates = (float(params['latitude']), float(params['longitude']))
+
+    @property
+    def measure(self) -> float | None:
+        # linear interpolation between the hours around now, clamped to the ends of the series
+        times, values = self._series
+        if len(times) == 0:
+            return None
+
+        now = time.time()
+        i = bisect.bisect_right(times, now)
+        if i == 0:
+            return values[0]
+        if i == len(times):
+            return values[-1]
+
+        t0, t1 = times[i - 1], times[i]
+        v0, v1 = values[i - 1], values[i]
+        if v0 is None or v1 is None:
+            return v0 if v1 is None else v1
+        return v0 + (v1 - v0) * (now - t0) / (t1 - t0)
+
+    @property
+    def measurement(self) -> int:
+        return self._measurement
+
+    @property
+    def units(self) -> str:
+        return self._units
+
+    @property
+    def coordinates(self) -> tuple[float, float]:
+        return self._coordinates
+
+    @property
+    def age(self) -> float | None:
+        # seconds since the series was fetched, it is kept when fetches fail
+        if self._fetched is None:
+            return None
+        return time.time() - self._fetched
+
+    def _handler(self, capability: str, times: list[int], values: list[float | None],
+                 units: str, fetched: float) -> None:
+        if capability != self._capability:
+            msg = 'open meteo hourly - called with mismatch capability: got %s != wanted %s'
+            logger.warning(msg, capability, self._capability)
+            return
+
+        # replaced as one tuple, measure may run on another thread
+        self._series = ([ float(t) for t in times ], list(values))
+        self._units = units
+        self._fetched = fetched
+
+    def retire(self) -> None:
+        if self._getter is not None:
+            self._getter.remove_handler(self._handler)
+            self._getter = None
+
+class OpenMeteoHourlyBuilder:
+    def __init__(self, name: str, capabilities: list[str]):
+        self._name = name
+        self._caps = capabilities
+
+    def __call__(self, interval: str, params: dict[str, int | str], scheduler,
+                 **_ignored) -> list[_OpenMeteoHourly]:
+        # the forecast is fetched every interval, e.g. PT3H, and measured by interpolating the
+        # series to the current time, params may set forecast_days and past_days
+        getter_impl = _shared_getter(_OpenMeteoHourlyGetterImpl, interval, params, scheduler)
 
         devs = []
         for cap in self._caps:
-            obj = _OpenMeteoCurrent(self._name, cap, interval, params, scheduler)
-            getter_impl.set_handler(cap, obj._handler)
+            obj = _OpenMeteoHourly(self._name, cap, params, getter_impl)
+            getter_impl.set_handler(obj.coordinates, cap, obj._handler)
             devs.append(obj)
 
         getter_impl.schedule(True)
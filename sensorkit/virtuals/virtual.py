@@ -31,3 +31,13 @@ class Virtual(MeterInterface):
     @property
     def channel_id(self) -> [ int | None ]:
         return None
+
+    def resolve(self) -> None:
+        # called once every virtual device is in the tree and again after each rescan or
+        # reload, look up the nodes a virtual device is derived from here
+        pass
+
+    def retire(self) -> None:
+        # called when the virtual device is removed from a running kit, release anything
+        # shared with other virtual devices here
+        pass
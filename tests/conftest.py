@@ -0,0 +1,80 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+import pytest
+
+from sensorkit import constants, devices
+from sensorkit.tools.mixins import NodeMixin
+
+class FakeBus:
+    # root bus answering a scan with addrs, set addrs to make devices come and go
+    def __init__(self, addrs):
+        self.addrs = list(addrs)
+
+    def scan(self):
+        return list(self.addrs)
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+class FakeBmp390(NodeMixin, devices.Device):
+    def __init__(self, bus, name, device_id, address, env=None):
+        super().__init__(bus, name, device_id, [ constants.TEMPERATURE, constants.PRESSURE ],
+                         address)
+        self._dev = self
+        self.temperature = 20.0
+        self.pressure = 1013.0
+        self._property_map[constants.TEMPERATURE] = 'temperature'
+        self._capability_units[constants.TEMPERATURE] = constants.CELSIUS_UNITS
+        self._property_map[constants.PRESSURE] = 'pressure'
+        self._capability_units[constants.PRESSURE] = constants.HECTOPASCAL_UNITS
+
+    @property
+    def real_device(self):
+        return self._dev
+
+class FakeSht41(NodeMixin, devices.Device):
+    def __init__(self, bus, name, device_id, address, env=None):
+        super().__init__(bus, name, device_id,
+                         [ constants.RELATIVE_HUMIDITY, constants.TEMPERATURE ], address)
+        self._dev = self
+        self.temperature = 21.0
+        self.relative_humidity = 40.0
+        self._property_map[constants.RELATIVE_HUMIDITY] = 'relative_humidity'
+        self._capability_units[constants.RELATIVE_HUMIDITY] = \
+                constants.PERC_RELATIVE_HUMIDITY_UNITS
+        self._property_map[constants.TEMPERATURE] = 'temperature'
+        self._capability_units[constants.TEMPERATURE] = constants.CELSIUS_UNITS
+
+    @property
+    def real_device(self):
+        return self._dev
+
+class FakeScd41(NodeMixin, devices.Device):
+    def __init__(self, bus, name, device_id, address, env=None):
+        super().__init__(bus, name, device_id, [ constants.CO2 ], address)
+        self._dev = self
+        self.CO2 = 420
+        self.ambient_pressures = []
+        self._property_map[constants.CO2] = 'CO2'
+        self._capability_units[constants.CO2] = constants.PPM_UNITS
+
+    @property
+    def real_device(self):
+        return self._dev
+
+    def set_ambient_pressure(self, value):
+        self.ambient_pressures.append(value)
+
+@pytest.fixture
+def fake_devices(monkeypatch):
+    # the kit builds these in place of the drivers, which need real hardware
+    for device_id, ctor in ((constants.BMP390, FakeBmp390), (constants.SHT41, FakeSht41),
+                            (constants.SCD41, FakeScd41)):
+        monkeypatch.setitem(devices.device_factory._ctors, device_id, ctor)
+
+@pytest.fixture
+def scheduler():
+    # never started, jobs stay pending and tests run them by hand
+    return BackgroundScheduler()
@@ -0,0 +1,68 @@
+import time
+
+from sensorkit import SensorKit
+from sensorkit.state import StateEntry
+
+from conftest import FakeBus
+
+def _config(state_path):
+    return {
+        'state': { 'path': str(state_path) },
+        'calibrations': {
+            'scd41': [ {
+                'measurement': 'pressure',
+                'target': { 'method': 'set_ambient_pressure', 'where': 'real' },
+                'source': { 'meter': 'bmp390' },
+                'policy': { 'aggregation': 'average', 'type': 'int', 'interval': 'PT1M',
+                            'deadband': 1, 'min_interval': 'PT15M' },
+            } ],
+        },
+    }
+
+def _device(kit, name):
+    return [ d.obj for d in kit.tree.registry.join_devices().where(name=name) ][0]
+
+def test_stale_restore_refreshed_inside_min_interval(fake_devices, scheduler, tmp_path):
+    kit = SensorKit(FakeBus([0x62, 0x77]), _config(tmp_path / 'state.json'), scheduler)
+    _, (cal,) = kit._calibrations[0]
+    kit._state._entries[cal._state_key] = StateEntry(900, time.time() - 3600)
+
+    cal.schedule(False)
+    cal.calibrate()
+
+    # the saved value is restored, then refreshed from the source right away
+    assert _device(kit, 'SCD41').ambient_pressures == [900, 1013]
+    assert cal.writes == 1
+    assert kit._state.get(cal._state_key).value == 1013
+
+def test_write_inside_min_interval_skipped(fake_devices, scheduler, tmp_path):
+    kit = SensorKit(FakeBus([0x62, 0x77]), _config(tmp_path / 'state.json'), scheduler)
+    _, (cal,) = kit._calibrations[0]
+
+    cal.calibrate()
+    _device(kit, 'BMP390').pressure = 1020.0
+    cal.calibrate()
+
+    assert _device(kit, 'SCD41').ambient_pressures == [1013]
+    assert cal.skipped == 1
+
+def test_rescan_restores_calibration_with_its_source(fake_devices, scheduler, tmp_path):
+    bus = FakeBus([0x62, 0x77])
+    kit = SensorKit(bus, _config(tmp_path / 'state.json'), scheduler)
+
+    # the source device goes away, the plan is kept without a calibration
+    bus.addrs = [0x62]
+    kit.rescan()
+    assert [ (plan.device_name, objs) for plan, objs in kit._calibrations ] == [('SCD41', [])]
+
+    # and comes back, the calibration is rebuilt against the new source
+    bus.addrs = [0x62, 0x77]
+    kit.rescan()
+    (plan, (cal,)), = kit._calibrations
+    assert [ s.node_id for s in cal.sources ] == \
+            [ m.node_id for m in kit.tree.children(_device(kit, 'BMP390'))
+              if m.measurement == plan.measurement ]
+    assert cal in kit._listeners
+
+    cal.calibrate()
+    assert _device(kit, 'SCD41').ambient_pressures == [1013]
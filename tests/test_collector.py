@@ -0,0 +1,66 @@
+import socket
+import threading
+import time
+
+from sensorkit import SensorKit
+from sensorkit.collector import (
+        Collector,
+        CollectorClient,
+        MSG_HELLO,
+        _CollectorHandler,
+        _message,
+)
+from sensorkit.sampler import Sample, SAMPLE_ERROR
+
+from conftest import FakeBus
+
+class _Server:
+    # what the handler needs of its socketserver
+    def __init__(self, collector):
+        self.collector = collector
+
+def _round_trip(kit, frames):
+    collector = Collector('127.0.0.1:0')
+    ours, theirs = socket.socketpair()
+    handler = threading.Thread(target=_CollectorHandler,
+                               args=(theirs, None, _Server(collector)))
+    handler.start()
+
+    client = CollectorClient('node-1', 'unused', kit.tree)
+    client._sock = ours
+    ours.sendall(_message(MSG_HELLO, b'node-1'))
+    for frame in frames:
+        client(frame)
+        assert client.flush()
+    client._disconnect()
+    handler.join(5)
+    theirs.close()
+    return client, collector
+
+def test_round_trip(fake_devices, scheduler):
+    kit = SensorKit([ FakeBus([0x77]), FakeBus([0x77]) ], {}, scheduler)
+    frame = kit.sampler.sample()
+    now = time.time()
+    failed = { node_id: Sample(None, now, SAMPLE_ERROR) for node_id in frame }
+
+    client, collector = _round_trip(kit, [ frame, failed ])
+
+    latest = collector.latest()
+    # identical devices on two buses are two series
+    assert sorted(latest) == [ ('node-1', 'bus0/BMP390@0x77/pressure'),
+                               ('node-1', 'bus0/BMP390@0x77/temperature'),
+                               ('node-1', 'bus1/BMP390@0x77/pressure'),
+                               ('node-1', 'bus1/BMP390@0x77/temperature') ]
+    assert all(s.value is None and s.status == SAMPLE_ERROR for s in latest.values())
+    assert collector.received == 8
+    assert client.sent == 8 and client.dropped == 0
+
+def test_values_survive_the_wire(fake_devices, scheduler):
+    kit = SensorKit(FakeBus([0x77]), {}, scheduler)
+    frame = kit.sampler.sample()
+
+    _, collector = _round_trip(kit, [ frame ])
+
+    latest = collector.latest()
+    assert latest[('node-1', 'bus0/BMP390@0x77/pressure')].value == 1013.0
+    assert latest[('node-1', 'bus0/BMP390@0x77/temperature')].value == 20.0
@@ -0,0 +1,78 @@
+import pytest
+
+from sensorkit import SensorKit
+from sensorkit.virtuals.derived import compile_expression, dew_point
+
+from conftest import FakeBus
+
+def _derived(inputs, expressions):
+    return { 'type': 'meter', 'module': '.virtuals.derived', 'builder': 'DerivedBuilder',
+             'capabilities': list(expressions),
+             'args': { 'inputs': inputs, 'expressions': expressions } }
+
+CONFIG = { 'virtual-devices': {
+    # declared before the virtual device it reads from
+    'outer': _derived({ 't': { 'virtual': 'inner', 'measurement': 'dew_point' } },
+                      { 'dew_point': 't + 1' }),
+    'inner': _derived({ 't': { 'meter': 'sht41', 'measurement': 'temperature' },
+                        'rh': { 'meter': 'SHT41', 'measurement': 'relative_humidity' } },
+                      { 'dew_point': 'dew_point(t, rh)' }),
+} }
+
+def _meter(kit, name):
+    (meter,) = kit._virtuals[name][1]
+    return meter
+
+def _sht41(kit):
+    return [ d.obj for d in kit.tree.registry.join_devices().where(name='SHT41') ][0]
+
+def test_derived_value_belongs_to_its_frame(fake_devices, scheduler):
+    kit = SensorKit(FakeBus([0x44]), CONFIG, scheduler)
+    inner = _meter(kit, 'inner')
+
+    _sht41(kit).temperature = 25.0
+    frame = kit.sampler.sample()
+
+    assert frame[inner.node_id].value == pytest.approx(dew_point(25.0, 40.0))
+
+def test_sources_resolved_in_any_order(fake_devices, scheduler):
+    kit = SensorKit(FakeBus([0x44]), CONFIG, scheduler)
+    kit.sampler.sample()
+    kit.sampler.sample()
+
+    assert _meter(kit, 'outer').measure == pytest.approx(dew_point(21.0, 40.0) + 1)
+
+def test_sources_resolved_again_on_rescan(fake_devices, scheduler):
+    bus = FakeBus([0x44])
+    kit = SensorKit(bus, CONFIG, scheduler)
+    inner = _meter(kit, 'inner')
+    kit.sampler.sample()
+    assert inner.measure is not None
+
+    bus.addrs = []
+    kit.rescan()
+    assert inner.measure is None
+
+    bus.addrs = [0x44]
+    kit.rescan()
+    kit.sampler.sample()
+    assert inner.measure == pytest.approx(dew_point(21.0, 40.0))
+
+@pytest.mark.parametrize('expression', [
+    't.real',
+    't.__class__',
+    '__import__("os")',
+    'open("x")',
+    '(lambda: 1)()',
+    '[t for t in (1,)]',
+    'x + 1',
+    '"a"',
+])
+def test_expression_whitelist_rejects(expression):
+    with pytest.raises(ValueError):
+        compile_expression(expression, { 't' })
+
+def test_expression_whitelist_accepts():
+    code = compile_expression('round(dew_point(t, 50), 1) if t > -40 else -t', { 't' })
+    assert eval(code, { '__builtins__': {}, 'round': round, 'dew_point': dew_point },
+                { 't': 20.0 }) == round(dew_point(20.0, 50), 1)
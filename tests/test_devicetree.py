@@ -0,0 +1,38 @@
+from sensorkit import SensorKit
+
+from conftest import FakeBus
+
+class BusyBus(FakeBus):
+    # the lock is refused a few times before it is granted
+    def __init__(self, addrs, busy):
+        super().__init__(addrs)
+        self.busy = busy
+        self.locked = False
+        self.unlocks = 0
+
+    def try_lock(self):
+        if self.busy > 0:
+            self.busy = self.busy - 1
+            return False
+        self.locked = True
+        return True
+
+    def scan(self):
+        assert self.locked
+        return super().scan()
+
+    def unlock(self):
+        assert self.locked
+        self.locked = False
+        self.unlocks = self.unlocks + 1
+
+def test_scan_waits_for_the_bus_lock(fake_devices, scheduler):
+    bus = BusyBus([0x77], busy=3)
+    kit = SensorKit(bus, {}, scheduler)
+    assert [ d.name for d in kit.tree.registry.join_devices() ] == ['BMP390']
+
+    bus.busy = 2
+    bus.addrs = [0x44, 0x77]
+    kit.rescan()
+    assert sorted(d.name for d in kit.tree.registry.join_devices()) == ['BMP390', 'SHT41']
+    assert not bus.locked
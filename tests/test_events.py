@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from sensorkit import constants
+from sensorkit.detectors import Detector
+from sensorkit.events import EventDispatcher
+from sensorkit.tools.gpio import SimulatedGPIO
+
+from conftest import FakeBmp390
+
+class Handler:
+    # on_detection that records channels, and blocks while held
+    def __init__(self, hold: bool = False):
+        self.channels = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def __call__(self, detector, channel):
+        self.started.set()
+        self.release.wait(5)
+        self.channels.append(channel)
+
+def _detector(handler, dispatcher, **options):
+    device = FakeBmp390(None, 'TSL2591', constants.TSL2591, 0x29)
+    gpio = SimulatedGPIO()
+    return Detector(device, 17, gpio.PUD_UP, gpio.FALLING, handler, dispatcher=dispatcher,
+                    gpio=gpio, **options)
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = EventDispatcher(workers=1, maxsize=1)
+    yield dispatcher
+    dispatcher.stop()
+
+def test_edges_inside_debounce_ignored(dispatcher):
+    handler = Handler()
+    detector = _detector(handler, dispatcher, debounce=60.0)
+
+    for channel in (1, 2, 3):
+        detector(channel)
+    dispatcher.stop()
+
+    assert handler.channels == [1]
+    assert detector.stats == (1, 2, 0, 0)
+
+def test_edges_coalesced_while_queued(dispatcher):
+    handler = Handler(hold=True)
+    detector = _detector(handler, dispatcher, coalesce=True)
+
+    detector(1)
+    assert handler.started.wait(5)
+    # the first event is being handled, the second queued, the third coalesced into it
+    detector(2)
+    detector(3)
+    handler.release.set()
+    dispatcher.stop()
+
+    assert handler.channels == [1, 2]
+    assert detector.stats == (2, 0, 1, 0)
+
+def test_edges_dropped_when_queue_full(dispatcher):
+    handler = Handler(hold=True)
+    detector = _detector(handler, dispatcher)
+
+    detector(1)
+    assert handler.started.wait(5)
+    detector(2)
+    detector(3)
+    handler.release.set()
+    dispatcher.stop()
+
+    assert handler.channels == [1, 2]
+    assert detector.stats == (2, 0, 0, 1)
+
+def test_failing_handler_keeps_worker():
+    channels = []
+    def handler(detector, channel):
+        channels.append(channel)
+        if channel == 1:
+            raise RuntimeError('handler failed')
+
+    dispatcher = EventDispatcher(workers=1, maxsize=4)
+    detector = _detector(handler, dispatcher)
+    detector(1)
+    detector(2)
+    dispatcher.stop()
+
+    assert channels == [1, 2]
@@ -0,0 +1,36 @@
+from sensorkit import constants
+from sensorkit.config import FilterPlan
+from sensorkit.filters import REJECT_OUTLIER, REJECT_RANGE, REJECT_RATE, MeterFilter
+
+def _filter(window=5, max_rate=None, low=-40.0, high=85.0):
+    plan = FilterPlan('BMP390', constants.TEMPERATURE, window, 3.0, 0.1, max_rate, low, high,
+                      False)
+    return MeterFilter(plan, low, high)
+
+def _feed(meter_filter, values, start=0.0):
+    return [ meter_filter(v, start + i) for i, v in enumerate(values) ]
+
+def test_range_reject_kept_out_of_window():
+    meter_filter = _filter()
+    assert _feed(meter_filter, [20.0, 20.1, 20.0, 20.1, 20.0]) == [None] * 5
+
+    # a glitch out of range must not shift the median or widen the spread
+    assert _feed(meter_filter, [999.0, 20.1], start=5.0) == [REJECT_RANGE, None]
+    assert 999.0 not in meter_filter._sorted
+    assert meter_filter.rejected[REJECT_RANGE] == 1
+
+def test_rate_reject_kept_out_of_window():
+    meter_filter = _filter(max_rate=1.0)
+    _feed(meter_filter, [20.0, 20.1, 20.0])
+
+    assert _feed(meter_filter, [30.0, 20.1], start=3.0) == [REJECT_RATE, None]
+    assert 30.0 not in meter_filter._sorted
+
+def test_sustained_step_accepted():
+    meter_filter = _filter()
+    _feed(meter_filter, [20.0, 20.1, 20.0, 20.1, 20.0])
+
+    # outlier rejects stay in the window until the step holds its majority
+    reasons = _feed(meter_filter, [25.0, 25.0, 25.0, 25.0], start=5.0)
+    assert reasons[0] == REJECT_OUTLIER
+    assert reasons[-1] is None
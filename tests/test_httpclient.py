@@ -0,0 +1,158 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+
+from sensorkit.tools.httpclient import HttpClient, HttpError
+from sensorkit.virtuals.openmeteo import _OpenMeteoCurrentGetterImpl
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections = self.server.connections + 1
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        status, body = self.server.reply(self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # drops the connection after answering without telling the client, like an idle timeout
+        self.close_connection = self.server.drop
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    httpd.daemon_threads = True
+    httpd.connections = 0
+    httpd.requests = []
+    httpd.drop = False
+    httpd.reply = lambda path: (200, b'{}')
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+def _url(server, path='/'):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+def _current(interval: int = 900, observed: float | None = None) -> bytes:
+    # an Open-Meteo current response for one location, observed now unless told otherwise
+    observed = time.time() if observed is None else observed
+    stamp = time.strftime('%Y-%m-%dT%H:%M', time.gmtime(observed))
+    return json.dumps({
+        'utc_offset_seconds': 0,
+        'current': { 'time': stamp, 'interval': interval, 'temperature_2m': 21.5 },
+        'current_units': { 'time': 'iso8601', 'interval': 'seconds', 'temperature_2m': '°C' },
+    }).encode()
+
+def _getter(server, handler):
+    getter = _OpenMeteoCurrentGetterImpl('PT15M', {}, None)
+    getter._location = _url(server, '/v1/forecast?')
+    getter._client = HttpClient(timeout=2.0)
+    getter.set_handler((52.52, 13.41), 'temperature', handler)
+    return getter
+
+def test_connection_reused(server):
+    client = HttpClient(timeout=2.0)
+    try:
+        first = client.get(_url(server, '/a'))
+        second = client.get(_url(server, '/b'))
+    finally:
+        client.close()
+
+    assert first.status == 200 and second.status == 200
+    assert server.requests == ['/a', '/b']
+    assert server.connections == 1
+
+def test_reconnects_when_pooled_connection_closed(server):
+    server.drop = True
+    client = HttpClient(timeout=2.0)
+    try:
+        client.get(_url(server, '/a'))
+        # the server dropped the pooled connection, the client retries on a fresh one
+        response = client.get(_url(server, '/b'))
+    finally:
+        client.close()
+
+    assert response.status == 200
+    assert server.requests == ['/a', '/b']
+    assert server.connections == 2
+
+def test_refused_connection_raises():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    port = httpd.server_address[1]
+    httpd.server_close()
+
+    with pytest.raises(HttpError):
+        HttpClient(timeout=2.0).get('http://127.0.0.1:{}/'.format(port))
+
+def test_cached_response_skips_fetch(server):
+    server.reply = lambda path: (200, _current())
+    values = []
+    getter = _getter(server, lambda *args: values.append(args[1]))
+
+    getter.url_get(getter._params)
+    getter.url_get(getter._params)
+
+    assert len(server.requests) == 1
+    assert values == [21.5]
+    assert getter.failures == 0
+
+def test_expired_response_fetched_again(server):
+    # observed longer than one interval ago, the response is not cached
+    server.reply = lambda path: (200, _current(interval=900, observed=time.time() - 3600))
+    getter = _getter(server, lambda *args: None)
+
+    getter.url_get(getter._params)
+    getter.url_get(getter._params)
+
+    assert len(server.requests) == 2
+
+def test_backoff_after_error(server):
+    server.reply = lambda path: (500, b'{}')
+    getter = _getter(server, lambda *args: None)
+
+    getter.url_get(getter._params)
+    assert getter.failures == 1
+    assert getter._retry_at >= time.time() + getter.BACKOFF_MIN - 1.0
+
+    # still backing off, no request is made
+    getter.url_get(getter._params)
+    assert len(server.requests) == 1
+
+    # the backoff doubles with every failure in a row
+    getter.url_get(getter._params, force=True)
+    assert getter.failures == 2
+    assert getter._retry_at >= time.time() + 2 * getter.BACKOFF_MIN - 1.0
+
+    # success resets it
+    server.reply = lambda path: (200, _current())
+    getter.url_get(getter._params, force=True)
+    assert getter.failures == 0
+    assert len(server.requests) == 3
+
+def test_reconnects_when_pooled_socket_closed(server):
+    client = HttpClient(timeout=2.0)
+    try:
+        client.get(_url(server, '/a'))
+        for conns in client._idle.values():
+            for conn in conns:
+                conn.sock.close()
+        response = client.get(_url(server, '/b'))
+    finally:
+        client.close()
+
+    assert response.status == 200
+    assert server.requests == ['/a', '/b']
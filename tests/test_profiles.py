@@ -0,0 +1,47 @@
+import pytest
+
+from sensorkit import profiles
+
+class RegisterBus:
+    # one device per address answering a one byte read with its register, mask is the bits
+    # of a written byte it keeps, None for a device that NAKs bare reads
+    def __init__(self, devices):
+        self.devices = devices
+        self.registers = { address: 0 for address in devices }
+        self.writes = []
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def writeto(self, address, buf):
+        self.writes.append((address, bytes(buf)))
+        mask = self.devices[address]
+        if mask is None:
+            raise OSError(121, 'Remote I/O error')
+        self.registers[address] = buf[0] & mask
+
+    def readfrom_into(self, address, buf):
+        buf[0] = self.registers[address]
+
+@pytest.mark.parametrize('mask, name', [ (0xff, 'TCA9548A'), (0x0f, 'PCA9546A') ])
+def test_mux_identified_by_its_control_register(mask, name):
+    bus = RegisterBus({ 0x70: mask })
+    record = profiles.discover(bus, 0x70)
+    assert record.found and record.record.name == name
+    # every channel deselected afterwards
+    assert bus.registers[0x70] == 0
+
+@pytest.mark.parametrize('mask', [ None, 0x00, 0x60 ])
+def test_non_mux_at_mux_address_unsupported(mask):
+    # e.g. a BME280 strapped to 0x76, or a display driver at 0x70
+    bus = RegisterBus({ 0x76: mask })
+    assert profiles.discover(bus, 0x76).found is False
+
+def test_meter_found_without_probe():
+    bus = RegisterBus({ 0x44: None })
+    record = profiles.discover(bus, 0x44)
+    assert record.found and record.record.name == 'SHT41'
+    assert bus.writes == []
@@ -0,0 +1,19 @@
+import logging
+
+from sensorkit import SensorKit
+
+from conftest import FakeBus
+
+def test_restart_only_changes_logged(fake_devices, scheduler, caplog):
+    kit = SensorKit(FakeBus([0x77]), { 'sampler': { 'interval': 'PT10S' } }, scheduler)
+
+    with caplog.at_level(logging.WARNING, logger='sensorkit.sensorkit'):
+        kit.reload({ 'sampler': { 'interval': 'PT5S' },
+                     'stream': { 'address': '127.0.0.1:0' },
+                     'presence-check': 'PT30S' })
+
+    messages = [ r.getMessage() for r in caplog.records ]
+    for section in ('sampler interval', 'stream', 'presence-check'):
+        assert 'reload: {} changes are not applied, restart to apply them'.format(section) \
+                in messages
+    assert not any('collector' in m or 'health' in m for m in messages)
@@ -0,0 +1,21 @@
+from sensorkit import SensorKit
+
+from conftest import FakeBus
+
+ADAPTIVE = { 'sampler': { 'interval': 'PT1S',
+                          'adaptive': { 'temperature': { 'max': 'PT10S', 'deadband': 0.1 } } } }
+
+def test_rescan_forgets_removed_meters(fake_devices, scheduler):
+    bus = FakeBus([0x44, 0x77])
+    kit = SensorKit(bus, ADAPTIVE, scheduler)
+    kit.sampler.sample()
+    assert len(kit.sampler.latest()) == 4
+    assert len(kit.sampler.intervals) == 2
+
+    bus.addrs = [0x44]
+    kit.rescan()
+
+    kept = set(m.node_id for meters in kit.tree.meters_by_bus().values() for m in meters)
+    assert set(kit.sampler.latest()) == kept
+    assert set(kit.sampler.intervals) <= kept
+    assert len(kit.sampler.intervals) == 1
@@ -0,0 +1,69 @@
+import threading
+
+from sensorkit import SensorKit
+from sensorkit.sampler import Sample, SAMPLE_OK
+from sensorkit.shm import LatestValuesReader
+
+from conftest import FakeBus
+
+def _kit(buses, path, scheduler):
+    return SensorKit(buses, { 'sampler': { 'shared-memory': str(path) } }, scheduler)
+
+def test_identical_devices_on_two_buses(fake_devices, scheduler, tmp_path):
+    kit = _kit([ FakeBus([0x44]), FakeBus([0x44]) ], tmp_path / 'latest', scheduler)
+    devices = sorted(kit.tree.registry.join_devices(), key=lambda d: d.node_id)
+    devices[0].obj.temperature = 10.0
+    devices[1].obj.temperature = 30.0
+    kit.sampler.sample()
+
+    reader = LatestValuesReader(str(tmp_path / 'latest'))
+    assert sorted(reader.names()) == [ 'bus0:-:SHT41:0x44:relative_humidity',
+                                       'bus0:-:SHT41:0x44:temperature',
+                                       'bus1:-:SHT41:0x44:relative_humidity',
+                                       'bus1:-:SHT41:0x44:temperature' ]
+    assert reader.read('bus0:-:SHT41:0x44:temperature').value == 10.0
+    assert reader.read('bus1:-:SHT41:0x44:temperature').value == 30.0
+    kit.release()
+
+def test_slot_kept_across_rescan(fake_devices, scheduler, tmp_path):
+    bus = FakeBus([0x77])
+    kit = _kit(bus, tmp_path / 'latest', scheduler)
+    kit.sampler.sample()
+    reader = LatestValuesReader(str(tmp_path / 'latest'))
+    before = reader._load_index()
+
+    for _ in range(3):
+        bus.addrs = []
+        kit.rescan()
+        bus.addrs = [0x77]
+        kit.rescan()
+        kit.sampler.sample()
+
+    assert reader._load_index() == before
+    assert reader.read('bus0:-:BMP390:0x77:pressure').value == 1013.0
+    kit.release()
+
+def test_reader_never_sees_a_torn_slot(fake_devices, scheduler, tmp_path):
+    kit = _kit(FakeBus([0x44]), tmp_path / 'latest', scheduler)
+    writer = kit._latest_values
+    node_ids = sorted(m.node_id for meters in kit.tree.meters_by_bus().values() for m in meters)
+    reader = LatestValuesReader(str(tmp_path / 'latest'))
+
+    done = threading.Event()
+    def write():
+        # value and timestamp always match within a frame
+        for i in range(20000):
+            writer({ node_id: Sample(float(i), float(i), SAMPLE_OK) for node_id in node_ids })
+        done.set()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    reads = 0
+    while not done.is_set() or reads == 0:
+        for sample in reader.read_all().values():
+            assert sample.value == sample.timestamp
+            reads = reads + 1
+    thread.join()
+
+    assert all(s.value == 19999.0 for s in reader.read_all().values())
+    kit.release()
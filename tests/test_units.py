@@ -0,0 +1,52 @@
+import pytest
+
+from sensorkit import constants, units
+from sensorkit.units import IDENTITY, conversion
+
+def test_same_units_is_identity():
+    assert conversion('C', constants.CELSIUS_UNITS) is IDENTITY
+    assert IDENTITY.identity
+
+def test_conversion_through_aliases():
+    to_fahrenheit = conversion('C', 'F')
+    assert to_fahrenheit(100.0) == pytest.approx(212.0)
+    assert to_fahrenheit(None) is None
+    assert conversion('F', 'C')(212.0) == pytest.approx(100.0)
+    assert conversion(constants.HECTOPASCAL_UNITS, 'inHg')(1013.25) \
+            == pytest.approx(29.92, abs=0.01)
+
+@pytest.mark.parametrize('source, target', [
+    ('furlong', 'm'),
+    ('C', 'furlong'),
+    ('C', 'hPa'),
+])
+def test_conversion_rejects(source, target):
+    with pytest.raises(ValueError):
+        conversion(source, target)
+
+def test_many_without_numpy(monkeypatch):
+    monkeypatch.setattr(units, 'numpy', None)
+    to_fahrenheit = conversion('C', 'F')
+
+    assert to_fahrenheit.many((0.0, 100.0)) == pytest.approx([32.0, 212.0])
+    assert to_fahrenheit.many(v for v in (0.0, 100.0)) == pytest.approx([32.0, 212.0])
+    assert IDENTITY.many([1, 2]) == [1.0, 2.0]
+    assert isinstance(to_fahrenheit.many([0.0]), list)
+
+def test_many_with_numpy():
+    numpy = pytest.importorskip('numpy')
+    to_fahrenheit = conversion('C', 'F')
+
+    # any sequence is converted in one pass, not only arrays
+    for values in ([0.0, 100.0], (0, 100), (v for v in (0.0, 100.0)),
+                   numpy.array([0.0, 100.0])):
+        converted = to_fahrenheit.many(values)
+        assert isinstance(converted, numpy.ndarray)
+        assert converted.dtype == float
+        assert converted.tolist() == pytest.approx([32.0, 212.0])
+    assert IDENTITY.many([1, 2]).tolist() == [1.0, 2.0]
+
+def test_convert_single_and_many(monkeypatch):
+    monkeypatch.setattr(units, 'numpy', None)
+    assert units.convert(0.0, 'C', 'F') == pytest.approx(32.0)
+    assert units.convert([0.0], 'C', 'F') == pytest.approx([32.0])